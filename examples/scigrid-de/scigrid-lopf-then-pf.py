@@ -167,14 +167,19 @@ print("Performing linear OPF for one day, {} snapshots at a time:".format(group_
 
 network.storage_units.state_of_charge_initial = 0.
 
-for i in range(int(24/group_size)):
-    #set the initial state of charge based on previous round
-    if i>0:
-        network.storage_units.state_of_charge_initial = network.storage_units_t.state_of_charge.loc[network.snapshots[group_size*i-1]]
-    network.lopf(network.snapshots[group_size*i:group_size*i+group_size],
-                 solver_name=solver_name,
-                 keep_files=True)
-    network.lines.s_nom = network.lines.s_nom_opt
+#the state of charge at the end of each group is the initial state of
+#charge of the next one
+#
+#if lines are extended (see above), each group optimises them
+#separately and s_nom_opt is that of the last group; unlike optimising
+#the groups in a loop with network.lines.s_nom = network.lines.s_nom_opt
+#after each one, the extensions of a group do not carry over to the
+#following groups
+network.lopf(network.snapshots[:24],
+             solver_name=solver_name,
+             keep_files=True,
+             horizon=group_size)
+network.lines.s_nom = network.lines.s_nom_opt
 
 #if lines are extended, look at which ones are bigger
 #network.lines[["s_nom_original","s_nom"]][abs(network.lines.s_nom - contingency_factor*network.lines.s_nom_original) > 1]
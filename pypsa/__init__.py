@@ -26,7 +26,7 @@ Grid calculation library.
 from __future__ import absolute_import
 
 from . import components
-from . import pf, opf, plot, networkclustering, io, contingency, geo
+from . import pf, pfsolvers, opf, linopf, plot, networkclustering, io, contingency, geo
 
 from .components import Network, SubNetwork
 
@@ -53,15 +53,18 @@ from .io import (export_to_csv_folder, import_from_csv_folder,
                  import_from_pypower_ppc, import_components_from_dataframe,
                  import_series_from_dataframe, import_from_pandapower_net)
 
-from .pf import (network_lpf, sub_network_lpf, network_pf,
-                 sub_network_pf, find_bus_controls, find_slack_bus, calculate_Y,
-                 calculate_PTDF, calculate_B_H, calculate_dependent_values)
+from .pf import (network_lpf, sub_network_lpf, network_batch_lpf, network_pf,
+                 sub_network_pf, find_bus_controls, find_bus_ordering, find_slack_bus, calculate_Y,
+                 calculate_PTDF, calculate_B_H, calculate_dependent_values,
+                 update_branches, pf_convergence_summary, compile_lpf)
+
+from .pfsolvers import MatrixCache
 
 from .contingency import (calculate_BODF, network_lpf_contingency,
                           network_sclopf)
 
 
-from .opf import network_lopf, network_opf
+from .opf import network_lopf, network_opf, network_build_lopf
 
 from .plot import plot
 
@@ -170,10 +173,16 @@ class Network(Basic):
 
     lpf = network_lpf
 
+    batch_lpf = network_batch_lpf
+
     pf = network_pf
 
+    pf_convergence_summary = pf_convergence_summary
+
     lopf = network_lopf
 
+    build_lopf = network_build_lopf
+
     opf = network_opf
 
     plot = plot
@@ -200,6 +209,13 @@ class Network(Basic):
         #corresponds to number of hours represented by each snapshot
         self.snapshot_weightings = pd.Series(index=self.snapshots,data=1.)
 
+        #matrices of the sub-networks and their factorisations, which
+        #survive determine_network_topology
+        self.matrix_cache = MatrixCache()
+
+        #convergence of the last non-linear power flow
+        self.pf_convergence = None
+
         components = pd.read_csv(os.path.join(dir_name,
                                               "components.csv"),
                                  index_col=0)
@@ -525,25 +541,25 @@ class Network(Basic):
         n_components, labels = sp.sparse.csgraph.connected_components(adjacency_matrix, directed=False)
 
         # remove all old sub_networks
-        for sub_network in self.sub_networks.index:
-            obj = self.sub_networks.at[sub_network,"obj"]
-            self.remove("SubNetwork", sub_network)
-            del obj
+        self.sub_networks.drop(self.sub_networks.index, inplace=True)
+        for df in itervalues(self.pnl("SubNetwork")):
+            df.drop(df.columns, axis=1, inplace=True)
 
-        for i in np.arange(n_components):
-            # index of first bus
-            buses_i = (labels == i).nonzero()[0]
-            carrier = self.buses.carrier.iat[buses_i[0]]
+        # carrier of the first bus of each sub-network
+        carriers = self.buses.carrier.values[np.unique(labels, return_index=True)[1]]
+        n_buses = np.bincount(labels, minlength=n_components)
 
-            if carrier not in ["AC","DC"] and len(buses_i) > 1:
-                logger.warning("Warning, sub network {} is not electric but contains multiple buses\n"
-                                "and branches. Passive flows are not allowed for non-electric networks!".format(i))
+        for i in ((carriers != "AC") & (carriers != "DC") & (n_buses > 1)).nonzero()[0]:
+            logger.warning("Warning, sub network {} is not electric but contains multiple buses\n"
+                           "and branches. Passive flows are not allowed for non-electric networks!".format(i))
 
-            if (self.buses.carrier.iloc[buses_i] != carrier).any():
-                logger.warning("Warning, sub network {} contains buses with mixed carriers! Value counts:\n{}".format(i),
-                                self.buses.carrier.iloc[buses_i].value_counts())
+        for i in np.unique(labels[self.buses.carrier.values != carriers[labels]]):
+            logger.warning("Warning, sub network {} contains buses with mixed carriers! Value counts:\n{}"
+                           .format(i, self.buses.carrier.iloc[(labels == i).nonzero()[0]].value_counts()))
 
-            self.add("SubNetwork", i, carrier=carrier)
+        self.import_components_from_dataframe(pd.DataFrame({"carrier" : carriers},
+                                                           index=np.arange(n_components)),
+                                              "SubNetwork")
 
         #add objects
         self.sub_networks["obj"] = [SubNetwork(self, name) for name in self.sub_networks.index]
@@ -699,10 +715,14 @@ class SubNetwork(Common):
 
     lpf = sub_network_lpf
 
+    compile_lpf = compile_lpf
+
     pf = sub_network_pf
 
     find_bus_controls = find_bus_controls
 
+    find_bus_ordering = find_bus_ordering
+
     find_slack_bus = find_slack_bus
 
     calculate_Y = calculate_Y
@@ -711,6 +731,8 @@ class SubNetwork(Common):
 
     calculate_B_H = calculate_B_H
 
+    update_branches = update_branches
+
     calculate_BODF = calculate_BODF
 
     graph = graph
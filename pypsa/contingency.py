@@ -38,6 +38,7 @@ import pandas as pd
 import collections
 
 from .pf import calculate_PTDF
+from .pfsolvers import _from_cache, _to_cache
 
 from .opt import l_constraint
 
@@ -69,6 +70,9 @@ def calculate_BODF(sub_network, skip_pre=False):
     if not skip_pre:
         calculate_PTDF(sub_network)
 
+    if _from_cache(sub_network, "BODF"):
+        return
+
     num_branches = sub_network.PTDF.shape[0]
 
     #build LxL version of PTDF
@@ -81,6 +85,8 @@ def calculate_BODF(sub_network, skip_pre=False):
     #make sure the flow on the branch itself is zero
     np.fill_diagonal(sub_network.BODF,-1)
 
+    _to_cache(sub_network, "BODF", ["BODF"])
+
 
 def network_lpf_contingency(network, snapshots=None, branch_outages=None):
     """
@@ -0,0 +1,1350 @@
+
+
+## Copyright 2015-2017 Tom Brown (FIAS), Jonas Hoersch (FIAS), David
+## Schlachtberger (FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Linear optimal power flow assembled directly as sparse matrices,
+without building a pyomo model.
+"""
+
+
+# make the code as Python 3 compatible as possible
+from __future__ import division, absolute_import
+from six import iteritems
+
+
+__author__ = "Tom Brown (FIAS), Jonas Hoersch (FIAS), David Schlachtberger (FIAS)"
+__copyright__ = "Copyright 2015-2017 Tom Brown (FIAS), Jonas Hoersch (FIAS), David Schlachtberger (FIAS), GNU GPL 3"
+
+import pandas as pd
+import numpy as np
+from numpy import newaxis
+from scipy.sparse import coo_matrix, csr_matrix, csc_matrix, identity
+from collections import OrderedDict
+import os
+import json
+import shutil
+import tempfile
+import subprocess
+import scipy
+from distutils.version import StrictVersion, LooseVersion
+try:
+    _scipy_version = StrictVersion(scipy.__version__)
+except ValueError:
+    _scipy_version = LooseVersion(scipy.__version__)
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+from .pf import (find_bus_controls, calculate_B_H, calculate_PTDF, find_tree,
+                 find_cycles)
+from .descriptors import get_switchable_as_dense
+
+
+
+class _LinearProblemBase(object):
+    """
+    Families of variables and constraints, objective and solution of a
+    linear optimisation problem, which LinearProblem and LPFileProblem
+    share; they differ in where the bounds and the constraints go,
+    which _add_bounds and _add_block receive.
+    """
+
+    def __init__(self):
+        self.variables = OrderedDict()
+        self.constraints = OrderedDict()
+        self.n_variables = 0
+        self.n_constraints = 0
+        self.constant = 0.
+        self._objective = []
+        self.x = None
+        self.y = None
+        self.objective = None
+
+    def __repr__(self):
+        return "{} with {} variables and {} constraints".format(type(self).__name__, self.n_variables, self.n_constraints)
+
+    @staticmethod
+    def _shape(index, snapshots):
+        if index is None:
+            return ()
+        return (len(index),) if snapshots is None else (len(snapshots), len(index))
+
+    def add_variables(self, name, index, snapshots=None, lower=-np.inf, upper=np.inf):
+        """
+        Add a family of variables.
+
+        Parameters
+        ----------
+        name : string
+        index : list-like
+            Components (or other labels) of the variables.
+        snapshots : list-like, default None
+            Snapshots of the variables, if they are time-dependent.
+        lower, upper : float|numpy.ndarray
+            Bounds, broadcastable to the shape of the family.
+
+        Returns
+        -------
+        positions : numpy.ndarray
+            Integer positions of the variables, of shape (snapshots,
+            index) or (index,).
+        """
+
+        shape = self._shape(index, snapshots)
+        positions = self.n_variables + np.arange(int(np.prod(shape))).reshape(shape)
+        self._add_bounds(positions.ravel(),
+                         np.broadcast_to(np.asarray(lower, dtype=float), shape).ravel(),
+                         np.broadcast_to(np.asarray(upper, dtype=float), shape).ravel())
+        self.n_variables += positions.size
+        self.variables[name] = (index, snapshots, positions)
+        return positions
+
+    def add_constraints(self, name, index, snapshots, terms, sense, rhs):
+        """
+        Add a family of constraints sum(terms) sense rhs.
+
+        Parameters
+        ----------
+        name : string
+        index : list-like|None
+            Components (or other labels) of the constraints; None for a
+            single constraint.
+        snapshots : list-like|None
+            Snapshots of the constraints, if they are time-dependent.
+        terms : list
+            Pairs (coefficients, variables) of arrays which are
+            broadcastable to the shape of the family, giving one term
+            for each constraint, or triples (coefficients, variables,
+            rows), where the rows are flat positions within the family
+            and the three arrays are broadcastable to each other, for
+            sums with several terms per constraint. Terms with a zero
+            coefficient are dropped.
+        sense : string
+            One of "<=", "==" or ">=".
+        rhs : float|numpy.ndarray
+            Right-hand side, broadcastable to the shape of the family.
+
+        Returns
+        -------
+        rows : numpy.ndarray
+            Integer rows of the constraints in A, of shape (snapshots,
+            index), (index,) or ().
+        """
+
+        if sense not in ("<=", "==", ">="):
+            raise KeyError('`sense` must be one of "==","<=",">="; got: {}'.format(sense))
+
+        shape = self._shape(index, snapshots)
+        size = int(np.prod(shape))
+        local = np.arange(size).reshape(shape)
+
+        rows, columns, coefficients = self._terms_as_block(terms, local)
+        self._add_block(self.n_constraints + rows, columns, coefficients,
+                        sense, np.broadcast_to(np.asarray(rhs, dtype=float), shape).ravel())
+        self.constraints[name] = (index, snapshots, self.n_constraints + local)
+        self.n_constraints += size
+        return self.n_constraints - size + local
+
+    @staticmethod
+    def _terms_as_block(terms, local):
+        rows, columns, coefficients = [np.zeros(0, dtype=int)], [np.zeros(0, dtype=int)], [np.zeros(0)]
+        for term in terms:
+            coefficient, variables = term[:2]
+            term_rows = term[2] if len(term) == 3 else local
+            coefficient, variables, term_rows = np.broadcast_arrays(np.asarray(coefficient, dtype=float),
+                                                                    variables, term_rows)
+            nonzero = coefficient != 0.
+            rows.append(term_rows[nonzero])
+            columns.append(variables[nonzero])
+            coefficients.append(coefficient[nonzero])
+        return (np.concatenate(rows).astype(int), np.concatenate(columns).astype(int),
+                np.concatenate(coefficients))
+
+    def add_objective(self, coefficients, variables):
+        """Add sum(coefficients*variables) to the objective, for
+        arrays which are broadcastable to each other."""
+
+        coefficients, variables = np.broadcast_arrays(np.asarray(coefficients, dtype=float), variables)
+        self._objective.append((variables.ravel(), coefficients.ravel()))
+
+    def set_objective(self, coefficients, variables):
+        """Replace the objective coefficients of the variables, for
+        arrays which are broadcastable to each other."""
+
+        coefficients, variables = np.broadcast_arrays(np.asarray(coefficients, dtype=float), variables)
+        c = self.c
+        c[variables.ravel()] = coefficients.ravel()
+        self._objective = [(np.arange(self.n_variables), c)]
+
+    @property
+    def c(self):
+        c = np.zeros(self.n_variables)
+        for variables, coefficients in self._objective:
+            np.add.at(c, variables, coefficients)
+        return c
+
+    def set_solution(self, x, y=None):
+        """Store the values x of the variables and the duals y of the
+        constraints (with the sign convention of d objective / d b)."""
+
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.full(self.n_constraints, np.nan) if y is None else np.asarray(y, dtype=float)
+        self.objective = self.c.dot(self.x) + self.constant
+
+    @staticmethod
+    def _series(values, index, snapshots):
+        #values (snapshots x index) as a Series indexed by tuples
+        #(*index, snapshot), like the values of pyomo variables
+        if index is None:
+            return values[()]
+        if snapshots is None:
+            return pd.Series(values, index=index)
+        index = pd.Index(index) if not isinstance(index, pd.Index) else index
+        if isinstance(index, pd.MultiIndex):
+            levels = [index.get_level_values(i) for i in range(index.nlevels)]
+        else:
+            levels = [index]
+        arrays = ([np.repeat(np.asarray(level), len(snapshots)) for level in levels]
+                  + [np.tile(np.asarray(snapshots), len(index))])
+        return pd.Series(values.T.ravel(), index=pd.MultiIndex.from_arrays(arrays))
+
+    def values(self, name):
+        """Values of the family of variables name as a pandas.Series
+        indexed like the values of the pyomo variables."""
+
+        index, snapshots, positions = self.variables[name]
+        return self._series(self.x[positions], index, snapshots)
+
+    def duals(self, name):
+        """Duals of the family of constraints name as a pandas.Series
+        indexed like the pyomo constraints (or a float for a single
+        constraint)."""
+
+        index, snapshots, rows = self.constraints[name]
+        return self._series(self.y[rows], index, snapshots)
+
+
+class LinearProblem(_LinearProblemBase):
+    """
+    Linear optimisation problem in matrix form
+
+        min  c x + constant
+        s.t. A x (<=, ==, >=) b,  lower <= x <= upper
+
+    which is assembled from numpy arrays instead of one Python object
+    per variable and constraint.
+
+    Variables and constraints are added in named families (e.g. the
+    dispatch of all generators in all snapshots), which are indexed by
+    components and optionally snapshots. Each family gets a contiguous
+    range of integer positions, returned as an array of shape
+    (snapshots, components) or (components,), so that the constraints
+    can be built with numpy broadcasting. The coefficients of A are
+    kept as one COO block per constraint family; repeated entries for
+    the same variable are summed up.
+
+    Attributes
+    ----------
+    variables : OrderedDict
+        Index, snapshots and positions of each family of variables.
+    constraints : OrderedDict
+        Index, snapshots and rows of each family of constraints.
+    blocks : list
+        COO blocks (rows, columns, coefficients) of A.
+    x, y : numpy.ndarray
+        Values of the variables and duals of the constraints (NaN if
+        the solver did not return them), once solved.
+    objective : float
+        Value of the objective, once solved.
+    """
+
+    def __init__(self):
+        super(LinearProblem, self).__init__()
+        self.blocks = []
+        self._lower = []
+        self._upper = []
+        self._sense = []
+        self._rhs = []
+
+    def _add_bounds(self, positions, lower, upper):
+        self._lower.append(lower)
+        self._upper.append(upper)
+
+    def _add_block(self, rows, columns, coefficients, sense, rhs):
+        self.blocks.append((rows, columns, coefficients))
+        self._sense.append((sense, len(rhs)))
+        self._rhs.append(rhs)
+
+    def update_variables(self, name, lower=None, upper=None):
+        """Replace the bounds of the family of variables name, given
+        as in add_variables."""
+
+        k = list(self.variables).index(name)
+        positions = self.variables[name][2]
+        if lower is not None:
+            self._lower[k] = np.broadcast_to(np.asarray(lower, dtype=float), positions.shape).ravel()
+        if upper is not None:
+            self._upper[k] = np.broadcast_to(np.asarray(upper, dtype=float), positions.shape).ravel()
+
+    def update_constraints(self, name, terms=None, rhs=None):
+        """Replace the terms and/or the right-hand side of the family of
+        constraints name, given as in add_constraints."""
+
+        k = list(self.constraints).index(name)
+        rows = self.constraints[name][2]
+        first = rows.flat[0] if rows.size else 0
+        if terms is not None:
+            local_rows, columns, coefficients = self._terms_as_block(terms, rows - first)
+            self.blocks[k] = (first + local_rows, columns, coefficients)
+        if rhs is not None:
+            self._rhs[k] = np.broadcast_to(np.asarray(rhs, dtype=float), rows.shape).ravel()
+
+    @property
+    def A(self):
+        if not self.blocks:
+            return csr_matrix((self.n_constraints, self.n_variables))
+        rows, columns, coefficients = (np.concatenate(a) for a in zip(*self.blocks))
+        return coo_matrix((coefficients, (rows, columns)),
+                          shape=(self.n_constraints, self.n_variables)).tocsr()
+
+    @property
+    def sense(self):
+        return np.concatenate([np.repeat(np.array([sense]), size) for sense, size in self._sense]
+                              or [np.array([], dtype=str)])
+
+    @property
+    def b(self):
+        return np.concatenate(self._rhs) if self._rhs else np.zeros(0)
+
+    @property
+    def lower(self):
+        return np.concatenate(self._lower) if self._lower else np.zeros(0)
+
+    @property
+    def upper(self):
+        return np.concatenate(self._upper) if self._upper else np.zeros(0)
+
+    def write_lp(self, path):
+        """Write the problem to the file path in CPLEX LP format, with
+        the variables named x<position> and the constraints c<row>
+        (the constant of the objective is left out)."""
+
+        with open(path, "w") as f:
+            _write_lp_objective(f, self.c)
+            f.write("s.t.\n")
+            first = 0
+            for (rows, columns, coefficients), (sense, size), rhs in zip(self.blocks, self._sense, self._rhs):
+                _write_lp_rows(f, first, rows, columns, coefficients, sense, rhs)
+                first += size
+            f.write("bounds\n")
+            _write_lp_bounds(f, np.arange(self.n_variables), self.lower, self.upper)
+            f.write("end\n")
+
+
+_lp_sense = {"<=" : "<=", "==" : "=", ">=" : ">="}
+
+
+def _write_lp_objective(f, c):
+    #every variable is listed, so that the solvers number the columns
+    #in the order of the positions
+    f.write("min\nobj:\n")
+    f.write("".join(["%+.17g x%d\n" % (v, i) for i, v in enumerate(c.tolist())]))
+
+
+def _write_lp_rows(f, first, rows, columns, coefficients, sense, rhs):
+    #one term per line, since some solvers limit the line length
+    block = coo_matrix((coefficients, (rows - first, columns)),
+                       shape=(len(rhs), columns.max() + 1 if len(columns) else 1)).tocsr()
+    indptr, indices, data = block.indptr, block.indices.tolist(), block.data.tolist()
+    sense = _lp_sense[sense]
+    lines = []
+    for i, b in enumerate(rhs.tolist()):
+        terms = ["%+.17g x%d\n" % (data[k], indices[k]) for k in range(indptr[i], indptr[i+1])]
+        lines.append("c%d:\n%s%s %.17g\n" % (first + i, "".join(terms) or "0 x0\n", sense, b))
+    f.write("".join(lines))
+
+
+def _write_lp_bounds(f, positions, lower, upper):
+    lines = []
+    for i, l, u in zip(positions.tolist(), lower.tolist(), upper.tolist()):
+        if l == u:
+            lines.append("x%d = %.17g\n" % (i, l))
+        elif l == -np.inf and u == np.inf:
+            lines.append("x%d free\n" % i)
+        else:
+            lines.append("%.17g <= x%d <= %.17g\n" % (l, i, u))
+    f.write("".join(lines))
+
+
+class LPFileProblem(_LinearProblemBase):
+    """
+    Linear optimisation problem like LinearProblem, which writes its
+    constraints and bounds to temporary files in CPLEX LP format as they
+    are added, instead of keeping them in memory, so that only one
+    family of constraints is held in memory at a time. write_lp puts
+    them together with the objective.
+
+    Only the objective, the positions of the variables and the rows of
+    the constraints are kept, so it has no matrix form (A, b, sense,
+    lower, upper) and its constraints and bounds cannot be updated; it
+    can only be solved by the solvers in file_solvers.
+    """
+
+    def __init__(self):
+        super(LPFileProblem, self).__init__()
+        self._constraints_file = tempfile.TemporaryFile(mode="w+")
+        self._bounds_file = tempfile.TemporaryFile(mode="w+")
+
+    def _add_bounds(self, positions, lower, upper):
+        _write_lp_bounds(self._bounds_file, positions, lower, upper)
+
+    def _add_block(self, rows, columns, coefficients, sense, rhs):
+        _write_lp_rows(self._constraints_file, self.n_constraints, rows, columns, coefficients, sense, rhs)
+
+    def write_lp(self, path):
+        with open(path, "w") as f:
+            _write_lp_objective(f, self.c)
+            f.write("s.t.\n")
+            self._constraints_file.seek(0)
+            shutil.copyfileobj(self._constraints_file, f)
+            f.write("bounds\n")
+            self._bounds_file.seek(0)
+            shutil.copyfileobj(self._bounds_file, f)
+            f.write("end\n")
+
+        #further constraints may still be added
+        self._constraints_file.seek(0, os.SEEK_END)
+        self._bounds_file.seek(0, os.SEEK_END)
+
+
+class _Balance(object):
+    #nodal balance expression of all elements except the passive
+    #branches: terms (coefficients, variables, bus positions) with
+    #variables of shape (snapshots, components) and a constant of
+    #shape (snapshots, buses)
+
+    def __init__(self, n_snapshots, n_buses):
+        self.terms = []
+        self.constant = np.zeros((n_snapshots, n_buses))
+
+    def add(self, coefficients, variables, buses):
+        self.terms.append((coefficients, variables, buses))
+
+    def add_constant(self, values, buses):
+        np.add.at(self.constant.T, buses, values.T)
+
+    def weighted(self, W):
+        #terms (for add_constraints) and constant of W times the
+        #balance, with one row for each snapshot and row of the matrix
+        #W (rows x buses)
+        W = csc_matrix(W)
+        n_rows = W.shape[0]
+        terms = []
+        for coefficients, variables, buses in self.terms:
+            Wk = W[:,buses].tocoo()
+            t = np.arange(variables.shape[0])[:,newaxis]
+            coefficients = np.broadcast_to(coefficients, variables.shape)[:,Wk.col] * Wk.data
+            terms.append((coefficients, variables[:,Wk.col], t*n_rows + Wk.row))
+        return terms, np.asarray(W.dot(self.constant.T).T)
+
+
+def _define_generators(network, snapshots, lp, balance, buses_i):
+
+    gens = network.generators
+    ext = gens.p_nom_extendable.values
+    ext_i = gens.index[ext]
+
+    p_min_pu = get_switchable_as_dense(network, 'Generator', 'p_min_pu', snapshots).values
+    p_max_pu = get_switchable_as_dense(network, 'Generator', 'p_max_pu', snapshots).values
+    p_nom = gens.p_nom.values
+
+    p = lp.add_variables("generator_p", gens.index, snapshots,
+                         np.where(ext, -np.inf, p_min_pu*p_nom), np.where(ext, np.inf, p_max_pu*p_nom))
+
+    p_nom_var = lp.add_variables("generator_p_nom", ext_i,
+                                 lower=np.maximum(gens.p_nom_min.values[ext], 0.),
+                                 upper=gens.p_nom_max.values[ext])
+
+    lp.add_constraints("generator_p_lower", ext_i, snapshots,
+                       [(1., p[:,ext]), (-p_min_pu[:,ext], p_nom_var)], ">=", 0.)
+    lp.add_constraints("generator_p_upper", ext_i, snapshots,
+                       [(1., p[:,ext]), (-p_max_pu[:,ext], p_nom_var)], "<=", 0.)
+
+    balance.add(gens.sign.values, p, buses_i.get_indexer(gens.bus))
+
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,newaxis]
+    lp.add_objective(gens.marginal_cost.values*weightings, p)
+    lp.add_objective(gens.capital_cost.values[ext], p_nom_var)
+    lp.constant -= (gens.capital_cost.values[ext]*p_nom[ext]).sum()
+
+
+def _define_storage_units(network, snapshots, lp, balance, buses_i):
+
+    sus = network.storage_units
+    ext = sus.p_nom_extendable.values
+    ext_i = sus.index[ext]
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,newaxis]
+
+    p_max_pu = get_switchable_as_dense(network, 'StorageUnit', 'p_max_pu', snapshots).values
+    p_min_pu = get_switchable_as_dense(network, 'StorageUnit', 'p_min_pu', snapshots).values
+    p_nom = sus.p_nom.values
+
+    dispatch = lp.add_variables("storage_p_dispatch", sus.index, snapshots,
+                                0., np.where(ext, np.inf, p_nom*p_max_pu))
+    store = lp.add_variables("storage_p_store", sus.index, snapshots,
+                             0., np.where(ext, np.inf, -p_nom*p_min_pu))
+
+    #spillage is only possible in snapshots with inflow, so its upper
+    #bound is zero elsewhere
+    inflow = get_switchable_as_dense(network, 'StorageUnit', 'inflow', snapshots)
+    spill_b = (inflow.max() > 0).values
+    inflow = inflow.values
+    spill = lp.add_variables("storage_p_spill", sus.index[spill_b], snapshots,
+                             0., np.where(inflow[:,spill_b] > 0, inflow[:,spill_b], 0.))
+
+    p_nom_var = lp.add_variables("storage_p_nom", ext_i,
+                                 lower=np.maximum(sus.p_nom_min.values[ext], 0.),
+                                 upper=sus.p_nom_max.values[ext])
+
+    lp.add_constraints("storage_p_upper", ext_i, snapshots,
+                       [(1., dispatch[:,ext]), (-p_max_pu[:,ext], p_nom_var)], "<=", 0.)
+    lp.add_constraints("storage_p_lower", ext_i, snapshots,
+                       [(1., store[:,ext]), (p_min_pu[:,ext], p_nom_var)], "<=", 0.)
+
+    soc = lp.add_variables("state_of_charge", sus.index, snapshots, 0., np.inf)
+
+    local = np.arange(soc.size).reshape(soc.shape)
+    lp.add_constraints("state_of_charge_upper", sus.index, snapshots,
+                       [(1., soc), (-sus.max_hours.values[ext], p_nom_var, local[:,ext])],
+                       "<=", np.where(ext, 0., sus.max_hours.values*p_nom))
+
+    #previous_soc + p_store - p_dispatch + inflow - spill == soc, where
+    #the previous soc of the first snapshot is the initial one (unless
+    #cyclic) and fixed socs are constants
+    soc_set = get_switchable_as_dense(network, 'StorageUnit', 'state_of_charge_set', snapshots).values
+    fixed = ~np.isnan(soc_set)
+    standing = (1 - sus.standing_loss.values)**weightings
+    previous = np.ones(soc.shape)
+    previous[0] = sus.cyclic_state_of_charge.values
+
+    rhs = np.where(fixed, soc_set, 0.) - inflow*weightings
+    rhs[0] -= (1 - previous[0])*standing[0]*sus.state_of_charge_initial.values
+
+    lp.add_constraints("state_of_charge_constraint", sus.index, snapshots,
+                       [(standing*previous, np.roll(soc, 1, axis=0)),
+                        (-1.*~fixed, soc),
+                        (sus.efficiency_store.values*weightings, store),
+                        (-weightings/sus.efficiency_dispatch.values, dispatch),
+                        (-1.*weightings, spill, local[:,spill_b])],
+                       "==", rhs)
+
+    fixed_t, fixed_su = fixed.nonzero()
+    lp.add_constraints("state_of_charge_constraint_fixed",
+                       list(zip(sus.index[fixed_su], np.asarray(snapshots)[fixed_t])), None,
+                       [(1., soc[fixed])], "==", soc_set[fixed])
+
+    buses = buses_i.get_indexer(sus.bus)
+    balance.add(sus.sign.values, dispatch, buses)
+    balance.add(-sus.sign.values, store, buses)
+
+    lp.add_objective(sus.marginal_cost.values*weightings, dispatch)
+    lp.add_objective(sus.capital_cost.values[ext], p_nom_var)
+    lp.constant -= (sus.capital_cost.values[ext]*p_nom[ext]).sum()
+
+
+def _define_stores(network, snapshots, lp, balance, buses_i):
+
+    stores = network.stores
+    ext = stores.e_nom_extendable.values
+    ext_i = stores.index[ext]
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,newaxis]
+
+    e_max_pu = get_switchable_as_dense(network, 'Store', 'e_max_pu', snapshots).values
+    e_min_pu = get_switchable_as_dense(network, 'Store', 'e_min_pu', snapshots).values
+    e_nom = stores.e_nom.values
+
+    p = lp.add_variables("store_p", stores.index, snapshots)
+    e = lp.add_variables("store_e", stores.index, snapshots,
+                         np.where(ext, -np.inf, e_nom*e_min_pu), np.where(ext, np.inf, e_nom*e_max_pu))
+    e_nom_var = lp.add_variables("store_e_nom", ext_i,
+                                 lower=stores.e_nom_min.values[ext], upper=stores.e_nom_max.values[ext])
+
+    lp.add_constraints("store_e_upper", ext_i, snapshots,
+                       [(1., e[:,ext]), (-e_max_pu[:,ext], e_nom_var)], "<=", 0.)
+    lp.add_constraints("store_e_lower", ext_i, snapshots,
+                       [(1., e[:,ext]), (-e_min_pu[:,ext], e_nom_var)], ">=", 0.)
+
+    #previous_e - p == e
+    standing = (1 - stores.standing_loss.values)**weightings
+    previous = np.ones(e.shape)
+    previous[0] = stores.e_cyclic.values
+    rhs = np.zeros(e.shape)
+    rhs[0] -= (1 - previous[0])*standing[0]*stores.e_initial.values
+
+    lp.add_constraints("store_constraint", stores.index, snapshots,
+                       [(-1., e), (standing*previous, np.roll(e, 1, axis=0)), (-1.*weightings, p)],
+                       "==", rhs)
+
+    balance.add(stores.sign.values, p, buses_i.get_indexer(stores.bus))
+
+    lp.add_objective(stores.marginal_cost.values*weightings, p)
+    lp.add_objective(stores.capital_cost.values[ext], e_nom_var)
+    lp.constant -= (stores.capital_cost.values[ext]*e_nom[ext]).sum()
+
+
+def _define_links(network, snapshots, lp, balance, buses_i):
+
+    links = network.links
+    ext = links.p_nom_extendable.values
+    ext_i = links.index[ext]
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,newaxis]
+
+    p_max_pu = get_switchable_as_dense(network, 'Link', 'p_max_pu', snapshots).values
+    p_min_pu = get_switchable_as_dense(network, 'Link', 'p_min_pu', snapshots).values
+    efficiency = get_switchable_as_dense(network, 'Link', 'efficiency', snapshots).values
+    p_nom = links.p_nom.values
+
+    p_nom_var = lp.add_variables("link_p_nom", ext_i,
+                                 lower=np.maximum(links.p_nom_min.values[ext], 0.),
+                                 upper=links.p_nom_max.values[ext])
+    p = lp.add_variables("link_p", links.index, snapshots,
+                         np.where(ext, -np.inf, p_min_pu*p_nom), np.where(ext, np.inf, p_max_pu*p_nom))
+
+    lp.add_constraints("link_p_upper", ext_i, snapshots,
+                       [(1., p[:,ext]), (-p_max_pu[:,ext], p_nom_var)], "<=", 0.)
+    lp.add_constraints("link_p_lower", ext_i, snapshots,
+                       [(1., p[:,ext]), (-p_min_pu[:,ext], p_nom_var)], ">=", 0.)
+
+    balance.add(-1., p, buses_i.get_indexer(links.bus0))
+    balance.add(efficiency, p, buses_i.get_indexer(links.bus1))
+
+    lp.add_objective(links.marginal_cost.values*weightings, p)
+    lp.add_objective(links.capital_cost.values[ext], p_nom_var)
+    lp.constant -= (links.capital_cost.values[ext]*p_nom[ext]).sum()
+
+
+def _define_loads(network, snapshots, balance, buses_i):
+
+    loads = network.loads
+    p_set = get_switchable_as_dense(network, 'Load', 'p_set', snapshots).values
+    balance.add_constant(loads.sign.values*p_set, buses_i.get_indexer(loads.bus))
+
+
+def _branch_parameters(network, passive_branches):
+    #series reactance (resistance for DC) including the tap ratio and
+    #the phase shift in radians of the passive branches
+    is_dc = (network.sub_networks.carrier.reindex(passive_branches.sub_network) == "DC").values
+    is_transformer = (passive_branches.index.get_level_values(0) == "Transformer")
+    tap_ratio = np.where(is_transformer, passive_branches.get("tap_ratio", 1.), 1.)
+    x = np.where(is_dc, passive_branches.r_pu, passive_branches.x_pu) * tap_ratio
+    phase_shift = np.where(is_transformer, passive_branches.get("phase_shift", 0.), 0.)*np.pi/180.
+    return x, phase_shift
+
+
+def _cycle_matrices(network, passive_branches, buses_i):
+    #cycle matrix (branches x cycles), tree matrix (branches x buses)
+    #and cycle index for all sub-networks
+    C, T, cycle_index = [], [], []
+    for sub_network in network.sub_networks.obj:
+        find_tree(sub_network)
+        find_cycles(sub_network)
+
+        #following is necessary to calculate angles post-facto
+        find_bus_controls(sub_network)
+        if len(sub_network.branches_i()) > 0:
+            calculate_B_H(sub_network)
+
+        branches = passive_branches.index.get_indexer(sub_network.branches().index)
+        buses = buses_i.get_indexer(sub_network.buses().index)
+        Cs = coo_matrix(sub_network.C)
+        Ts = coo_matrix(sub_network.T)
+        C.append((branches[Cs.row], len(cycle_index) + Cs.col, Cs.data))
+        T.append((branches[Ts.row], buses[Ts.col], Ts.data))
+        cycle_index += [(sub_network.name, i) for i in range(sub_network.C.shape[1])]
+
+    def stack(entries, shape):
+        rows, columns, data = (np.concatenate(a) for a in zip(*entries)) if entries else ([], [], [])
+        return csr_matrix((data, (rows, columns)), shape=shape)
+
+    return (stack(C, (len(passive_branches), len(cycle_index))),
+            stack(T, (len(passive_branches), len(buses_i))), cycle_index)
+
+
+def _define_passive_branch_flows(network, snapshots, lp, balance, buses_i, formulation="angles",
+                                 ptdf_tolerance=0.):
+
+    passive_branches = network.passive_branches()
+    n_branches = len(passive_branches)
+    T = len(snapshots)
+    local = np.arange(T*n_branches).reshape(T, n_branches)
+
+    bus0 = buses_i.get_indexer(passive_branches.bus0)
+    bus1 = buses_i.get_indexer(passive_branches.bus1)
+    x, phase_shift = _branch_parameters(network, passive_branches)
+
+    if formulation == "angles":
+        angles = lp.add_variables("voltage_angles", buses_i, snapshots)
+        slacks = buses_i.get_indexer(network.sub_networks.slack_bus)
+        lp.add_constraints("slack_angle", network.sub_networks.index, snapshots,
+                           [(1., angles[:,slacks])], "==", 0.)
+
+    p = lp.add_variables("passive_branch_p", passive_branches.index, snapshots)
+
+    if formulation == "angles":
+        y = 1/x
+        lp.add_constraints("passive_branch_p_def", passive_branches.index, snapshots,
+                           [(y, angles[:,bus0]), (-y, angles[:,bus1]), (-1., p)],
+                           "==", y*phase_shift)
+
+    elif formulation == "ptdf":
+        rows, columns, data = [], [], []
+        for sub_network in network.sub_networks.obj:
+            find_bus_controls(sub_network)
+
+            branches_i = sub_network.branches_i()
+            if len(branches_i) > 0:
+                calculate_PTDF(sub_network)
+
+                #kill small PTDF values (on a copy, since the PTDF may be
+                #shared with the matrix cache)
+                sub_network.PTDF = np.where(abs(sub_network.PTDF) < ptdf_tolerance, 0., sub_network.PTDF)
+
+                PTDF = coo_matrix(sub_network.PTDF)
+                rows.append(passive_branches.index.get_indexer(branches_i)[PTDF.row])
+                columns.append(buses_i.get_indexer(sub_network.buses_o)[PTDF.col])
+                data.append(PTDF.data)
+
+        PTDF = csr_matrix((np.concatenate(data) if data else [],
+                           (np.concatenate(rows) if rows else [], np.concatenate(columns) if columns else [])),
+                          shape=(n_branches, len(buses_i)))
+        terms, constant = balance.weighted(PTDF)
+        lp.add_constraints("passive_branch_p_def", passive_branches.index, snapshots,
+                           terms + [(-1., p)], "==", -constant)
+        lp.balance_weights["passive_branch_p_def"] = PTDF
+
+    elif formulation in ("cycles", "kirchhoff"):
+        C, tree, cycle_index = _cycle_matrices(network, passive_branches, buses_i)
+
+        if formulation == "cycles":
+            cycles = lp.add_variables("cycles", cycle_index, snapshots)
+            Cc = C.tocoo()
+            terms, constant = balance.weighted(tree)
+            t = np.arange(T)[:,newaxis]
+            lp.add_constraints("passive_branch_p_def", passive_branches.index, snapshots,
+                               terms + [(Cc.data, cycles[:,Cc.col], t*n_branches + Cc.row), (-1., p)],
+                               "==", -constant)
+            lp.balance_weights["passive_branch_p_def"] = tree
+
+        #sum of x p around each cycle is zero
+        W = coo_matrix(C.T.multiply(x[newaxis,:]))
+        t = np.arange(T)[:,newaxis]
+        lp.add_constraints("cycle_constraints", cycle_index, snapshots,
+                           [(W.data, p[:,W.col], t*len(cycle_index) + W.row)], "==", 0.)
+
+    else:
+        raise ValueError("formulation must be one of 'angles', 'cycles', 'kirchhoff' or 'ptdf', got: {}".format(formulation))
+
+    #flow limits
+    ext = passive_branches.s_nom_extendable.values
+    s_nom = passive_branches.s_nom.values
+    s_nom_var = lp.add_variables("passive_branch_s_nom", passive_branches.index[ext],
+                                 lower=np.maximum(passive_branches.s_nom_min.values[ext], 0.),
+                                 upper=passive_branches.s_nom_max.values[ext])
+
+    lp.add_constraints("flow_upper", passive_branches.index, snapshots,
+                       [(1., p), (-1., s_nom_var, local[:,ext])], "<=", np.where(ext, 0., s_nom))
+    lp.add_constraints("flow_lower", passive_branches.index, snapshots,
+                       [(1., p), (1., s_nom_var, local[:,ext])], ">=", np.where(ext, 0., -s_nom))
+
+    lp.add_objective(passive_branches.capital_cost.values[ext], s_nom_var)
+    lp.constant -= (passive_branches.capital_cost.values[ext]*s_nom[ext]).sum()
+
+    return p, bus0, bus1
+
+
+def build_lopf_problem(network, snapshots, formulation="angles", ptdf_tolerance=0., lp=None):
+    """
+    Assemble the linear optimal power flow of network_lopf as a
+    LinearProblem, with the same variables, constraints and objective
+    as the pyomo model, but built family by family from the component
+    DataFrames instead of element by element.
+
+    The network topology, dependent values and slack buses must be
+    known (see network_lopf).
+
+    Parameters
+    ----------
+    snapshots : list-like
+        Snapshots to optimise.
+    formulation : string
+        Formulation of the linear power flow equations, one of
+        ["angles","cycles","kirchhoff","ptdf"].
+    ptdf_tolerance : float
+        Value below which PTDF entries are ignored.
+    lp : LinearProblem, default None
+        Empty problem to build into, e.g. an LPFileProblem; defaults to
+        a new LinearProblem.
+
+    Returns
+    -------
+    LinearProblem
+    """
+
+    if lp is None:
+        lp = LinearProblem()
+    buses_i = network.buses.index
+    balance = _Balance(len(snapshots), len(buses_i))
+
+    #constraint families whose right-hand side is -W times the
+    #constant part of the nodal balances (the loads)
+    lp.balance_weights = OrderedDict()
+
+    _define_generators(network, snapshots, lp, balance, buses_i)
+    _define_storage_units(network, snapshots, lp, balance, buses_i)
+    _define_stores(network, snapshots, lp, balance, buses_i)
+    _define_links(network, snapshots, lp, balance, buses_i)
+    _define_loads(network, snapshots, balance, buses_i)
+
+    p, bus0, bus1 = _define_passive_branch_flows(network, snapshots, lp, balance, buses_i,
+                                                 formulation, ptdf_tolerance)
+
+    if formulation in ("angles", "kirchhoff"):
+        W = identity(len(buses_i))
+        terms, constant = balance.weighted(W)
+        t = np.arange(len(snapshots))[:,newaxis]
+        terms += [(-1., p, t*len(buses_i) + bus0), (1., p, t*len(buses_i) + bus1)]
+        lp.add_constraints("power_balance", buses_i, snapshots, terms, "==", -constant)
+        lp.balance_weights["power_balance"] = W
+    else:
+        sub_networks = network.sub_networks.index.get_indexer(network.buses.sub_network)
+        W = csr_matrix((np.ones(len(buses_i)), (sub_networks, np.arange(len(buses_i)))),
+                       shape=(len(network.sub_networks), len(buses_i)))
+        terms, constant = balance.weighted(W)
+        lp.add_constraints("sub_network_balance_constraint", network.sub_networks.index, snapshots,
+                           terms, "==", -constant)
+        lp.balance_weights["sub_network_balance_constraint"] = W
+
+    if network.co2_limit is not None:
+        _define_co2_constraint(network, snapshots, lp)
+
+    return lp
+
+
+def _define_co2_constraint(network, snapshots, lp):
+
+    weightings = network.snapshot_weightings.loc[snapshots].values[:,newaxis]
+    co2_emissions = network.carriers.co2_emissions
+    gens = network.generators
+    stores = network.stores
+    lp.add_constraints("co2_constraint", None, None,
+                       [(co2_emissions.loc[gens.carrier].values/gens.efficiency.values*weightings,
+                         lp.variables["generator_p"][2], 0),
+                        (co2_emissions.loc[network.buses.carrier.loc[stores.bus]].values*weightings,
+                         lp.variables["store_p"][2], 0)],
+                       "<=", network.co2_limit)
+
+
+def solve_scipy_highs(lp, solver_options={}, keep_files=False):
+    """
+    Solve the LinearProblem lp in-process with the HiGHS solver bundled
+    with scipy (>= 1.7), which is called through
+    scipy.optimize.linprog(method="highs") on the sparse constraint
+    matrix and returns the marginals, without any files or
+    subprocesses.
+
+    The solver options are passed on as options of linprog; "method"
+    may also be "highs-ds" (dual simplex) or "highs-ipm" (interior
+    point). The older methods of linprog are not accepted, since they
+    return no duals and do not solve the LOPF reliably.
+
+    Returns
+    -------
+    status, termination_condition : string
+        As returned by network_lopf.
+    result : scipy.optimize.OptimizeResult
+    """
+
+    if not isinstance(lp, LinearProblem):
+        raise TypeError("The solver 'scipy-highs' needs the constraint matrix of a LinearProblem, got: {}"
+                        .format(type(lp).__name__))
+
+    if _scipy_version < '1.7':
+        raise ImportError("The solver 'scipy-highs' needs scipy >= 1.7, found {}".format(scipy.__version__))
+
+    from scipy.optimize import linprog
+
+    options = dict(solver_options)
+    method = options.pop("method", "highs")
+    if method not in ("highs", "highs-ds", "highs-ipm"):
+        raise ValueError("method must be one of 'highs', 'highs-ds' or 'highs-ipm', got: {}".format(method))
+
+    A = lp.A
+    sense = lp.sense
+    b = lp.b
+    ub = (sense != "==").nonzero()[0]
+    eq = (sense == "==").nonzero()[0]
+    #>= rows are negated to <= rows
+    sign = np.where(sense[ub] == ">=", -1., 1.)
+    A_ub = csr_matrix(A[ub].multiply(sign[:,newaxis]))
+    A_eq = A[eq]
+
+    result = linprog(lp.c, A_ub=A_ub if len(ub) else None, b_ub=sign*b[ub] if len(ub) else None,
+                     A_eq=A_eq if len(eq) else None, b_eq=b[eq] if len(eq) else None,
+                     bounds=np.column_stack((lp.lower, lp.upper)), method=method, options=options)
+
+    #only an optimal solution is passed on, so that the results of
+    #interrupted or failed solves are never written to the network
+    status, termination_condition = {0 : ("ok", "optimal"),
+                                     1 : ("warning", "maxIterations"),
+                                     2 : ("warning", "infeasible"),
+                                     3 : ("warning", "unbounded")}.get(result.status, ("error", "other"))
+    if result.status != 0:
+        logger.warning("linprog returned: %s", result.message)
+        return status, termination_condition, result
+
+    y = np.empty(lp.n_constraints)
+    y[eq] = result.eqlin.marginals
+    y[ub] = sign*result.ineqlin.marginals
+    lp.set_solution(result.x, y)
+
+    return status, termination_condition, result
+
+
+def _solve_command_line(lp, command, solution_suffix, read_solution, keep_files=False,
+                        save_solution=None):
+    #write lp to an LP file in a temporary directory, run the command
+    #line solver command(problem_fn, solution_fn) and read the solution
+    #back with read_solution(solution_fn, n_variables, n_constraints);
+    #a solution is copied to save_solution, if given
+
+    directory = tempfile.mkdtemp(prefix="pypsa-lopf-")
+    problem_fn = os.path.join(directory, "problem.lp")
+    solution_fn = os.path.join(directory, "solution" + solution_suffix)
+
+    try:
+        lp.write_lp(problem_fn)
+
+        args = command(problem_fn, solution_fn)
+        logger.info("Running %s", " ".join(args))
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        log = process.communicate()[0]
+        logger.debug(log)
+
+        if not os.path.exists(solution_fn):
+            logger.error("%s did not write a solution:\n%s", args[0], log)
+            return "error", "other", log
+
+        status, termination_condition, x, y = read_solution(solution_fn, lp.n_variables, lp.n_constraints)
+        if save_solution is not None and x is not None:
+            shutil.copyfile(solution_fn, save_solution)
+    finally:
+        if keep_files:
+            logger.info("Solver files are kept in %s", directory)
+        else:
+            shutil.rmtree(directory)
+
+    if x is not None:
+        lp.set_solution(x, y)
+
+    return status, termination_condition, log
+
+
+def _options_as_arguments(solver_options, prefix, separator=None):
+    arguments = []
+    for key, value in iteritems(solver_options):
+        if separator is not None:
+            arguments.append("{}{}{}{}".format(prefix, key, separator, value))
+        else:
+            arguments.append(prefix + key)
+            if value is not None:
+                arguments.append(str(value))
+    return arguments
+
+
+def _read_glpk_solution(fn, n_variables, n_constraints):
+
+    with open(fn) as f:
+        lines = [line.split() for line in f if not line.startswith("c")]
+
+    x = np.empty(n_variables)
+    y = np.empty(n_constraints)
+
+    if lines[0][0] == "s":
+        #s bas rows columns primal_status dual_status objective
+        primal, dual = lines[0][4:6]
+        for line in lines[1:]:
+            if line[0] == "i":
+                y[int(line[1]) - 1] = float(line[4])
+            elif line[0] == "j":
+                x[int(line[1]) - 1] = float(line[3])
+    else:
+        #format of GLPK before 4.57 without the leading letters
+        status_codes = {"1" : "u", "2" : "f", "3" : "i", "4" : "n"}
+        primal, dual = (status_codes[code] for code in lines[1][:2])
+        y[:] = [float(line[2]) for line in lines[2:2+n_constraints]]
+        x[:] = [float(line[1]) for line in lines[2+n_constraints:2+n_constraints+n_variables]]
+
+    if primal == "f" and dual == "f":
+        return "ok", "optimal", x, y
+    elif primal == "n":
+        return "warning", "infeasible", None, None
+    elif dual == "n":
+        return "warning", "unbounded", None, None
+    else:
+        return "error", "unknown", None, None
+
+
+def solve_glpk(lp, solver_options={}, keep_files=False, basis_fn=None):
+    """
+    Solve the LinearProblem lp with the GLPK command line solver
+    glpsol. The solver options are passed on as --key value.
+
+    If basis_fn is given, glpsol starts from the basis of the solution
+    in this file, if it exists, and the new solution is saved to it,
+    which warm starts re-solves of a problem with the same rows and
+    columns.
+
+    Returns
+    -------
+    status, termination_condition : string
+        As returned by network_lopf.
+    log : string
+        Output of glpsol.
+    """
+
+    def command(problem_fn, solution_fn):
+        warm_start = ["--ini", basis_fn] if basis_fn is not None and os.path.exists(basis_fn) else []
+        return (["glpsol", "--lp", problem_fn, "-w", solution_fn] + warm_start
+                + _options_as_arguments(solver_options, "--"))
+
+    return _solve_command_line(lp, command, ".sol", _read_glpk_solution, keep_files,
+                               save_solution=basis_fn)
+
+
+def _read_cbc_solution(fn, n_variables, n_constraints):
+
+    x = np.empty(n_variables)
+    y = np.empty(n_constraints)
+
+    with open(fn) as f:
+        status = f.readline()
+        for line in f:
+            #rows and columns with infeasibilities are marked with **
+            fields = line.split()
+            if fields[0] == "**":
+                fields = fields[1:]
+            name = fields[1]
+            if name[0] == "x":
+                x[int(name[1:])] = float(fields[2])
+            elif name[0] == "c":
+                y[int(name[1:])] = float(fields[3])
+
+    if status.startswith("Optimal"):
+        return "ok", "optimal", x, y
+    elif "infeasible" in status.lower():
+        return "warning", "infeasible", None, None
+    elif status.startswith("Unbounded"):
+        return "warning", "unbounded", None, None
+    elif status.startswith("Stopped on iterations"):
+        return "warning", "maxIterations", None, None
+    elif status.startswith("Stopped on time"):
+        return "warning", "maxTimeLimit", None, None
+    else:
+        return "error", "other", None, None
+
+
+def solve_cbc(lp, solver_options={}, keep_files=False):
+    """
+    Solve the LinearProblem lp with the CBC command line solver. The
+    solver options are passed on as -key value.
+
+    Returns
+    -------
+    status, termination_condition : string
+        As returned by network_lopf.
+    log : string
+        Output of cbc.
+    """
+
+    def command(problem_fn, solution_fn):
+        return (["cbc", problem_fn] + _options_as_arguments(solver_options, "-")
+                + ["-solve", "-printingOptions", "all", "-solution", solution_fn])
+
+    return _solve_command_line(lp, command, ".sol", _read_cbc_solution, keep_files)
+
+
+def _read_gurobi_solution(fn, n_variables, n_constraints):
+
+    with open(fn) as f:
+        solution = json.load(f)
+
+    x = np.empty(n_variables)
+    y = np.full(n_constraints, np.nan)
+
+    for variable in solution.get("Vars", []):
+        x[int(variable["VarName"][1:])] = variable["X"]
+    for constraint in solution.get("Constrs", []):
+        y[int(constraint["ConstrName"][1:])] = constraint["Pi"]
+
+    status = solution["SolutionInfo"]["Status"]
+    if status == 2:
+        return "ok", "optimal", x, y
+    elif status == 3:
+        return "warning", "infeasible", None, None
+    elif status in (4, 5):
+        return "warning", "unbounded", None, None
+    elif status == 7:
+        return "warning", "maxIterations", None, None
+    elif status == 9:
+        return "warning", "maxTimeLimit", None, None
+    else:
+        return "error", "other", None, None
+
+
+def solve_gurobi(lp, solver_options={}, keep_files=False):
+    """
+    Solve the LinearProblem lp with the Gurobi command line solver
+    gurobi_cl, which writes its solution including the duals as JSON.
+    The solver options are passed on as Key=Value parameters.
+
+    Returns
+    -------
+    status, termination_condition : string
+        As returned by network_lopf.
+    log : string
+        Output of gurobi_cl.
+    """
+
+    def command(problem_fn, solution_fn):
+        return (["gurobi_cl", "ResultFile=" + solution_fn, "JSONSolDetail=1"]
+                + _options_as_arguments(solver_options, "", "=") + [problem_fn])
+
+    return _solve_command_line(lp, command, ".json", _read_gurobi_solution, keep_files)
+
+
+#solvers for the sparse backend of network_lopf, which take a
+#LinearProblem, solver options and keep_files and return the status,
+#termination condition and raw results; the solution (including the
+#duals) is only set on the LinearProblem if it is optimal
+sparse_solvers = {"scipy-highs" : solve_scipy_highs,
+                  "glpk" : solve_glpk,
+                  "cbc" : solve_cbc,
+                  "gurobi" : solve_gurobi}
+
+#solvers which read the problem from an LP file, for which it is
+#streamed to disk while it is built
+file_solvers = {"glpk", "cbc", "gurobi"}
+
+#solvers which take the argument basis_fn to warm start from the
+#previous solution
+warm_start_solvers = {"glpk"}
+
+
+def _set_varying(network, component, attr, values):
+    #write values (snapshots x components) to the time-varying data,
+    #starting from the static values for components without a series
+    pnl = network.pnl(component)[attr]
+    static = network.df(component)[attr]
+    for name in values.columns:
+        if name not in pnl.columns:
+            pnl[name] = static.at[name]
+    pnl.loc[values.index, values.columns] = values
+
+
+class LOPFModel(object):
+    """
+    Persistent linear optimal power flow, as built by
+    network.build_lopf.
+
+    The loads, the availability of generators, their marginal costs and
+    the CO2 limit can be changed with update, which writes them to the
+    network and changes only the affected bounds, right-hand sides and
+    coefficients of the LinearProblem, so that it can be solved again
+    with solve without being rebuilt.
+
+    For solvers in warm_start_solvers (only glpk) the basis of the last
+    solution is kept in a temporary directory, which close removes; the
+    model can be used as a context manager to close it::
+
+        with network.build_lopf(snapshots) as model:
+            model.solve()
+            model.update(co2_limit=1e6)
+            model.solve()
+
+    Attributes
+    ----------
+    network : pypsa.Network
+    snapshots : list-like
+    lp : LinearProblem
+    formulation : string
+    solver_name : string
+    solver_options : dict
+    """
+
+    def __init__(self, network, snapshots, lp, formulation, solver_name, solver_options={}):
+        self.network = network
+        self.snapshots = snapshots
+        self.lp = lp
+        self.formulation = formulation
+        self.solver_name = solver_name
+        self.solver_options = solver_options
+        self._directory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Remove the basis kept for warm starts; the next solve starts
+        from scratch."""
+
+        if self._directory is not None:
+            shutil.rmtree(self._directory, ignore_errors=True)
+            self._directory = None
+
+    def __repr__(self):
+        return "LOPFModel for {} snapshots with {} variables and {} constraints".format(len(self.snapshots), self.lp.n_variables, self.lp.n_constraints)
+
+    @property
+    def _basis_fn(self):
+        if self._directory is None:
+            self._directory = tempfile.mkdtemp(prefix="pypsa-lopf-")
+        return os.path.join(self._directory, "basis.sol")
+
+    def update(self, loads=None, p_max_pu=None, marginal_cost=None, co2_limit=None):
+        """
+        Change parameters of the network and of the model in place.
+
+        Only the parameters below can be changed, and only for the
+        components they name: marginal_cost and p_max_pu apply to
+        generators, not to storage units, stores or links. Any other
+        change to the network needs a new model from
+        network.build_lopf.
+
+        Parameters
+        ----------
+        loads : pandas.DataFrame
+            Active power of loads (snapshots x loads), written to
+            network.loads_t.p_set; the right-hand sides of the nodal
+            balances (and of the flow definitions for the "ptdf" and
+            "cycles" formulations) are updated.
+        p_max_pu : pandas.DataFrame
+            Availability of generators (snapshots x generators), written
+            to network.generators_t.p_max_pu; the upper bounds of the
+            dispatch, or the coefficients of extendable generators, are
+            updated.
+        marginal_cost : pandas.Series
+            Marginal cost of generators, written to
+            network.generators.marginal_cost; the objective
+            coefficients of the dispatch are updated.
+        co2_limit : float
+            Written to network.co2_limit; the right-hand side of the CO2
+            constraint is updated, or the constraint is added.
+
+        Raises
+        ------
+        ValueError
+            If loads or p_max_pu have columns, or marginal_cost an
+            index, which are not loads or generators respectively.
+        """
+
+        network = self.network
+        snapshots = self.snapshots
+        lp = self.lp
+
+        for values, labels, component in [(loads, "columns", "Load"), (p_max_pu, "columns", "Generator"),
+                                          (marginal_cost, "index", "Generator")]:
+            if values is None:
+                continue
+            unknown = getattr(values, labels).difference(network.df(component).index)
+            if len(unknown) > 0:
+                raise ValueError("LOPFModel.update can only change {}s, got: {}"
+                                 .format(component.lower(), ", ".join(map(str, unknown))))
+
+        if loads is not None:
+            _set_varying(network, 'Load', 'p_set', loads)
+            buses_i = network.buses.index
+            balance = _Balance(len(snapshots), len(buses_i))
+            _define_loads(network, snapshots, balance, buses_i)
+            for name, W in iteritems(lp.balance_weights):
+                lp.update_constraints(name, rhs=-np.asarray(csr_matrix(W).dot(balance.constant.T).T))
+
+        if p_max_pu is not None:
+            _set_varying(network, 'Generator', 'p_max_pu', p_max_pu)
+            gens = network.generators
+            ext = gens.p_nom_extendable.values
+            p_max_pu = get_switchable_as_dense(network, 'Generator', 'p_max_pu', snapshots).values
+            p = lp.variables["generator_p"][2]
+            lp.update_variables("generator_p", upper=np.where(ext, np.inf, p_max_pu*gens.p_nom.values))
+            lp.update_constraints("generator_p_upper",
+                                  terms=[(1., p[:,ext]), (-p_max_pu[:,ext], lp.variables["generator_p_nom"][2])])
+
+        if marginal_cost is not None:
+            network.generators.loc[marginal_cost.index, "marginal_cost"] = marginal_cost
+            weightings = network.snapshot_weightings.loc[snapshots].values[:,newaxis]
+            lp.set_objective(network.generators.marginal_cost.values*weightings,
+                             lp.variables["generator_p"][2])
+
+        if co2_limit is not None:
+            network.co2_limit = co2_limit
+            if "co2_constraint" in lp.constraints:
+                lp.update_constraints("co2_constraint", rhs=co2_limit)
+            else:
+                _define_co2_constraint(network, snapshots, lp)
+                #the rows have changed, so the previous basis is invalid
+                self.close()
+
+    def solve(self, solver_options=None, keep_files=False):
+        """
+        Solve the model and write the results to the network, warm
+        starting from the previous solution if the solver supports it
+        (only glpk, see pypsa.linopf.warm_start_solvers); the other
+        solvers start from scratch.
+
+        Parameters
+        ----------
+        solver_options : dictionary, default None
+            Options for the solver, defaults to the ones given to
+            network.build_lopf.
+        keep_files : bool, default False
+            Keep the files of command line solvers.
+
+        Returns
+        -------
+        status, termination_condition : string
+            As returned by network_lopf.
+        """
+
+        from .opf import _extract_if_solved
+
+        solve = sparse_solvers[self.solver_name]
+        solver_options = self.solver_options if solver_options is None else solver_options
+        kwargs = {"basis_fn" : self._basis_fn} if self.solver_name in warm_start_solvers else {}
+
+        logger.info("Solving model using %s", self.solver_name)
+        self.network.model = self.lp
+        status, termination_condition, self.network.results = solve(self.lp, solver_options,
+                                                                    keep_files, **kwargs)
+
+        _extract_if_solved(self.network, self.snapshots, self.formulation,
+                           status, termination_condition, self.lp)
+
+        return status, termination_condition
@@ -49,7 +49,7 @@ except ValueError:
 
 from .pf import (calculate_dependent_values, find_slack_bus,
                  find_bus_controls, calculate_B_H, calculate_PTDF, find_tree,
-                 find_cycles)
+                 find_cycles, _bus_injections)
 from .opt import (l_constraint, l_objective, LExpression, LConstraint,
                   patch_optsolver_free_model_before_solving,
                   patch_optsolver_record_memusage_before_solving,
@@ -266,7 +266,7 @@ def define_storage_variables_constraints(network,snapshots):
 
     for su,sn in spill_index:
         storage_p_spill = model.storage_p_spill[su,sn]
-        soc[su,sn][0].append((-1.*elapsed_hours,storage_p_spill))
+        soc[su,sn][0].append((-1.*network.snapshot_weightings[sn],storage_p_spill))
 
     l_constraint(model,"state_of_charge_constraint",
                  soc,list(network.storage_units.index), snapshots)
@@ -494,8 +494,9 @@ def define_passive_branch_flows_with_PTDF(network,snapshots,ptdf_tolerance=0.):
         if len(branches_i) > 0:
             calculate_PTDF(sub_network)
 
-            #kill small PTDF values
-            sub_network.PTDF[abs(sub_network.PTDF) < ptdf_tolerance] = 0
+            #kill small PTDF values (on a copy, since the PTDF may be
+            #shared with the matrix cache)
+            sub_network.PTDF = np.where(abs(sub_network.PTDF) < ptdf_tolerance, 0., sub_network.PTDF)
 
         for i,branch in enumerate(branches_i):
             bt = branch[0]
@@ -834,10 +835,47 @@ def define_linear_objective(network,snapshots):
     l_objective(model,objective)
 
 
-def extract_optimisation_results(network, snapshots, formulation="angles"):
+class _PyomoSolution(object):
+    """Values and duals of the solved pyomo model of network_lopf, in
+    the form extract_optimisation_results reads them."""
+
+    def __init__(self, network):
+        self.model = network.model
+        self.objective = network.results["Problem"][0]["Lower bound"]
+
+    def values(self, name):
+        return pd.Series(getattr(self.model, name).get_values())
+
+    def duals(self, name):
+        constraint = getattr(self.model, name)
+        if not constraint.is_indexed():
+            return self.model.dual[constraint]
+        return (pd.Series(list(constraint.values()),
+                          index=pd.MultiIndex.from_tuples(list(constraint.keys())))
+                .map(pd.Series(list(self.model.dual.values()), index=pd.Index(list(self.model.dual.keys())))))
+
+
+def extract_optimisation_results(network, snapshots, formulation="angles", solution=None):
+    """
+    Write the results of the linear optimal power flow to the network.
+
+    Parameters
+    ----------
+    snapshots : list-like
+        Snapshots which were optimised.
+    formulation : string
+        Formulation of the linear power flow equations which was used.
+    solution : object, default None
+        Solution with an `objective` attribute and `values(name)` and
+        `duals(name)` methods, which return the values of the variables
+        and the duals of the constraints called name, as pandas.Series
+        indexed by (component, snapshot) (or a float for a single
+        constraint); defaults to the solved pyomo model network.model.
+    """
 
     from .components import \
-        passive_branch_components, branch_components, controllable_one_port_components
+        passive_branch_components, branch_components, controllable_one_port_components, \
+        controllable_branch_components
 
     if isinstance(snapshots, pd.DatetimeIndex) and _pd_version < '0.18.0':
         # Work around pandas bug #12050 (https://github.com/pydata/pandas/issues/12050)
@@ -852,53 +890,44 @@ def extract_optimisation_results(network, snapshots, formulation="angles"):
                                          'Transformer': ['p0', 'p1'],
                                          'Link': ['p0', 'p1']})
 
-    #get value of objective function
-    network.objective = network.results["Problem"][0]["Lower bound"]
+    if solution is None:
+        solution = _PyomoSolution(network)
 
-    model = network.model
+    #get value of objective function
+    network.objective = solution.objective
 
-    def as_series(indexedvar):
-        return pd.Series(indexedvar.get_values())
+    as_series = solution.values
 
     def set_from_series(df, series):
         df.loc[snapshots] = series.unstack(0).reindex(columns=df.columns)
 
     if len(network.generators):
-        set_from_series(network.generators_t.p, as_series(model.generator_p))
+        set_from_series(network.generators_t.p, as_series("generator_p"))
 
     if len(network.storage_units):
         set_from_series(network.storage_units_t.p,
-                        as_series(model.storage_p_dispatch)
-                        - as_series(model.storage_p_store))
+                        as_series("storage_p_dispatch")
+                        - as_series("storage_p_store"))
 
         set_from_series(network.storage_units_t.state_of_charge,
-                        as_series(model.state_of_charge))
+                        as_series("state_of_charge"))
 
         if (network.storage_units_t.inflow.max() > 0).any():
             set_from_series(network.storage_units_t.spill,
-                            as_series(model.storage_p_spill))
+                            as_series("storage_p_spill"))
         network.storage_units_t.spill.fillna(0, inplace=True) #p_spill doesn't exist if inflow=0
 
     if len(network.stores):
-        set_from_series(network.stores_t.p, as_series(model.store_p))
-        set_from_series(network.stores_t.e, as_series(model.store_e))
+        set_from_series(network.stores_t.p, as_series("store_p"))
+        set_from_series(network.stores_t.e, as_series("store_e"))
 
     if len(network.loads):
         load_p_set = get_switchable_as_dense(network, 'Load', 'p_set')
         network.loads_t["p"].loc[snapshots] = load_p_set.loc[snapshots]
 
-    if len(network.buses):
-        network.buses_t.p.loc[snapshots] = \
-            pd.concat({c.name:
-                       c.pnl.p.loc[snapshots].multiply(c.df.sign, axis=1)
-                       .groupby(c.df.bus, axis=1).sum()
-                       for c in network.iterate_components(controllable_one_port_components)}) \
-              .sum(level=1) \
-              .reindex_axis(network.buses_t.p.columns, axis=1, fill_value=0.)
-
 
     # passive branches
-    passive_branches = as_series(model.passive_branch_p)
+    passive_branches = as_series("passive_branch_p")
     for c in network.iterate_components(passive_branch_components):
         set_from_series(c.pnl.p0, passive_branches.loc[c.name])
         c.pnl.p1.loc[snapshots] = - c.pnl.p0.loc[snapshots]
@@ -906,31 +935,26 @@ def extract_optimisation_results(network, snapshots, formulation="angles"):
 
     # active branches
     if len(network.links):
-        set_from_series(network.links_t.p0, as_series(model.link_p))
+        set_from_series(network.links_t.p0, as_series("link_p"))
 
         efficiency = get_switchable_as_dense(network, 'Link', 'efficiency')
 
         network.links_t.p1.loc[snapshots] = - network.links_t.p0.loc[snapshots]*efficiency.loc[snapshots,:]
 
-        network.buses_t.p.loc[snapshots] -= (network.links_t.p0.loc[snapshots]
-                                             .groupby(network.links.bus0, axis=1).sum()
-                                             .reindex(columns=network.buses_t.p.columns, fill_value=0.))
-
-        network.buses_t.p.loc[snapshots] -= (network.links_t.p1.loc[snapshots]
-                                             .groupby(network.links.bus1, axis=1).sum()
-                                             .reindex(columns=network.buses_t.p.columns, fill_value=0.))
+    if len(network.buses):
+        network.buses_t.p.loc[snapshots, network.buses.index] = \
+            _bus_injections(network, None, snapshots, network.buses.index,
+                            network.iterate_components(controllable_one_port_components),
+                            network.iterate_components(controllable_branch_components))
 
 
     if len(network.buses):
         if formulation in {'angles', 'kirchhoff'}:
-            set_from_series(network.buses_t.marginal_price,
-                            pd.Series(list(model.power_balance.values()),
-                                      index=pd.MultiIndex.from_tuples(list(model.power_balance.keys())))
-                            .map(pd.Series(list(model.dual.values()), index=pd.Index(list(model.dual.keys())))))
+            set_from_series(network.buses_t.marginal_price, solution.duals("power_balance"))
 
         if formulation == "angles":
             set_from_series(network.buses_t.v_ang,
-                            as_series(model.voltage_angles))
+                            as_series("voltage_angles"))
         elif formulation in ["ptdf","cycles","kirchhoff"]:
             for sn in network.sub_networks.obj:
                 network.buses_t.v_ang.loc[snapshots,sn.slack_bus] = 0.
@@ -947,20 +971,20 @@ def extract_optimisation_results(network, snapshots, formulation="angles"):
     network.generators.p_nom_opt = network.generators.p_nom
 
     network.generators.loc[network.generators.p_nom_extendable, 'p_nom_opt'] = \
-        as_series(network.model.generator_p_nom)
+        as_series("generator_p_nom")
 
     network.storage_units.p_nom_opt = network.storage_units.p_nom
 
     network.storage_units.loc[network.storage_units.p_nom_extendable, 'p_nom_opt'] = \
-        as_series(network.model.storage_p_nom)
+        as_series("storage_p_nom")
 
     network.stores.e_nom_opt = network.stores.e_nom
 
     network.stores.loc[network.stores.e_nom_extendable, 'e_nom_opt'] = \
-        as_series(network.model.store_e_nom)
+        as_series("store_e_nom")
 
 
-    s_nom_extendable_passive_branches = as_series(model.passive_branch_s_nom)
+    s_nom_extendable_passive_branches = as_series("passive_branch_s_nom")
     for c in network.iterate_components(passive_branch_components):
         c.df['s_nom_opt'] = c.df.s_nom
         if c.df.s_nom_extendable.any():
@@ -969,11 +993,11 @@ def extract_optimisation_results(network, snapshots, formulation="angles"):
     network.links.p_nom_opt = network.links.p_nom
 
     network.links.loc[network.links.p_nom_extendable, "p_nom_opt"] = \
-        as_series(network.model.link_p_nom)
+        as_series("link_p_nom")
 
     if network.co2_limit is not None:
         try:
-            network.co2_price = - network.model.dual[network.model.co2_constraint]
+            network.co2_price = - solution.duals("co2_constraint")
         except (AttributeError, KeyError) as e:
             logger.warning("Could not read out co2_price, although a co2_limit was set")
 
@@ -981,7 +1005,7 @@ def extract_optimisation_results(network, snapshots, formulation="angles"):
 def network_lopf(network, snapshots=None, solver_name="glpk",
                  skip_pre=False, extra_functionality=None, solver_options={},
                  keep_files=False, formulation="angles", ptdf_tolerance=0.,
-                 free_memory={}):
+                 free_memory={}, backend="pyomo", horizon=None, overlap=0):
     """
     Linear optimal power flow for a group of snapshots.
 
@@ -1017,6 +1041,39 @@ def network_lopf(network, snapshots=None, solver_name="glpk",
         Any subset of {'pypsa', 'pyomo_hack'}. Beware that the
         pyomo_hack is slow and only tested on small systems.  Stash
         time series data and/or pyomo model away while the solver runs.
+    backend : string, default "pyomo"
+        "pyomo" builds a pyomo model; "sparse" assembles the problem
+        directly as sparse matrices in a pypsa.linopf.LinearProblem,
+        which is much faster to build for large networks and is solved
+        by one of pypsa.linopf.sparse_solvers: "scipy-highs" in
+        memory, or the command line solvers "glpk", "cbc" and
+        "gurobi", for which the problem is streamed to an LP file
+        while it is built.
+        With "sparse", network.model is the LinearProblem, which
+        extra_functionality may extend with add_variables,
+        add_constraints and add_objective; the 'pyomo_hack' of
+        free_memory does not apply.
+    horizon : int, default None
+        If given, the snapshots are optimised in consecutive windows of
+        `horizon` snapshots (a rolling horizon), each extended by the
+        following `overlap` snapshots. The state of charge of storage
+        units and the energy of stores at the end of each window are
+        the initial values of the next window, whose results replace
+        those of the overlap. Cyclic conditions are ignored, the
+        co2_limit applies to each window and extendable capacities are
+        optimised for each window separately. network.objective is the
+        sum of the objectives of the windows without the marginal costs
+        of their overlaps, so that each snapshot is counted once. If a
+        window fails, its status is returned, the following snapshots
+        keep their previous results and network.objective keeps its
+        value from before the call. Each window builds its model anew
+        rather than updating the model of the previous one, since
+        besides the initial state of charge and energy all of its
+        time-varying data (weightings, inflows, availabilities, loads)
+        change, which LOPFModel.update does not cover.
+    overlap : int, default 0
+        Number of snapshots by which each window of the rolling horizon
+        looks ahead.
 
     Returns
     -------
@@ -1035,6 +1092,225 @@ def network_lopf(network, snapshots=None, solver_name="glpk",
     if snapshots is None:
         snapshots = [network.now]
 
+    if horizon is not None:
+        return _network_lopf_rolling(network, snapshots, horizon, overlap,
+                                     dict(solver_name=solver_name, extra_functionality=extra_functionality,
+                                          solver_options=solver_options, keep_files=keep_files,
+                                          formulation=formulation, ptdf_tolerance=ptdf_tolerance,
+                                          free_memory=free_memory, backend=backend))
+
+    if isinstance(free_memory, string_types):
+        free_memory = {free_memory}
+
+    if backend == "sparse":
+        status, termination_condition = _network_lopf_sparse(network, snapshots, solver_name,
+                                                             extra_functionality, solver_options,
+                                                             keep_files, formulation, ptdf_tolerance,
+                                                             free_memory)
+        solution = network.model
+    elif backend == "pyomo":
+        status, termination_condition = _network_lopf_pyomo(network, snapshots, solver_name,
+                                                            extra_functionality, solver_options,
+                                                            keep_files, formulation, ptdf_tolerance,
+                                                            free_memory)
+        solution = None
+    else:
+        raise ValueError("backend must be one of 'pyomo' or 'sparse', got: {}".format(backend))
+
+    _extract_if_solved(network, snapshots, formulation, status, termination_condition, solution)
+
+    return status, termination_condition
+
+
+def _network_lopf_rolling(network, snapshots, horizon, overlap, lopf_kwargs):
+
+    if horizon < 1 or overlap < 0:
+        raise ValueError("horizon must be positive and overlap non-negative, got: {} and {}".format(horizon, overlap))
+
+    sus = network.storage_units
+    stores = network.stores
+
+    if sus.cyclic_state_of_charge.any() or stores.e_cyclic.any():
+        logger.warning("Cyclic state of charge and energy conditions are ignored in the rolling horizon LOPF")
+
+    initial = (sus.state_of_charge_initial.copy(), sus.cyclic_state_of_charge.copy(),
+               stores.e_initial.copy(), stores.e_cyclic.copy())
+
+    sus["cyclic_state_of_charge"] = False
+    stores["e_cyclic"] = False
+
+    #each window sets network.objective, which a failure restores
+    previous_objective = getattr(network, "objective", None)
+    objective = 0.
+    try:
+        for start in range(0, len(snapshots), horizon):
+            window = snapshots[start:start+horizon+overlap]
+            last = snapshots[min(start+horizon, len(snapshots))-1]
+
+            logger.info("Optimising snapshots %s to %s of the rolling horizon", window[0], window[-1])
+
+            #the topology and dependent values are only determined once
+            status, termination_condition = network_lopf(network, window, skip_pre=True, **lopf_kwargs)
+            if not (status == "ok" or (status == "warning" and termination_condition == "other")):
+                logger.error("Optimising snapshots %s to %s of the rolling horizon failed with status %s "
+                             "and condition %s; the results of the following snapshots are not updated "
+                             "and network.objective is unchanged", window[0], window[-1],
+                             status, termination_condition)
+                network.objective = previous_objective
+                return status, termination_condition
+
+            #the overlap is committed by the next window, so only the
+            #committed snapshots count towards the objective
+            solution = network.model if lopf_kwargs.get("backend") == "sparse" else _PyomoSolution(network)
+            objective += network.objective - _marginal_costs(network, snapshots[start+horizon:start+horizon+overlap],
+                                                             solution)
+
+            #hand the state at the end of the window over to the next one
+            if len(sus):
+                sus["state_of_charge_initial"] = network.storage_units_t.state_of_charge.loc[last]
+            if len(stores):
+                stores["e_initial"] = network.stores_t.e.loc[last]
+    finally:
+        (sus["state_of_charge_initial"], sus["cyclic_state_of_charge"],
+         stores["e_initial"], stores["e_cyclic"]) = initial
+
+    network.objective = objective
+
+    return status, termination_condition
+
+
+def _marginal_costs(network, snapshots, solution):
+    #weighted marginal costs of the dispatch in snapshots, as they
+    #enter the objective of define_linear_objective
+    costs = 0.
+    weightings = network.snapshot_weightings.loc[snapshots]
+    for name, df in [("generator_p", network.generators), ("storage_p_dispatch", network.storage_units),
+                     ("store_p", network.stores), ("link_p", network.links)]:
+        if len(snapshots) == 0 or df.empty:
+            continue
+        values = solution.values(name).unstack(0).loc[snapshots, df.index]
+        costs += values.mul(weightings, axis=0).dot(df.marginal_cost).sum()
+    return costs
+
+
+def _extract_if_solved(network, snapshots, formulation, status, termination_condition, solution=None):
+
+    if status == "ok" and termination_condition == "optimal":
+        logger.info("Optimization successful")
+        extract_optimisation_results(network,snapshots,formulation,solution)
+    elif status == "warning" and termination_condition == "other":
+        logger.warn("WARNING! Optimization might be sub-optimal. Writing output anyway")
+        extract_optimisation_results(network,snapshots,formulation,solution)
+    else:
+        logger.error("Optimisation failed with status %s and terminal condition %s"
+              % (status,termination_condition))
+
+
+def network_build_lopf(network, snapshots=None, solver_name="glpk", skip_pre=False,
+                       extra_functionality=None, solver_options={}, formulation="angles",
+                       ptdf_tolerance=0.):
+    """
+    Build the linear optimal power flow for a group of snapshots as a
+    persistent model, which can be updated in place and solved
+    repeatedly, so that the model is built once per topology instead
+    of once per scenario.
+
+    Parameters
+    ----------
+    snapshots : list or index slice
+        A list of snapshots to optimise, must be a subset of
+        network.snapshots, defaults to network.now
+    solver_name : string
+        One of pypsa.linopf.sparse_solvers, e.g. "glpk", "cbc" or
+        "scipy-highs"
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating
+        dependent values and finding bus controls.
+    extra_functionality : callable function
+        This function must take two arguments
+        `extra_functionality(network,snapshots)` and is called after
+        the model building is complete, with the LinearProblem in
+        network.model.
+    solver_options : dictionary
+        A dictionary with additional options that get passed to the
+        solver.
+    formulation : string
+        Formulation of the linear power flow equations to use; must be
+        one of ["angles","cycles","kirchhoff","ptdf"]
+    ptdf_tolerance : float
+        Value below which PTDF entries are ignored
+
+    Returns
+    -------
+    model : pypsa.linopf.LOPFModel
+        Use model.update(...) to change loads, availabilities, marginal
+        costs or the CO2 limit and model.solve() to solve it and write
+        the results to the network; model.close() removes the basis
+        which glpk keeps for warm starts.
+
+    Examples
+    --------
+    >>> model = network.build_lopf(network.snapshots, solver_name="scipy-highs")
+    >>> model.solve()
+    >>> model.update(loads=1.1*network.loads_t.p_set, co2_limit=1e6)
+    >>> model.solve()
+    """
+
+    from .linopf import build_lopf_problem, sparse_solvers, LOPFModel
+
+    if solver_name not in sparse_solvers:
+        raise ValueError("solver_name must be one of {}, got: {}"
+                         .format(sorted(sparse_solvers), solver_name))
+
+    if not skip_pre:
+        network.determine_network_topology()
+        calculate_dependent_values(network)
+        for sub_network in network.sub_networks.obj:
+            find_slack_bus(sub_network)
+        logger.info("Performed preliminary steps")
+
+    if snapshots is None:
+        snapshots = [network.now]
+
+    logger.info("Building sparse linear problem using `%s` formulation", formulation)
+    network.model = build_lopf_problem(network, snapshots, formulation, ptdf_tolerance)
+
+    if extra_functionality is not None:
+        extra_functionality(network,snapshots)
+
+    return LOPFModel(network, snapshots, network.model, formulation, solver_name, solver_options)
+
+
+def _network_lopf_sparse(network, snapshots, solver_name, extra_functionality,
+                         solver_options, keep_files, formulation, ptdf_tolerance, free_memory):
+
+    from .linopf import (build_lopf_problem, sparse_solvers, file_solvers,
+                         LinearProblem, LPFileProblem)
+
+    if solver_name not in sparse_solvers:
+        raise ValueError("solver_name must be one of {} for the sparse backend, got: {}"
+                         .format(sorted(sparse_solvers), solver_name))
+
+    logger.info("Building sparse linear problem using `%s` formulation", formulation)
+    lp = LPFileProblem() if solver_name in file_solvers else LinearProblem()
+    network.model = build_lopf_problem(network, snapshots, formulation, ptdf_tolerance, lp)
+
+    if extra_functionality is not None:
+        extra_functionality(network,snapshots)
+
+    logger.info("Solving model using %s", solver_name)
+    solve = sparse_solvers[solver_name]
+    if 'pypsa' in free_memory:
+        with empty_network(network):
+            status, termination_condition, network.results = solve(network.model, solver_options, keep_files)
+    else:
+        status, termination_condition, network.results = solve(network.model, solver_options, keep_files)
+
+    return status, termination_condition
+
+
+def _network_lopf_pyomo(network, snapshots, solver_name, extra_functionality, solver_options,
+                        keep_files, formulation, ptdf_tolerance, free_memory):
 
     logger.info("Building pyomo model using `%s` formulation", formulation)
     network.model = ConcreteModel("Linear Optimal Power Flow")
@@ -1081,9 +1357,6 @@ def network_lopf(network, snapshots=None, solver_name="glpk",
 
     patch_optsolver_record_memusage_before_solving(opt, network)
 
-    if isinstance(free_memory, string_types):
-        free_memory = {free_memory}
-
     if 'pyomo_hack' in free_memory:
         patch_optsolver_free_network_before_solving(opt, network.model)
 
@@ -1102,14 +1375,4 @@ def network_lopf(network, snapshots=None, solver_name="glpk",
     status = network.results["Solver"][0]["Status"].key
     termination_condition = network.results["Solver"][0]["Termination condition"].key
 
-    if status == "ok" and termination_condition == "optimal":
-        logger.info("Optimization successful")
-        extract_optimisation_results(network,snapshots,formulation)
-    elif status == "warning" and termination_condition == "other":
-        logger.warn("WARNING! Optimization might be sub-optimal. Writing output anyway")
-        extract_optimisation_results(network,snapshots,formulation)
-    else:
-        logger.error("Optimisation failed with status %s and terminal condition %s"
-              % (status,termination_condition))
-
     return status, termination_condition
@@ -27,22 +27,27 @@ __copyright__ = "Copyright 2015-2017 Tom Brown (FIAS), Jonas Hoersch (FIAS), GNU
 import logging
 logger = logging.getLogger(__name__)
 
-from scipy.sparse import issparse, csr_matrix, csc_matrix, hstack as shstack, vstack as svstack, dok_matrix
+from scipy.sparse import csr_matrix, csc_matrix, dok_matrix
 
 from numpy import r_, ones, zeros, newaxis
-from scipy.sparse.linalg import spsolve
+from scipy.sparse.linalg import spsolve, splu
 from numpy.linalg import norm
 
 import numpy as np
 import pandas as pd
-import scipy as sp, scipy.sparse
+import scipy as sp, scipy.sparse, scipy.sparse.csgraph
 import networkx as nx
 
 import collections, six
-from itertools import chain
-import time
+from itertools import chain, count
 
-from .descriptors import get_switchable_as_dense, allocate_series_dataframes
+from .descriptors import get_switchable_as_dense, allocate_series_dataframes, Dict
+from .pfsolvers import (JacobianPattern, _factorise, _LowRankUpdate, _options_key,
+                        _matrix_key, _from_cache, _to_cache, _cached, _map_chunks, _shared_pool,
+                        _snapshot_chunks, _unique_rows, _max_backtracks,
+                        _max_stalled_iterations, _check_step_control, _optimal_multipliers,
+                        _fast_decoupled_pf, _sweep_pf, _object_array,
+                        _pf_chunk, _lpf_chunk)
 
 def _as_snapshots(network, snapshots):
     if snapshots is None:
@@ -77,7 +82,132 @@ def _allocate_pf_outputs(network, linear=False):
 
 
 
-def _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, **kwargs):
+def _injection_operator(network, name, c, buses_i, bus="bus", weights=None):
+    """Sparse matrix mapping the columns of component c to the buses
+    buses_i, weighted by weights (default 1).
+
+    The matrix is kept in network._injection_operators under name
+    (e.g. the sub-network name), so that it survives the sub-networks
+    being determined anew, and is only built anew when the buses or
+    weights of the components change. Columns attached to buses outside
+    buses_i are dropped."""
+
+    index = c.df.index if c.ind is None else c.ind
+    bus_names = (c.df[bus] if c.ind is None else c.df.loc[index, bus]).values
+    weights = np.ones(len(index)) if weights is None else np.asarray(weights, dtype=float)
+
+    cache = network.__dict__.setdefault("_injection_operators", {})
+    entry = cache.get((name, c.name, bus))
+    if (entry is not None and entry[0].equals(index) and entry[1].equals(buses_i)
+        and np.array_equal(entry[2], bus_names) and np.array_equal(entry[3], weights)):
+        return entry[4]
+
+    rows = np.arange(len(index))
+    cols = buses_i.get_indexer(bus_names)
+    inside = cols >= 0
+    operator = csr_matrix((weights[inside], (rows[inside], cols[inside])),
+                          shape=(len(index), len(buses_i)))
+    cache[(name, c.name, bus)] = (index, buses_i, bus_names, weights, operator)
+    return operator
+
+
+def _bus_injections(network, name, snapshots, buses_i, one_ports=(), branches=(), n="p"):
+    """Return the power injections at buses_i as a len(snapshots) x
+    len(buses_i) array, from the dispatch n of the one port components
+    one_ports (times their sign) and from the power n0 and n1 withdrawn
+    by the branch components branches at their buses.
+
+    Each component contributes one sparse matrix product with the
+    operators cached for name, see _injection_operator."""
+
+    p = np.zeros((len(snapshots), len(buses_i)))
+
+    for c in one_ports:
+        index = c.df.index if c.ind is None else c.ind
+        operator = _injection_operator(network, name, c, buses_i, "bus", c.df.loc[index, "sign"].values)
+        p += c.pnl[n].loc[snapshots, index].values * operator
+
+    for c in branches:
+        index = c.df.index if c.ind is None else c.ind
+        for i in [0,1]:
+            operator = _injection_operator(network, name, c, buses_i, "bus"+str(i))
+            p -= c.pnl[n+str(i)].loc[snapshots, index].values * operator
+
+    return p
+
+
+#settings of the power flow solvers, which are passed to the power
+#flows as the single dict solver_options, see network_pf
+_solver_option_defaults = {"batch_size" : 100, "n_workers" : 1, "executor" : "process",
+                           "method" : "auto", "linear_solver" : None, "deduplicate" : False,
+                           "record_residuals" : False, "step_control" : None,
+                           "divergence_factor" : None, "enforce_q_limits" : False,
+                           "max_stacked_buses" : 0}
+
+
+def _solver_options(solver_options, names, **defaults):
+    """Return the values of the solver options names from the dict
+    solver_options, filled in from defaults and otherwise from
+    _solver_option_defaults; options which are not among names raise
+    a ValueError."""
+
+    solver_options = solver_options or {}
+    unknown = sorted(set(solver_options) - set(names))
+    if unknown:
+        raise ValueError("Unknown solver options {}, the options are: {}".format(unknown, ", ".join(names)))
+
+    return [solver_options.get(name, defaults.get(name, _solver_option_defaults.get(name)))
+            for name in names]
+
+
+
+def _B_factorisation(sub_network, linear_solver_options=None):
+    #factorisation of the weighted Laplacian B with the slack removed
+
+    def factorise(B):
+        return _factorise(B[1:, 1:], linear_solver_options,
+                          _restrict_order(find_bus_ordering(sub_network), np.arange(1, B.shape[0])))
+
+    options_key = _options_key(linear_solver_options)
+
+    changes = getattr(sub_network, "_B_changes", None)
+    if changes is None:
+        return _cached(sub_network, ("B", options_key), lambda: factorise(sub_network.B))
+
+    #B was changed by update_branches, so correct the factorisation of
+    #B before the first change for all changed branches
+    if options_key not in changes["factorisations"]:
+        B = changes["B"]
+        if options_key not in changes["base"]:
+            changes["base"][options_key] = _cached(sub_network, ("B", options_key),
+                                                   lambda: factorise(B), key=changes["key"])
+        base = changes["base"][options_key]
+
+        positions = np.array(sorted(changes["branches"]), dtype=int)
+        b_original, bus0, bus1 = (np.array([changes["branches"][l][i] for l in positions])
+                                  for i in range(3))
+        c = np.asarray(sub_network.H[positions, bus0]).ravel() - b_original
+        changed = c != 0.
+
+        if not changed.any():
+            solver = base
+        else:
+            n = B.shape[0]
+            k = changed.sum()
+            U = np.zeros((n, k))
+            U[bus0[changed], np.arange(k)] = 1.
+            U[bus1[changed], np.arange(k)] = -1.
+            solver = _LowRankUpdate(base, U[1:], c[changed])
+
+        changes["factorisations"][options_key] = solver
+
+    return changes["factorisations"][options_key]
+
+
+def _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, solver_options=None, **kwargs):
+
+    solver_options = dict(solver_options or {})
+    max_stacked_buses = solver_options.pop("max_stacked_buses", 0) if linear else 0
 
     if linear:
         sub_network_pf_fun = sub_network_lpf
@@ -99,16 +229,38 @@ def _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, **kw
         network.links_t.p0.loc[snapshots] = p_set.loc[snapshots]
         network.links_t.p1.loc[snapshots] = -p_set.loc[snapshots].multiply(network.links.efficiency)
 
-    for sub_network in network.sub_networks.obj:
-        if not skip_pre:
-            find_bus_controls(sub_network)
+    results = {}
 
-            branches_i = sub_network.branches_i()
-            if len(branches_i) > 0:
-                sub_network_prepare_fun(sub_network, skip_pre=True)
-        sub_network_pf_fun(sub_network, snapshots=snapshots, skip_pre=True, **kwargs)
+    sub_networks = network.sub_networks.obj
+    if linear and max_stacked_buses > 0:
+        n_buses = network.buses.sub_network.value_counts()
+        small = n_buses.reindex(network.sub_networks.index, fill_value=0) <= max_stacked_buses
+        if small.any():
+            _stacked_lpf(network, list(sub_networks[small]), snapshots, skip_pre, solver_options)
+            sub_networks = sub_networks[~small]
+
+    #the sub-networks share one pool of workers
+    with _shared_pool(solver_options) as shared_solver_options:
+        for sub_network in sub_networks:
+            if not skip_pre:
+                find_bus_controls(sub_network)
 
-def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False):
+                branches_i = sub_network.branches_i()
+                if len(branches_i) > 0:
+                    sub_network_prepare_fun(sub_network, skip_pre=True)
+            results[sub_network.name] = sub_network_pf_fun(sub_network, snapshots=snapshots, skip_pre=True,
+                                                           solver_options=shared_solver_options, **kwargs)
+
+    if not linear:
+        attrs = ["n_iter", "error", "converged", "duplicate", "seconds", "method"]
+        if solver_options.get("record_residuals"):
+            attrs.append("residuals")
+        network.pf_convergence = Dict({attr : pd.DataFrame({name : result[i] for name, result in results.items()},
+                                                           index=snapshots, columns=network.sub_networks.index)
+                                       for i, attr in enumerate(attrs)})
+        return network.pf_convergence
+
+def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False, solver_options=None):
     """
     Full non-linear power flow for generic network.
 
@@ -121,27 +273,190 @@ def network_pf(network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=Fal
         Skip the preliminary steps of computing topology, calculating dependent values and finding bus controls.
     x_tol: float
         Tolerance for Newton-Raphson power flow.
-    use_seed : bool, default False
-        Use a seed for the initial guess for the Newton-Raphson algorithm.
+    use_seed : bool|string, default False
+        Initial guess for the Newton-Raphson algorithm: "flat" (or
+        False) starts from the set-points and otherwise flat voltages,
+        "stored" (or True) from the voltages already in
+        network.buses_t, "chain" seeds each batch of snapshots with the
+        last converged snapshot before it (use the solver option
+        batch_size=1 to seed each snapshot with the previous one) and
+        "lpf" uses the voltage angles (voltage magnitudes for DC) of a
+        linear power flow.
+    solver_options : dict, default None
+        Settings of the solvers, all optional; unknown keys raise a
+        ValueError. The same dict is taken by the linear power flows,
+        which use the keys marked as such.
+
+        "batch_size" : int, default 100
+            Number of snapshots for which the Newton-Raphson iterations
+            are carried out together; the Jacobians of these snapshots
+            are factorised as a single block-diagonal matrix. Also used
+            by network.batch_lpf(), where it bounds the memory used for
+            intermediate arrays and defaults to 1000.
+        "n_workers" : int, default 1
+            Number of workers among which the batches of snapshots are
+            distributed (also network.batch_lpf()).
+        "executor" : string|pool, default "process"
+            Run the workers in a pool of processes ("process") or
+            threads ("thread"), which is started once per call and
+            shared by all sub-networks, or in a given pool with a
+            method map, like a multiprocessing.Pool, which is left
+            open; threads avoid copying the data but only run in
+            parallel while SciPy releases the GIL (also
+            network.batch_lpf()).
+        "method" : string, default "auto"
+            Solve with Newton-Raphson ("nr"), with the fast-decoupled
+            load flow ("fdlf"), which iterates with the constant
+            matrices B' and B'' factorised once per sub-network, or
+            with the backward/forward sweep ("sweep") for radial
+            sub-networks without PV buses; the latter two fall back to
+            Newton-Raphson for the snapshots where they do not
+            converge. "auto" uses the sweep for radial AC sub-networks
+            without PV buses and Newton-Raphson otherwise; since the
+            sweep converges only linearly, "auto" runs it to x_tol/1e4,
+            so that its solution is about as precise as that of
+            Newton-Raphson.
+        "linear_solver" : dict, default None
+            Options of the linear solver for the Newton steps, the
+            fast-decoupled load flow, the linear power flow seed and the
+            linear power flows: "solver" is one of "lu" (direct sparse
+            LU, the default), "gmres" or "bicgstab"; the iterative
+            solvers take "tol", "maxiter" and "restart" (GMRES only) and
+            are preconditioned with an incomplete LU factorisation,
+            which is computed once with "drop_tol" and "fill_factor"
+            (see scipy.sparse.linalg.spilu) and then reused.
+        "deduplicate" : bool, default False
+            Solve each distinct operating point, i.e. the power
+            injections and voltage set-points of a sub-network, only
+            once and copy the result to all snapshots with the same
+            operating point. The seeds of the snapshots are not
+            compared (also network.lpf()).
+        "record_residuals" : bool, default False
+            Also record the error after each iteration for each
+            snapshot.
+        "step_control" : string, default None
+            Control the size of the Newton-Raphson steps: None takes
+            full steps, "backtracking" halves the step of a snapshot
+            until its error decreases and "iwamoto" scales it by
+            Iwamoto's optimal multiplier; both help heavily loaded
+            snapshots to converge.
+        "divergence_factor" : float, default None
+            Give up on a snapshot as soon as its Newton-Raphson error
+            exceeds divergence_factor times its initial error, e.g.
+            1e3, or has not halved within five iterations, instead of
+            running all iterations.
+        "enforce_q_limits" : bool, default False
+            Switch a PV bus to a PQ bus at its reactive power limit as
+            soon as the converged reactive power of its PV generators
+            (whose limits q_min and q_max are added up) violates it,
+            and iterate on; the bus is not switched back. Only
+            Newton-Raphson enforces the limits and the slack is not
+            limited.
+        "max_stacked_buses" : int, default 0
+            Only network.lpf(): sub-networks with at most this many
+            buses are not solved one by one, but stacked into one
+            block-diagonal system, which is assembled, factorised and
+            solved once; this saves the overhead per sub-network for
+            networks with many small sub-networks, e.g. sector-coupled
+            models. Their matrices are not stored on the sub-networks.
 
     Returns
     -------
-    None
+    Dict
+        Dictionary with keys 'n_iter', 'error', 'converged',
+        'duplicate' (whether the result was copied from another
+        snapshot), 'seconds' (wall time of the batch in which the
+        snapshot was solved), 'method' (the method which converged,
+        e.g. "nr" or "fdlf+nr" if Newton-Raphson took over from the
+        fast-decoupled load flow) and, if record_residuals, 'residuals'
+        (arrays with the error before the first and after each
+        iteration), each a pandas.DataFrame indexed by snapshots with a
+        column for each sub-network. It is also stored as
+        network.pf_convergence, see network.pf_convergence_summary().
+    """
+
+    return _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False,
+                                       solver_options=solver_options, x_tol=x_tol, use_seed=use_seed)
+
+def pf_convergence_summary(network, n=10, by="seconds", non_converged=False):
+    """
+    Summarise the convergence of the last non-linear power flow by
+    snapshot, e.g. to find the slowest or the non-converged snapshots.
+
+    Parameters
+    ----------
+    n : int|None, default 10
+        Number of snapshots to return, all if None.
+    by : string, default "seconds"
+        Sort the snapshots by decreasing "seconds", "n_iter" or "error".
+    non_converged : bool, default False
+        Only return the snapshots for which some sub-network did not
+        converge.
+
+    Returns
+    -------
+    pandas.DataFrame
+        Indexed by snapshot with the columns n_iter and error (maximum
+        over the sub-networks), converged (for all sub-networks),
+        seconds (sum over the sub-networks) and method (the methods
+        which converged, joined by ",").
+
+    Examples
+    --------
+    >>> network.pf(network.snapshots)
+    >>> network.pf_convergence_summary(n=5, by="n_iter")
     """
 
-    _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=False, x_tol=x_tol, use_seed=use_seed)
+    info = getattr(network, "pf_convergence", None)
+    if info is None:
+        raise ValueError("No non-linear power flow has been run for this network")
+
+    if by not in ("seconds", "n_iter", "error"):
+        raise ValueError("by must be one of 'seconds', 'n_iter' or 'error', got: {}".format(by))
+
+    summary = pd.DataFrame({"n_iter" : info.n_iter.max(axis=1),
+                            "error" : info.error.max(axis=1),
+                            "converged" : info.converged.all(axis=1),
+                            "seconds" : info.seconds.sum(axis=1),
+                            "method" : info.method.apply(lambda r: ",".join(sorted(set(r.dropna()))), axis=1)},
+                           columns=["n_iter", "error", "converged", "seconds", "method"])
+
+    if non_converged:
+        summary = summary[~summary.converged]
+
+    summary = summary.sort_values(by, ascending=False)
+
+    return summary if n is None else summary.iloc[:n]
 
 
-def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100):
+def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100, linear_solver=None,
+                          step_control=None, divergence_factor=None):
     """Solve f(x) = 0 with initial guess for x and dfdx(x). dfdx(x) should
     return a sparse Jacobian.  Terminate if error on norm of f(x) is <
     x_tol or there were more than lim_iter iterations.
 
+    The Newton steps are computed with linear_solver(J, F), which
+    defaults to scipy.sparse.linalg.spsolve.
+
+    With step_control="backtracking" a step is halved (up to
+    _max_backtracks times) until it decreases the error, with
+    step_control="iwamoto" it is scaled by Iwamoto's optimal
+    multiplier. With divergence_factor the iterations are aborted as
+    soon as the error exceeds divergence_factor times the initial error
+    or has not halved within _max_stalled_iterations iterations.
+
     """
 
+    if linear_solver is None:
+        linear_solver = spsolve
+
+    _check_step_control(step_control)
+
     n_iter = 0
     F = f(guess)
     diff = norm(F,np.Inf)
+    initial_diff = best_diff = diff
+    stalled = 0
 
     logger.debug("Error at iteration %d: %f", n_iter, diff)
 
@@ -149,21 +464,118 @@ def newton_raphson_sparse(f, guess, dfdx, x_tol=1e-10, lim_iter=100):
 
         n_iter +=1
 
-        guess = guess - spsolve(dfdx(guess),F)
-
-        F = f(guess)
+        dx = linear_solver(dfdx(guess),F)
+
+        F_new = f(guess - dx)
+        if step_control == "iwamoto":
+            mu = _optimal_multipliers(F[newaxis,:], F_new[newaxis,:])[0]
+            if mu != 1.:
+                dx = mu*dx
+                F_new = f(guess - dx)
+        elif step_control == "backtracking":
+            for i in range(_max_backtracks):
+                if norm(F_new,np.Inf) < diff:
+                    break
+                dx = dx/2.
+                F_new = f(guess - dx)
+
+        guess = guess - dx
+        F = F_new
         diff = norm(F,np.Inf)
 
         logger.debug("Error at iteration %d: %f", n_iter, diff)
 
+        if divergence_factor is not None:
+            if diff < 0.5*best_diff:
+                best_diff, stalled = diff, 0
+            else:
+                stalled += 1
+            if not diff <= divergence_factor*initial_diff or stalled >= _max_stalled_iterations:
+                logger.warn("Aborting Newton-Raphson after %d iterations, since the error %f is diverging or stalling", n_iter, diff)
+                break
+
     if diff > x_tol:
         logger.warn("Warning, we didn't reach the required tolerance within %d iterations, error is at %f. See the section \"Troubleshooting\" in the documentation for tips to fix this. ", n_iter, diff)
 
     return guess, n_iter, diff
 
 
+def _radial_sweep_levels(sub_network):
+    """Precompute the parent/child ordering of the buses of a radial
+    sub-network for the backward/forward sweep.
+
+    The buses are ordered by their depth in the tree rooted at the
+    slack bus. For each depth level the positions of the buses, of
+    their parents and the two-port admittances of the branches to the
+    parents (from the parent side f to the child side t) are stored.
 
-def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False):
+    Returns
+    -------
+    levels : list of tuples
+        (buses, parents, y_ff, y_ft, y_tf, y_tt) for each depth level,
+        starting with the buses next to the slack.
+    y_shunt : numpy.ndarray
+        Shunt admittances at the buses which do not belong to branches.
+    """
+
+    from .components import passive_branch_components
+
+    buses_o = sub_network.buses_o
+    n_buses = len(buses_o)
+
+    bus0 = buses_o.get_indexer(np.concatenate([c.df.loc[c.ind, 'bus0'].values
+                                               for c in sub_network.iterate_components(passive_branch_components)]))
+    bus1 = buses_o.get_indexer(np.concatenate([c.df.loc[c.ind, 'bus1'].values
+                                               for c in sub_network.iterate_components(passive_branch_components)]))
+    branches = np.arange(len(bus0))
+
+    Y0 = sub_network.Y0.tocsr()
+    Y1 = sub_network.Y1.tocsr()
+    y00 = np.asarray(Y0[branches, bus0]).ravel()
+    y01 = np.asarray(Y0[branches, bus1]).ravel()
+    y10 = np.asarray(Y1[branches, bus0]).ravel()
+    y11 = np.asarray(Y1[branches, bus1]).ravel()
+
+    y_shunt = sub_network.Y.diagonal().astype(complex)
+    np.subtract.at(y_shunt, bus0, y00)
+    np.subtract.at(y_shunt, bus1, y11)
+
+    #number the branches in the adjacency matrix to find them again
+    adjacency = csr_matrix((r_[branches, branches] + 1., (r_[bus0, bus1], r_[bus1, bus0])),
+                           shape=(n_buses, n_buses))
+    order, parent = sp.sparse.csgraph.breadth_first_order(adjacency, 0, directed=False)
+
+    depth = zeros(n_buses, dtype=int)
+    for bus in order[1:]:
+        depth[bus] = depth[parent[bus]] + 1
+
+    levels = []
+    for d in range(1, depth.max() + 1 if n_buses > 1 else 1):
+        buses = (depth == d).nonzero()[0]
+        parents = parent[buses]
+        l = np.asarray(adjacency[buses, parents]).ravel().astype(int) - 1
+        forward = bus0[l] == parents
+        levels.append((buses, parents,
+                       np.where(forward, y00[l], y11[l]), np.where(forward, y01[l], y10[l]),
+                       np.where(forward, y10[l], y01[l]), np.where(forward, y11[l], y00[l])))
+
+    return levels, y_shunt
+
+
+def _lpf_seed(sub_network, p, linear_solver_options=None):
+    #voltage differences of the linear power flow for the active power
+    #injections p (snapshots x buses_o)
+    _B_H_like_Y(sub_network)
+    v_diff = zeros(p.shape)
+    B_lu = _B_factorisation(sub_network, linear_solver_options)
+    v_diff[:,1:] = B_lu.solve(np.asfortranarray((p[:,1:] - sub_network.p_bus_shift[1:]).T)).T
+    return v_diff
+
+
+#factor by which method="auto" tightens x_tol for the backward/forward sweep
+_auto_sweep_tol_factor = 1e-4
+
+def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_seed=False, solver_options=None):
     """
     Non-linear power flow for connected sub-network.
 
@@ -176,14 +588,44 @@ def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_
         Skip the preliminary steps of computing topology, calculating dependent values and finding bus controls.
     x_tol: float
         Tolerance for Newton-Raphson power flow.
-    use_seed : bool, default False
-        Use a seed for the initial guess for the Newton-Raphson algorithm.
+    use_seed : bool|string, default False
+        Initial guess for the Newton-Raphson algorithm: "flat" (or
+        False) starts from the set-points and otherwise flat voltages,
+        "stored" (or True) from the voltages already in
+        network.buses_t, "chain" seeds each batch of snapshots with the
+        last converged snapshot before it and "lpf" uses the voltage
+        angles (voltage magnitudes for DC) of a linear power flow.
+    solver_options : dict, default None
+        Settings of the solvers, see network_pf; all but
+        "max_stacked_buses" apply.
 
     Returns
     -------
-    None
+    n_iter : pandas.Series
+        Number of iterations for each snapshot.
+    error : pandas.Series
+        Remaining error of the power flow equations for each snapshot.
+    converged : pandas.Series
+        Whether the required tolerance was reached for each snapshot.
+    duplicate : pandas.Series
+        Whether the result of each snapshot was copied from an earlier
+        snapshot with the same operating point.
+    seconds : pandas.Series
+        Wall time of the batch in which each snapshot was solved (0 for
+        copied results).
+    method : pandas.Series
+        Method which converged for each snapshot, see network_pf.
+    residuals : pandas.Series|None
+        If record_residuals, arrays with the error before the first and
+        after each iteration for each snapshot.
     """
 
+    (batch_size, n_workers, executor, method, linear_solver_options, deduplicate, record_residuals,
+     step_control, divergence_factor, enforce_q_limits) = \
+        _solver_options(solver_options, ["batch_size", "n_workers", "executor", "method", "linear_solver",
+                                         "deduplicate", "record_residuals", "step_control",
+                                         "divergence_factor", "enforce_q_limits"])
+
     snapshots = _as_snapshots(sub_network.network, snapshots)
     logger.info("Performing non-linear load-flow on {} sub-network {} for snapshots {}".format(sub_network.network.sub_networks.at[sub_network.name,"carrier"], sub_network, snapshots))
 
@@ -213,135 +655,177 @@ def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_
 
         # set the power injection at each node from controllable components
         network.buses_t[n].loc[snapshots, buses_o] = \
-            sum([((c.pnl[n].loc[snapshots, c.ind] * c.df.loc[c.ind, 'sign'])
-                  .groupby(c.df.loc[c.ind, 'bus'], axis=1).sum()
-                  .reindex(columns=buses_o, fill_value=0.))
-                 for c in sub_network.iterate_components(controllable_one_port_components)])
-
-        if n == "p":
-            network.buses_t[n].loc[snapshots, buses_o] += sum(
-                [(- c.pnl[n+str(i)].loc[snapshots].groupby(c.df["bus"+str(i)], axis=1).sum()
-                  .reindex(columns=buses_o, fill_value=0))
-                 for c in network.iterate_components(controllable_branch_components)
-                 for i in [0,1]])
-
-    def f(guess):
-        network.buses_t.v_ang.loc[now,sub_network.pvpqs] = guess[:len(sub_network.pvpqs)]
-
-        network.buses_t.v_mag_pu.loc[now,sub_network.pqs] = guess[len(sub_network.pvpqs):]
-
-        v_mag_pu = network.buses_t.v_mag_pu.loc[now,buses_o]
-        v_ang = network.buses_t.v_ang.loc[now,buses_o]
-        V = v_mag_pu*np.exp(1j*v_ang)
-
-        mismatch = V*np.conj(sub_network.Y*V) - s
-
-        F = r_[mismatch.real[1:],mismatch.imag[1+len(sub_network.pvs):]]
-
-        return F
-
-
-    def dfdx(guess):
-
-        network.buses_t.v_ang.loc[now,sub_network.pvpqs] = guess[:len(sub_network.pvpqs)]
-
-        network.buses_t.v_mag_pu.loc[now,sub_network.pqs] = guess[len(sub_network.pvpqs):]
-
-        v_mag_pu = network.buses_t.v_mag_pu.loc[now,buses_o]
-        v_ang = network.buses_t.v_ang.loc[now,buses_o]
-
-        V = v_mag_pu*np.exp(1j*v_ang)
-
-        index = r_[:len(buses_o)]
-
-        #make sparse diagonal matrices
-        V_diag = csr_matrix((V,(index,index)))
-        V_norm_diag = csr_matrix((V/abs(V),(index,index)))
-        I_diag = csr_matrix((sub_network.Y*V,(index,index)))
-
-        dS_dVa = 1j*V_diag*np.conj(I_diag - sub_network.Y*V_diag)
-
-        dS_dVm = V_norm_diag*np.conj(I_diag) + V_diag * np.conj(sub_network.Y*V_norm_diag)
-
-        J00 = dS_dVa[1:,1:].real
-        J01 = dS_dVm[1:,1+len(sub_network.pvs):].real
-        J10 = dS_dVa[1+len(sub_network.pvs):,1:].imag
-        J11 = dS_dVm[1+len(sub_network.pvs):,1+len(sub_network.pvs):].imag
-
-        J = svstack([
-            shstack([J00, J01]),
-            shstack([J10, J11])
-        ], format="csr")
-
-        return J
-
+            _bus_injections(network, sub_network.name, snapshots, buses_o,
+                            sub_network.iterate_components(controllable_one_port_components),
+                            network.iterate_components(controllable_branch_components) if n == "p" else (),
+                            n=n)
 
     #Set what we know: slack V and v_mag_pu for PV buses
-    v_mag_pu_set = get_switchable_as_dense(network, 'Bus', 'v_mag_pu_set', snapshots)
-    network.buses_t.v_mag_pu.loc[snapshots,sub_network.pvs] = v_mag_pu_set.loc[:,sub_network.pvs]
-    network.buses_t.v_mag_pu.loc[snapshots,sub_network.slack_bus] = v_mag_pu_set.loc[:,sub_network.slack_bus]
-    network.buses_t.v_ang.loc[snapshots,sub_network.slack_bus] = 0.
+    #(buses_o is ordered slack, PVs, PQs)
+    pvpq_i = np.arange(1, len(buses_o))
+    pq_i = np.arange(1 + len(sub_network.pvs), len(buses_o))
 
-    if not use_seed:
-        network.buses_t.v_mag_pu.loc[snapshots,sub_network.pqs] = 1.
-        network.buses_t.v_ang.loc[snapshots,sub_network.pvpqs] = 0.
+    use_seed = {False : "flat", True : "stored"}.get(use_seed, use_seed)
+    if use_seed not in ("flat", "stored", "chain", "lpf"):
+        raise ValueError("use_seed must be one of False, True, 'flat', 'stored', 'chain' or 'lpf', got: {}".format(use_seed))
 
-    ss = np.empty((len(snapshots), len(buses_o)), dtype=np.complex)
-    roots = np.empty((len(snapshots), len(sub_network.pvpqs) + len(sub_network.pqs)))
-    for i, now in enumerate(snapshots):
-        p = network.buses_t.p.loc[now,buses_o]
-        q = network.buses_t.q.loc[now,buses_o]
-        ss[i] = s = p + 1j*q
+    v_mag_pu_set = get_switchable_as_dense(network, 'Bus', 'v_mag_pu_set', snapshots)
+    v_mag_pu_set = v_mag_pu_set.loc[:,buses_o[:1+len(sub_network.pvs)]].values
+
+    ss = (network.buses_t.p.loc[snapshots,buses_o].values
+          + 1j*network.buses_t.q.loc[snapshots,buses_o].values)
+
+    #reactive power limits of the PV buses, from the limits of their PV generators
+    is_ac = network.sub_networks.at[sub_network.name,"carrier"] != "DC"
+    q_limits = enforce_q_limits and is_ac and len(sub_network.pvs) > 0
+    if q_limits:
+        gens = network.generators
+        pv_gens = gens.index[(gens.control == "PV") & gens.bus.isin(sub_network.pvs)]
+        q_gens = network.generators_t.q.loc[snapshots,pv_gens]
+        q_min, q_max = [(gens.loc[pv_gens,attr] - q_gens).groupby(gens.loc[pv_gens,"bus"], axis=1).sum()
+                        .reindex(columns=sub_network.pvs).values + ss[:,1:1+len(sub_network.pvs)].imag
+                        for attr in ("q_min", "q_max")]
+
+    #only solve the distinct operating points
+    if deduplicate:
+        unique, inverse = _unique_rows(ss, v_mag_pu_set, *([q_min, q_max] if q_limits else []))
+        logger.info("Solving %d distinct operating points for %d snapshots of sub-network %s",
+                    len(unique), len(snapshots), sub_network)
+    else:
+        unique = np.arange(len(snapshots))
 
-        #Make a guess for what we don't know: V_ang for PV and PQs and v_mag_pu for PQ buses
-        guess = r_[network.buses_t.v_ang.loc[now,sub_network.pvpqs],network.buses_t.v_mag_pu.loc[now,sub_network.pqs]]
+    if use_seed == "stored":
+        v_mag_pu = network.buses_t.v_mag_pu.loc[snapshots,buses_o].values[unique]
+        v_ang = network.buses_t.v_ang.loc[snapshots,buses_o].values[unique]
+    else:
+        v_mag_pu = np.ones((len(unique), len(buses_o)))
+        v_ang = np.zeros((len(unique), len(buses_o)))
 
-        #Now try and solve
-        start = time.time()
-        roots[i], n_iter, diff = newton_raphson_sparse(f,guess,dfdx,x_tol=x_tol)
-        logger.info("Newton-Raphson solved in %d iterations with error of %f in %f seconds", n_iter,diff,time.time()-start)
+    if use_seed == "lpf" and len(branches_i) > 0:
+        v_diff = _lpf_seed(sub_network, ss.real[unique], linear_solver_options)
+        if network.sub_networks.at[sub_network.name,"carrier"] == "DC":
+            v_mag_pu += v_diff
+        else:
+            v_ang = v_diff
+
+    v_mag_pu[:,:1+len(sub_network.pvs)] = v_mag_pu_set[unique]
+    v_ang[:,0] = 0.
+
+    #the Jacobian pattern is kept for as long as Y and the bus controls
+    #don't change; with reactive power limits the voltage magnitudes of
+    #the PV buses are unknowns as well
+    bus_order = find_bus_ordering(sub_network)
+    mag_i = pvpq_i if q_limits else pq_i
+    jacobian = getattr(sub_network, "_jacobian", None)
+    if jacobian is None or not jacobian.matches(sub_network.Y, pvpq_i, mag_i, linear_solver_options, bus_order):
+        jacobian = sub_network._jacobian = _cached(sub_network, ("jacobian", _options_key(linear_solver_options), q_limits),
+                                                   lambda: JacobianPattern(sub_network.Y, pvpq_i, mag_i,
+                                                                           linear_solver_options, bus_order))
+
+    #find the column ordering before the pattern is shared with any workers
+    if jacobian.perm_c is None and jacobian.n > 0:
+        jacobian.analyse(v_mag_pu[:1]*np.exp(1j*v_ang[:1]))
+
+    n_iter = zeros(len(unique), dtype=int)
+    diff = zeros(len(unique))
+
+    if method not in ("auto", "nr", "fdlf", "sweep"):
+        raise ValueError("method must be one of 'auto', 'nr', 'fdlf' or 'sweep', got: {}".format(method))
+
+    #sub-networks are connected, so they are radial if they have one branch less than buses
+    is_radial = len(branches_i) == len(buses_o) - 1
+    solver_tol = x_tol
+    if method == "auto":
+        method = "sweep" if is_ac and is_radial and len(sub_network.pvs) == 0 and jacobian.n > 0 else "nr"
+        #the sweep converges only linearly, so that it stops just below
+        #x_tol, whereas the last Newton-Raphson step usually ends far
+        #below; run it to a tighter tolerance to be as precise
+        if method == "sweep":
+            solver_tol = _auto_sweep_tol_factor*x_tol
+    elif method == "sweep" and not (is_radial and len(sub_network.pvs) == 0):
+        raise ValueError("The backward/forward sweep is only available for radial sub-networks without PV buses, "
+                         "which sub-network {} is not".format(sub_network))
+
+    solver = None
+    if method == "fdlf":
+        if not is_ac:
+            logger.info("The fast-decoupled load flow is not available for DC sub-networks, using Newton-Raphson for sub-network {}".format(sub_network))
+        elif q_limits:
+            logger.info("Reactive power limits are only enforced by Newton-Raphson, using it for sub-network {}".format(sub_network))
+        elif jacobian.n > 0:
+            #XB version: B' from the series reactances only, B'' from the full admittance matrix
+            _B_H_like_Y(sub_network)
+            Bp = sub_network.B[pvpq_i,:][:,pvpq_i]
+            Bpp = -sub_network.Y.imag[pq_i,:][:,pq_i]
+            options_key = _options_key(linear_solver_options)
+            solver = ("fdlf", "Fast-decoupled load flow", _fast_decoupled_pf,
+                      (_cached(sub_network, ("Bp", options_key),
+                               lambda: _factorise(Bp, linear_solver_options, _restrict_order(bus_order, pvpq_i))),
+                       _cached(sub_network, ("Bpp", options_key),
+                               lambda: _factorise(Bpp, linear_solver_options, _restrict_order(bus_order, pq_i)))
+                       if len(pq_i) else None), solver_tol)
+    elif method == "sweep" and jacobian.n > 0:
+        solver = ("sweep", "Backward/forward sweep", _sweep_pf, _radial_sweep_levels(sub_network), solver_tol)
+
+    seconds = zeros(len(unique))
+    methods = np.empty(len(unique), dtype=object)
+    residuals = [] if record_residuals else None
+
+    chunks = _snapshot_chunks(len(unique), n_workers)
+    nr_options = dict(step_control=step_control, divergence_factor=divergence_factor)
+    q_limits = ((np.arange(1, 1+len(sub_network.pvs)), v_mag_pu_set[unique][:,1:], q_min[unique], q_max[unique])
+                if q_limits else None)
+    results = _map_chunks(_pf_chunk, (jacobian, ss[unique], v_mag_pu, v_ang, x_tol, batch_size, use_seed == "chain",
+                                      solver, record_residuals, nr_options, q_limits),
+                          chunks, n_workers=n_workers, executor=executor)
+    for chunk, result in zip(chunks, results):
+        v_mag_pu[chunk], v_ang[chunk], n_iter[chunk], diff[chunk], seconds[chunk], methods[chunk] = result[:6]
+        if record_residuals:
+            residuals += result[6]
+
+    #copy the solutions to the snapshots with the same operating point
+    duplicate = np.ones(len(snapshots), dtype=bool)
+    duplicate[unique] = False
+    if deduplicate:
+        v_mag_pu, v_ang, n_iter, diff = v_mag_pu[inverse], v_ang[inverse], n_iter[inverse], diff[inverse]
+        seconds = np.where(duplicate, 0., seconds[inverse])
+        methods = methods[inverse]
+        if record_residuals:
+            residuals = [residuals[i] for i in inverse]
+
+    converged = diff <= x_tol
+    if not converged.all():
+        logger.warn("Warning, we didn't reach the required tolerance within %d iterations for the snapshots %s. See the section \"Troubleshooting\" in the documentation for tips to fix this. ",
+                    n_iter.max(), list(snapshots[~converged]))
 
     #now set everything
-    network.buses_t.v_ang.loc[snapshots,sub_network.pvpqs] = roots[:,:len(sub_network.pvpqs)]
-    network.buses_t.v_mag_pu.loc[snapshots,sub_network.pqs] = roots[:,len(sub_network.pvpqs):]
-
-    v_mag_pu = network.buses_t.v_mag_pu.loc[snapshots,buses_o].values
-    v_ang = network.buses_t.v_ang.loc[snapshots,buses_o].values
+    network.buses_t.v_ang.loc[snapshots,buses_o] = v_ang
+    network.buses_t.v_mag_pu.loc[snapshots,buses_o] = v_mag_pu
 
     V = v_mag_pu*np.exp(1j*v_ang)
 
-    #add voltages to branches
+    #branch flows for all snapshots at once
     buses_indexer = buses_o.get_indexer
-    branch_bus0 = []; branch_bus1 = []
-    for c in sub_network.iterate_components(passive_branch_components):
-        branch_bus0 += list(c.df.loc[c.ind, 'bus0'])
-        branch_bus1 += list(c.df.loc[c.ind, 'bus1'])
-    v0 = V[:,buses_indexer(branch_bus0)]
-    v1 = V[:,buses_indexer(branch_bus1)]
-
-    i0 = np.empty((len(snapshots), sub_network.Y0.shape[0]), dtype=np.complex)
-    i1 = np.empty((len(snapshots), sub_network.Y1.shape[0]), dtype=np.complex)
-    for i, now in enumerate(snapshots):
-        i0[i] = sub_network.Y0*V[i]
-        i1[i] = sub_network.Y1*V[i]
-
-    s0 = pd.DataFrame(v0*np.conj(i0), columns=branches_i, index=snapshots)
-    s1 = pd.DataFrame(v1*np.conj(i1), columns=branches_i, index=snapshots)
-    for c in sub_network.iterate_components(passive_branch_components):
-        s0t = s0.loc[:,c.name]
-        s1t = s1.loc[:,c.name]
-        c.pnl.p0.loc[snapshots,s0t.columns] = s0t.values.real
-        c.pnl.q0.loc[snapshots,s0t.columns] = s0t.values.imag
-        c.pnl.p1.loc[snapshots,s1t.columns] = s1t.values.real
-        c.pnl.q1.loc[snapshots,s1t.columns] = s1t.values.imag
-
-    s_calc = np.empty((len(snapshots), len(buses_o)), dtype=np.complex)
-    for i in np.arange(len(snapshots)):
-        s_calc[i] = V[i]*np.conj(sub_network.Y*V[i])
-    slack_index = buses_o.get_loc(sub_network.slack_bus)
-    network.buses_t.p.loc[snapshots,sub_network.slack_bus] = s_calc[:,slack_index].real
-    network.buses_t.q.loc[snapshots,sub_network.slack_bus] = s_calc[:,slack_index].imag
-    network.buses_t.q.loc[snapshots,sub_network.pvs] = s_calc[:,buses_indexer(sub_network.pvs)].imag
+    if len(branches_i) > 0:
+        branch_bus0 = np.concatenate([c.df.loc[c.ind, 'bus0'].values
+                                      for c in sub_network.iterate_components(passive_branch_components)])
+        branch_bus1 = np.concatenate([c.df.loc[c.ind, 'bus1'].values
+                                      for c in sub_network.iterate_components(passive_branch_components)])
+        s0 = V[:,buses_indexer(branch_bus0)]*np.conj((sub_network.Y0*V.T).T)
+        s1 = V[:,buses_indexer(branch_bus1)]*np.conj((sub_network.Y1*V.T).T)
+
+        for c in sub_network.iterate_components(passive_branch_components):
+            sl = branches_i.get_loc(c.name)
+            c.pnl.p0.loc[snapshots,c.ind] = s0[:,sl].real
+            c.pnl.q0.loc[snapshots,c.ind] = s0[:,sl].imag
+            c.pnl.p1.loc[snapshots,c.ind] = s1[:,sl].real
+            c.pnl.q1.loc[snapshots,c.ind] = s1[:,sl].imag
+
+    #power at the slack and the PV buses (buses_o starts with the slack, then the PVs)
+    slack_pvs = buses_o[:1+len(sub_network.pvs)]
+    s_calc = V[:,:len(slack_pvs)]*np.conj((sub_network.Y[:len(slack_pvs),:]*V.T).T)
+    network.buses_t.p.loc[snapshots,sub_network.slack_bus] = s_calc[:,0].real
+    network.buses_t.q.loc[snapshots,slack_pvs] = s_calc.imag
 
     #set shunt impedance powers
     shunt_impedances_i = sub_network.shunt_impedances_i()
@@ -351,14 +835,17 @@ def sub_network_pf(sub_network, snapshots=None, skip_pre=False, x_tol=1e-6, use_
         network.shunt_impedances_t.p.loc[snapshots,shunt_impedances_i] = (shunt_impedances_v_mag_pu**2)*network.shunt_impedances.loc[shunt_impedances_i, 'g_pu'].values
         network.shunt_impedances_t.q.loc[snapshots,shunt_impedances_i] = (shunt_impedances_v_mag_pu**2)*network.shunt_impedances.loc[shunt_impedances_i, 'b_pu'].values
 
-    #let slack generator take up the slack
-    network.generators_t.p.loc[snapshots,sub_network.slack_generator] += network.buses_t.p.loc[snapshots,sub_network.slack_bus] - ss[:,slack_index].real
-    network.generators_t.q.loc[snapshots,sub_network.slack_generator] += network.buses_t.q.loc[snapshots,sub_network.slack_bus] - ss[:,slack_index].imag
+    #let slack generator take up the slack and set the Q of the PV generators
+    network.generators_t.p.loc[snapshots,sub_network.slack_generator] += s_calc[:,0].real - ss[:,0].real
+    slack_pv_generators = [sub_network.slack_generator] + list(network.buses.loc[sub_network.pvs, "generator"])
+    network.generators_t.q.loc[snapshots,slack_pv_generators] += s_calc.imag - ss[:,:len(slack_pvs)].imag
 
-    #set the Q of the PV generators
-    network.generators_t.q.loc[snapshots,network.buses.loc[sub_network.pvs, "generator"]] += np.asarray(network.buses_t.q.loc[snapshots,sub_network.pvs] - ss[:,buses_indexer(sub_network.pvs)].imag)
+    return (pd.Series(n_iter, snapshots), pd.Series(diff, snapshots),
+            pd.Series(converged, snapshots), pd.Series(duplicate, snapshots),
+            pd.Series(seconds, snapshots), pd.Series(methods, snapshots),
+            pd.Series(_object_array(residuals), snapshots) if record_residuals else None)
 
-def network_lpf(network, snapshots=None, skip_pre=False):
+def network_lpf(network, snapshots=None, skip_pre=False, solver_options=None):
     """
     Linear power flow for generic network.
 
@@ -370,13 +857,19 @@ def network_lpf(network, snapshots=None, skip_pre=False):
     skip_pre: bool, default False
         Skip the preliminary steps of computing topology, calculating
         dependent values and finding bus controls.
+    solver_options : dict, default None
+        Settings of the solvers, see network_pf; "linear_solver",
+        "deduplicate" and "max_stacked_buses" apply.
 
     Returns
     -------
     None
     """
 
-    _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=True)
+    _solver_options(solver_options, ["linear_solver", "deduplicate", "max_stacked_buses"])
+
+    _network_prepare_and_run_pf(network, snapshots, skip_pre, linear=True,
+                                solver_options=solver_options)
 
 
 def apply_line_types(network):
@@ -508,35 +1001,56 @@ def calculate_dependent_values(network):
 def find_slack_bus(sub_network):
     """Find the slack bus in a connected sub-network."""
 
-    gens = sub_network.generators()
-
-    if len(gens) == 0:
-        logger.warn("No generators in sub-network {}, better hope power is already balanced".format(sub_network.name))
-        sub_network.slack_generator = None
-        sub_network.slack_bus = sub_network.buses_i()[0]
-
-    else:
-
-        slacks = gens[gens.control == "Slack"].index
-
-        if len(slacks) == 0:
-            sub_network.slack_generator = gens.index[0]
-            sub_network.network.generators.loc[sub_network.slack_generator,"control"] = "Slack"
-            logger.debug("No slack generator found in sub-network {}, using {} as the slack generator".format(sub_network.name, sub_network.slack_generator))
-
-        elif len(slacks) == 1:
-            sub_network.slack_generator = slacks[0]
-        else:
-            sub_network.slack_generator = slacks[0]
-            sub_network.network.generators.loc[slacks[1:],"control"] = "PV"
-            logger.debug("More than one slack generator found in sub-network {}, using {} as the slack generator".format(sub_network.name, sub_network.slack_generator))
-
-        sub_network.slack_bus = gens.bus[sub_network.slack_generator]
+    _find_slack_buses(sub_network.network, [sub_network])
+
+
+def _find_slack_buses(network, sub_networks):
+    #find_slack_bus for many sub-networks at once, with a few
+    #operations on the whole DataFrames instead of a few per
+    #sub-network
+
+    names = pd.Index([sn.name for sn in sub_networks])
+    bus_sub_network = network.buses.sub_network
+    buses_i = network.buses.index[bus_sub_network.isin(names)]
+
+    gens = network.generators
+    gen_sub_network = gens.bus.map(bus_sub_network)
+    gens_i = gens.index[gen_sub_network.isin(names)]
+    gen_sub_network = gen_sub_network[gens_i]
+
+    #the slack generator is the first one with control "Slack", which
+    #is otherwise given to the first one; further slack generators
+    #become PV
+    is_slack = (gens.control[gens_i] == "Slack").values
+    slack_gens = gens_i[is_slack].to_series().groupby(gen_sub_network[is_slack]).first()
+    first_gens = gens_i.to_series().groupby(gen_sub_network).first()
+    new_slack_gens = first_gens.drop(slack_gens.index)
+    demoted = gens_i[is_slack].difference(slack_gens.values)
+    network.generators.loc[new_slack_gens.values, "control"] = "Slack"
+    network.generators.loc[demoted, "control"] = "PV"
+    slack_gens = pd.concat([slack_gens, new_slack_gens]).astype(object).reindex(names)
+
+    has_gens = slack_gens.notnull().values
+    for name in names[~has_gens]:
+        logger.warn("No generators in sub-network {}, better hope power is already balanced".format(name))
+    for name, gen in new_slack_gens.iteritems():
+        logger.debug("No slack generator found in sub-network %s, using %s as the slack generator", name, gen)
+    for name in gen_sub_network[demoted].unique():
+        logger.debug("More than one slack generator found in sub-network %s, using %s as the slack generator",
+                     name, slack_gens[name])
+
+    #without generators the slack bus is the first bus
+    slack_buses = buses_i.to_series().groupby(bus_sub_network[buses_i]).first().reindex(names)
+    slack_buses[has_gens] = gens.bus[slack_gens[has_gens]].values
+
+    for sub_network, slack_generator, has, slack_bus in zip(sub_networks, slack_gens, has_gens, slack_buses):
+        sub_network.slack_generator = slack_generator if has else None
+        sub_network.slack_bus = slack_bus
 
     #also put it into the dataframe
-    sub_network.network.sub_networks.at[sub_network.name,"slack_bus"] = sub_network.slack_bus
+    network.sub_networks.loc[names, "slack_bus"] = slack_buses.values
 
-    logger.info("Slack bus for sub-network {} is {}".format(sub_network.name, sub_network.slack_bus))
+    logger.info("Slack buses for sub-networks %s are %s", list(names), list(slack_buses))
 
 
 def find_bus_controls(sub_network):
@@ -544,56 +1058,128 @@ def find_bus_controls(sub_network):
     This function also fixes sub_network.buses_o, a DataFrame
     ordered by control type."""
 
-    network = sub_network.network
+    _find_bus_controls(sub_network.network, [sub_network])
 
-    find_slack_bus(sub_network)
 
-    gens = sub_network.generators()
-    buses_i = sub_network.buses_i()
+def _find_bus_controls(network, sub_networks):
+    #find_bus_controls for many sub-networks at once
 
-    #default bus control is PQ
-    network.buses.loc[buses_i, "control"] = "PQ"
+    _find_slack_buses(network, sub_networks)
+
+    names = pd.Index([sn.name for sn in sub_networks])
+    bus_sub_network = network.buses.sub_network
+    buses_i = network.buses.index[bus_sub_network.isin(names)]
+    gens = network.generators
+    gens_i = gens.index[gens.bus.map(bus_sub_network).isin(names)]
 
-    #find all buses with one or more gens with PV
-    pvs = gens[gens.control == 'PV'].index.to_series().groupby(gens.bus).first()
+    #default bus control is PQ, then PV for buses with PV generators
+    network.buses.loc[buses_i, "control"] = "PQ"
+    is_pv = (gens.control[gens_i] == "PV").values
+    pvs = gens_i[is_pv].to_series().groupby(gens.bus[gens_i[is_pv]]).first()
     network.buses.loc[pvs.index, "control"] = "PV"
     network.buses.loc[pvs.index, "generator"] = pvs
 
-    network.buses.loc[sub_network.slack_bus, "control"] = "Slack"
-    network.buses.loc[sub_network.slack_bus, "generator"] = sub_network.slack_generator
+    slack_buses = [sn.slack_bus for sn in sub_networks]
+    network.buses.loc[slack_buses, "control"] = "Slack"
+    network.buses.loc[slack_buses, "generator"] = [sn.slack_generator for sn in sub_networks]
+
+    #order the buses of each sub-network: slack, PVs, PQs
+    rank = network.buses.control[buses_i].map({"Slack" : 0, "PV" : 1, "PQ" : 2}).values
+    position = names.get_indexer(bus_sub_network[buses_i])
+    order = np.lexsort((np.arange(len(buses_i)), rank, position))
+    buses_o, rank = buses_i[order], rank[order]
+    bounds = np.searchsorted(position[order], np.arange(len(names)+1))
 
-    buses_control = network.buses.loc[buses_i, "control"]
-    sub_network.pvs = buses_control.index[buses_control == "PV"]
-    sub_network.pqs = buses_control.index[buses_control == "PQ"]
+    for i, sub_network in enumerate(sub_networks):
+        sub_network.buses_o = buses_o[bounds[i]:bounds[i+1]]
+        n_pvs = (rank[bounds[i]:bounds[i+1]] == 1).sum()
+        sub_network.pvs = sub_network.buses_o[1:1+n_pvs]
+        sub_network.pqs = sub_network.buses_o[1+n_pvs:]
+        sub_network.pvpqs = sub_network.buses_o[1:]
 
-    sub_network.pvpqs = sub_network.pvs.append(sub_network.pqs)
+        #the matrices have to be calculated (or found in the cache) again
+        sub_network._matrix_key = None
+
+
+def find_bus_ordering(sub_network):
+    """Find a fill-reducing ordering of the buses of a sub_network.
+
+    The buses are put into minimum degree order for the bus graph
+    (with SuperLU's MMD ordering of the weighted Laplacian pattern).
+    All factorisations of B, Y and the Jacobian reorder their rows and
+    columns accordingly, which reduces the fill-in of the LU factors
+    for large meshed networks; the results are still reported in the
+    order of sub_network.buses_o.
+
+    Sets sub_network.bus_order, the integer positions of the buses in
+    sub_network.buses_o in their fill-reducing order. It only depends
+    on the topology and the bus controls, so it is computed once and
+    kept for as long as sub_network.buses_o does not change.
+
+    Returns
+    -------
+    bus_order : numpy.ndarray
+    """
+
+    buses_o = sub_network.buses_o
 
-    # order buses
-    sub_network.buses_o = sub_network.pvpqs.insert(0, sub_network.slack_bus)
+    cached = getattr(sub_network, "_bus_order_buses", None)
+    if cached is not None and cached.equals(buses_o):
+        return sub_network.bus_order
+
+    if _from_cache(sub_network, "bus_order"):
+        sub_network._bus_order_buses = buses_o
+        return sub_network.bus_order
+
+    #pattern of the weighted Laplacian, made regular so that SuperLU
+    #keeps to the diagonal
+    K = abs(sub_network.incidence_matrix(busorder=buses_o))
+    A = csc_matrix(K*K.T + sp.sparse.identity(len(buses_o)))
+
+    perm_c = splu(A, permc_spec="MMD_AT_PLUS_A", options=dict(SymmetricMode=True)).perm_c
+    sub_network.bus_order = np.argsort(perm_c)
+    sub_network._bus_order_buses = buses_o
+    _to_cache(sub_network, "bus_order", ["bus_order"])
+
+    return sub_network.bus_order
+
+
+def _restrict_order(bus_order, buses):
+    #fill-reducing order of the subset buses (integer positions in
+    #buses_o), as positions within buses
+    position = -ones(len(bus_order), dtype=int)
+    position[buses] = np.arange(len(buses))
+    position = position[bus_order]
+    return position[position >= 0]
 
 
 def calculate_B_H(sub_network,skip_pre=False):
     """Calculate B and H matrices for AC or DC sub-networks."""
 
-    from .components import passive_branch_components
-
     network = sub_network.network
 
     if not skip_pre:
         calculate_dependent_values(network)
         find_bus_controls(sub_network)
 
-    if network.sub_networks.at[sub_network.name,"carrier"] == "DC":
-        attribute="r_pu"
-    else:
-        attribute="x_pu"
+    _discard_updates(sub_network, "B")
+    _build_B_H(sub_network)
+
+
+def _build_B_H(sub_network):
+    #B, H and the phase shift injections from the branch data, or from
+    #the matrix cache for the current matrix key
+
+    network = sub_network.network
+
+    if _from_cache(sub_network, "B_H"):
+        return
 
     #following leans heavily on pypower.makeBdc
 
     #susceptances
-    b = 1./np.concatenate([(c.df.loc[c.ind, attribute]*c.df.loc[c.ind, "tap_ratio"]).values if c.name == "Transformer"
-                           else c.df.loc[c.ind, attribute].values
-                           for c in sub_network.iterate_components(passive_branch_components)])
+    b, p_branch_shift = _branch_susceptances(sub_network.branches(),
+                                             network.sub_networks.at[sub_network.name,"carrier"])
 
 
     if np.isnan(b).any():
@@ -609,13 +1195,13 @@ def calculate_B_H(sub_network,skip_pre=False):
     sub_network.B = sub_network.K * sub_network.H
 
 
-    sub_network.p_branch_shift = -b*np.concatenate([(c.df.loc[c.ind, "phase_shift"]).values*np.pi/180. if c.name == "Transformer"
-                                                    else np.zeros((len(c.ind),))
-                                                    for c in sub_network.iterate_components(passive_branch_components)])
+    sub_network.p_branch_shift = p_branch_shift
 
     sub_network.p_bus_shift = sub_network.K * sub_network.p_branch_shift
 
-def calculate_PTDF(sub_network,skip_pre=False):
+    _to_cache(sub_network, "B_H", ["K", "H", "B", "p_branch_shift", "p_bus_shift"])
+
+def calculate_PTDF(sub_network,skip_pre=False,linear_solver_options=None):
     """
     Calculate the Power Transfer Distribution Factor (PTDF) for
     sub_network.
@@ -628,54 +1214,37 @@ def calculate_PTDF(sub_network,skip_pre=False):
     skip_pre: bool, default False
         Skip the preliminary steps of computing topology, calculating dependent values,
         finding bus controls and computing B and H.
+    linear_solver_options : dict, default None
+        Options of the linear solver, see the solver option
+        "linear_solver" of network_pf.
 
     """
 
     if not skip_pre:
         calculate_B_H(sub_network)
 
-    #calculate inverse of B with slack removed
-
-    n_pvpq = len(sub_network.pvpqs)
-    index = np.r_[:n_pvpq]
-
-    I = csc_matrix((np.ones(n_pvpq), (index, index)))
+    #since B is symmetric, PTDF^T = B^-1 H^T, which is solved column
+    #by column for the branches without forming the inverse of B
+    #(with the slack removed)
 
-    B_inverse = spsolve(sub_network.B[1:, 1:],I)
-
-    #exception for two-node networks, where B_inverse is a 1d array
-    if issparse(B_inverse):
-        B_inverse = B_inverse.toarray()
-    elif B_inverse.shape == (1,):
-        B_inverse = B_inverse.reshape((1,1))
-
-    #add back in zeroes for slack
-    B_inverse = np.hstack((np.zeros((n_pvpq,1)),B_inverse))
-    B_inverse = np.vstack((np.zeros(n_pvpq+1),B_inverse))
-
-    sub_network.PTDF = sub_network.H*B_inverse
-
-
-def calculate_Y(sub_network,skip_pre=False):
-    """Calculate bus admittance matrices for AC sub-networks."""
+    if _from_cache(sub_network, "PTDF"):
+        return
 
-    if not skip_pre:
-        calculate_dependent_values(sub_network.network)
+    n_pvpq = len(sub_network.pvpqs)
 
-    if sub_network.network.sub_networks.at[sub_network.name,"carrier"] != "AC":
-        logger.warn("Non-AC networks not supported for Y!")
-        return
+    sub_network.PTDF = np.zeros((sub_network.H.shape[0], n_pvpq+1))
 
-    branches = sub_network.branches()
-    buses_o = sub_network.buses_o
+    if n_pvpq > 0:
+        B_lu = _B_factorisation(sub_network, linear_solver_options)
+        H_T = np.asfortranarray(sub_network.H[:, 1:].T.toarray())
+        sub_network.PTDF[:, 1:] = B_lu.solve(H_T).T
 
-    network = sub_network.network
+    _to_cache(sub_network, "PTDF", ["PTDF"])
 
-    #following leans heavily on pypower.makeYbus
-    #Copyright Richard Lincoln, Ray Zimmerman, BSD-style licence
 
-    num_branches = len(branches)
-    num_buses = len(buses_o)
+def _branch_admittances(branches):
+    #elements Y00, Y01, Y10, Y11 of the two-port admittance matrices of
+    #the branches (a DataFrame as returned by sub_network.branches())
 
     y_se = 1/(branches["r_pu"] + 1.j*branches["x_pu"])
 
@@ -703,6 +1272,51 @@ def calculate_Y(sub_network,skip_pre=False):
     Y01 = -y_se/tau_lv/tau_hv/np.conj(phase_shift)
     Y00 = (y_se + 0.5*y_sh)/tau_hv**2
 
+    return Y00.values, Y01.values, Y10.values, Y11.values
+
+
+def _branch_susceptances(branches, carrier):
+    #series susceptances of the branches (a DataFrame as returned by
+    #sub_network.branches()) and the flows caused by phase shifts
+
+    is_transformer = branches.index.get_level_values(0) == "Transformer"
+
+    #carrier is the carrier of the sub-network or an array with one per branch
+    impedance = np.where(np.asarray(carrier) == "DC", branches["r_pu"], branches["x_pu"])
+    b = 1./(impedance*np.where(is_transformer, branches["tap_ratio"], 1.))
+
+    phase_shift = np.where(is_transformer, branches["phase_shift"], 0.)*np.pi/180.
+
+    return b, -b*phase_shift
+
+
+def calculate_Y(sub_network,skip_pre=False):
+    """Calculate bus admittance matrices for AC sub-networks."""
+
+    if not skip_pre:
+        calculate_dependent_values(sub_network.network)
+
+    if sub_network.network.sub_networks.at[sub_network.name,"carrier"] != "AC":
+        logger.warn("Non-AC networks not supported for Y!")
+        return
+
+    _discard_updates(sub_network, "Y")
+    if _from_cache(sub_network, "Y"):
+        return
+
+    branches = sub_network.branches()
+    buses_o = sub_network.buses_o
+
+    network = sub_network.network
+
+    #following leans heavily on pypower.makeYbus
+    #Copyright Richard Lincoln, Ray Zimmerman, BSD-style licence
+
+    num_branches = len(branches)
+    num_buses = len(buses_o)
+
+    Y00, Y01, Y10, Y11 = _branch_admittances(branches)
+
     #bus shunt impedances
     b_sh = network.shunt_impedances.b_pu.groupby(network.shunt_impedances.bus).sum().reindex(buses_o, fill_value = 0.)
     g_sh = network.shunt_impedances.g_pu.groupby(network.shunt_impedances.bus).sum().reindex(buses_o, fill_value = 0.)
@@ -726,6 +1340,187 @@ def calculate_Y(sub_network,skip_pre=False):
     sub_network.Y = C0.T * sub_network.Y0 + C1.T * sub_network.Y1 + \
        csr_matrix((Y_sh, (np.arange(num_buses), np.arange(num_buses))))
 
+    _to_cache(sub_network, "Y", ["Y", "Y0", "Y1"])
+
+
+#states of Y and of B and H which were changed by update_branches are
+#labelled with ("update_branches", n), otherwise with the matrix key of
+#the data they were calculated from
+_update_counter = count()
+
+
+def _discard_updates(sub_network, calculated):
+    #calculate_Y ("Y") and calculate_B_H ("B") start again from the
+    #data, which discards the changes by update_branches of all
+    #matrices, so that the other matrices are calculated again if they
+    #were changed
+    changed = [name for name in ("Y", "B")
+               if name != calculated and isinstance(getattr(sub_network, "_{}_key".format(name), None), tuple)]
+
+    sub_network._matrix_key = _matrix_key(sub_network)
+    sub_network._B_changes = None
+    sub_network._branches_out = set()
+    sub_network._jacobian = None
+    setattr(sub_network, "_{}_key".format(calculated), sub_network._matrix_key)
+
+    if "Y" in changed:
+        calculate_Y(sub_network, skip_pre=True)
+    if "B" in changed:
+        calculate_B_H(sub_network, skip_pre=True)
+
+
+def _B_H_like_Y(sub_network):
+    #B and H for the linear power flow seed and the fast-decoupled load
+    #flow, which agree with Y: unlike calculate_B_H this keeps the
+    #changes of update_branches, which switches the same branches out
+    #of B and H as out of Y
+
+    Y_key = getattr(sub_network, "_Y_key", None)
+    B_key = getattr(sub_network, "_B_key", None)
+    if sub_network.network.sub_networks.at[sub_network.name,"carrier"] != "AC":
+        #without Y, B is compared with the data unless it was changed
+        Y_key = B_key if isinstance(B_key, tuple) else _matrix_key(sub_network)
+    if getattr(sub_network, "B", None) is not None and B_key == Y_key:
+        return
+
+    if not isinstance(Y_key, tuple):
+        calculate_B_H(sub_network, skip_pre=True)
+        return
+
+    out = sorted(sub_network._branches_out)
+    sub_network._matrix_key = _matrix_key(sub_network)
+    sub_network._B_changes = None
+    _build_B_H(sub_network)
+    sub_network._B_key = sub_network._matrix_key
+    if out:
+        update_branches(sub_network, sub_network.branches_i()[out], in_service=False)
+    sub_network._matrix_key = None
+    sub_network._B_key = sub_network._Y_key
+
+
+def update_branches(sub_network, branches, in_service=None):
+    """
+    Update the matrices of sub_network for changes to a few of its
+    branches, instead of calculating them again.
+
+    The contributions of the branches to Y, Y0, Y1, B, H and the phase
+    shift injections are replaced with low-rank updates, using the
+    current per unit parameters of the branches (r_pu, x_pu, g_pu,
+    b_pu, tap_ratio, tap_side and phase_shift; call
+    network.calculate_dependent_values() after changing r, x, g or b).
+    Branches which are switched out are removed from the matrices:
+    their rows in Y0, Y1 and H are zero, so that they carry no flow,
+    but they keep their places, so that they can be switched in again.
+
+    The factorisation of B for the linear power flow and the PTDF is
+    not computed again; instead the factorisation from before the
+    first update is corrected for all changed branches with the
+    Sherman-Morrison-Woodbury formula. Run the power flows with
+    skip_pre=True to use the updated matrices; the linear power flow
+    seed and the fast-decoupled load flow of network.pf() then switch
+    the same branches out of B and H if only Y was updated. Until the
+    matrices are calculated again with calculate_Y or calculate_B_H,
+    which discard the updates of all matrices, they are neither taken
+    from nor put into network.matrix_cache.
+
+    Parameters
+    ----------
+    sub_network : pypsa.SubNetwork
+    branches : list-like
+        Passive branches of sub_network as tuples (component, name).
+    in_service : bool, default None
+        Switch the branches out (False) or in again (True); by default
+        they stay as they are.
+
+    Examples
+    --------
+    >>> sub_network.update_branches([("Line", "12")], in_service=False)
+    >>> sub_network.lpf(skip_pre=True)
+    """
+
+    network = sub_network.network
+
+    branches = pd.MultiIndex.from_tuples(list(branches)).drop_duplicates()
+    l = sub_network.branches_i().get_indexer(branches)
+    if (l < 0).any():
+        raise ValueError("The branches {} are not in sub-network {}".format(list(branches[l < 0]), sub_network.name))
+
+    out = getattr(sub_network, "_branches_out", set())
+    if in_service is not None:
+        out = out - set(l) if in_service else out | set(l)
+    sub_network._branches_out = out
+    active = np.array([i not in out for i in l])
+
+    types = branches.get_level_values(0)
+    df = pd.concat([network.df(c).loc[branches.get_level_values(1)[types == c]] for c in types.unique()],
+                   keys=types.unique()).reindex(branches)
+    for attr in ["tap_ratio", "tap_side", "phase_shift"]:
+        if attr not in df:
+            df[attr] = np.nan
+
+    bus0 = sub_network.buses_o.get_indexer(df.bus0)
+    bus1 = sub_network.buses_o.get_indexer(df.bus1)
+
+    rows = r_[l, l]
+    cols = r_[bus0, bus1]
+    bus_rows = r_[bus0, bus0, bus1, bus1]
+    bus_cols = r_[bus0, bus1, bus0, bus1]
+
+    updated_Y = getattr(sub_network, "Y", None) is not None and network.sub_networks.at[sub_network.name,"carrier"] == "AC"
+    updated_B = getattr(sub_network, "B", None) is not None
+
+    if updated_Y:
+        Y00, Y01, Y10, Y11 = (np.where(active, y, 0.) for y in _branch_admittances(df))
+
+        Y0 = sub_network.Y0.tocsr()
+        Y1 = sub_network.Y1.tocsr()
+        dY00 = Y00 - np.asarray(Y0[l, bus0]).ravel()
+        dY01 = Y01 - np.asarray(Y0[l, bus1]).ravel()
+        dY10 = Y10 - np.asarray(Y1[l, bus0]).ravel()
+        dY11 = Y11 - np.asarray(Y1[l, bus1]).ravel()
+
+        sub_network.Y0 = Y0 + csr_matrix((r_[dY00, dY01], (rows, cols)), Y0.shape)
+        sub_network.Y1 = Y1 + csr_matrix((r_[dY10, dY11], (rows, cols)), Y1.shape)
+        sub_network.Y = sub_network.Y + csr_matrix((r_[dY00, dY01, dY10, dY11], (bus_rows, bus_cols)),
+                                                   sub_network.Y.shape)
+
+    if updated_B:
+        b, p_branch_shift = _branch_susceptances(df, network.sub_networks.at[sub_network.name,"carrier"])
+        b = np.where(active, b, 0.)
+
+        H = sub_network.H.tocsr()
+        b_old = np.asarray(H[l, bus0]).ravel()
+        db = b - b_old
+
+        changes = getattr(sub_network, "_B_changes", None)
+        if changes is None:
+            changes = sub_network._B_changes = dict(B=sub_network.B, key=getattr(sub_network, "_matrix_key", None),
+                                                    branches={}, base={})
+        for i in range(len(l)):
+            changes["branches"].setdefault(l[i], (b_old[i], bus0[i], bus1[i]))
+        changes["factorisations"] = {}
+
+        sub_network.H = H + csr_matrix((r_[db, -db], (rows, cols)), H.shape)
+        sub_network.B = sub_network.B + csr_matrix((r_[db, -db, -db, db], (bus_rows, bus_cols)),
+                                                   sub_network.B.shape)
+
+        sub_network.p_branch_shift = sub_network.p_branch_shift.copy()
+        sub_network.p_branch_shift[l] = np.where(active, p_branch_shift, 0.)
+        sub_network.p_bus_shift = sub_network.K * sub_network.p_branch_shift
+
+    #the matrices no longer belong to the hash; Y and B keep sharing a
+    #state if they did before
+    Y_key = getattr(sub_network, "_Y_key", None)
+    B_key = getattr(sub_network, "_B_key", None)
+    Y_state = ("update_branches", next(_update_counter))
+    B_state = Y_state if Y_key == B_key else ("update_branches", next(_update_counter))
+    if updated_Y:
+        sub_network._Y_key = Y_state
+        sub_network._jacobian = None
+    if updated_B:
+        sub_network._B_key = B_state
+    sub_network._matrix_key = None
+
 
 
 def aggregate_multi_graph(sub_network):
@@ -867,7 +1662,7 @@ def find_cycles(sub_network):
                 sub_network.C[b_i,c] = sign
                 c+=1
 
-def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
+def sub_network_lpf(sub_network, snapshots=None, skip_pre=False, solver_options=None):
     """
     Linear power flow for connected sub-network.
 
@@ -879,12 +1674,17 @@ def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
     skip_pre: bool, default False
         Skip the preliminary steps of computing topology, calculating
         dependent values and finding bus controls.
+    solver_options : dict, default None
+        Settings of the solvers, see network_pf; "linear_solver" and
+        "deduplicate" apply.
 
     Returns
     -------
     None
     """
 
+    linear_solver_options, deduplicate = _solver_options(solver_options, ["linear_solver", "deduplicate"])
+
     snapshots = _as_snapshots(sub_network.network, snapshots)
     logger.info("Performing linear load-flow on %s sub-network %s for snapshot(s) %s",
                 sub_network.network.sub_networks.at[sub_network.name,"carrier"], sub_network, snapshots)
@@ -918,15 +1718,9 @@ def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
 
     # set the power injection at each node
     network.buses_t.p.loc[snapshots, buses_o] = \
-        sum([((c.pnl.p.loc[snapshots, c.ind] * c.df.loc[c.ind, 'sign'])
-              .groupby(c.df.loc[c.ind, 'bus'], axis=1).sum()
-              .reindex(columns=buses_o, fill_value=0.))
-             for c in sub_network.iterate_components(one_port_components)]
-            +
-            [(- c.pnl["p"+str(i)].loc[snapshots].groupby(c.df["bus"+str(i)], axis=1).sum()
-              .reindex(columns=buses_o, fill_value=0))
-             for c in network.iterate_components(controllable_branch_components)
-             for i in [0,1]])
+        _bus_injections(network, sub_network.name, snapshots, buses_o,
+                        sub_network.iterate_components(one_port_components),
+                        network.iterate_components(controllable_branch_components))
 
     if not skip_pre and len(branches_i) > 0:
         calculate_B_H(sub_network, skip_pre=True)
@@ -934,7 +1728,14 @@ def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
     v_diff = np.zeros((len(snapshots), len(buses_o)))
     if len(branches_i) > 0:
         p = network.buses_t['p'].loc[snapshots, buses_o].values - sub_network.p_bus_shift
-        v_diff[:,1:] = spsolve(sub_network.B[1:, 1:], p[:,1:].T).T
+        B_lu = _B_factorisation(sub_network, linear_solver_options)
+        if deduplicate:
+            unique, inverse = _unique_rows(p)
+            logger.info("Solving %d distinct operating points for %d snapshots of sub-network %s",
+                        len(unique), len(snapshots), sub_network)
+            v_diff[:,1:] = B_lu.solve(np.asfortranarray(p[unique,1:].T)).T[inverse]
+        else:
+            v_diff[:,1:] = B_lu.solve(np.asfortranarray(p[:,1:].T)).T
         flows = pd.DataFrame(v_diff * sub_network.H.T,
                              columns=branches_i, index=snapshots) + sub_network.p_branch_shift
 
@@ -961,7 +1762,376 @@ def sub_network_lpf(sub_network, snapshots=None, skip_pre=False):
 
 
 
-def network_batch_lpf(network,snapshots=None):
-    """Batched linear power flow with numpy.dot for several snapshots."""
+class LinearFlowOperator(object):
+    """
+    Linear power flow of a sub-network, compiled for computing the
+    branch flows of many vectors of active power injections without a
+    Network.
+
+    It holds the factorisation of the weighted Laplacian B without the
+    slack bus, the rows of H for the monitored branches and the
+    phase-shift terms, as found by sub_network.compile_lpf(). It does
+    not refer to the network and can be pickled (the factorisation is
+    then computed again on unpickling).
+
+    Attributes
+    ----------
+    buses : pandas.Index
+        Buses in the order of the columns of the injections, starting
+        with the slack bus.
+    branches : pandas.MultiIndex
+        Monitored branches in the order of the columns of the flows.
+
+    """
+
+    def __init__(self, B_lu, H, p_bus_shift, p_branch_shift, buses, branches):
+        self.B_lu = B_lu
+        self.H = H
+        self.p_bus_shift = p_bus_shift
+        self.p_branch_shift = p_branch_shift
+        self.buses = buses
+        self.branches = branches
+        self._transfer = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_transfer"] = None
+        return state
+
+    def __repr__(self):
+        return "LinearFlowOperator for {} buses and {} monitored branches".format(len(self.buses), len(self.branches))
+
+    def _transfer_matrix(self):
+        """
+        Dense transfer matrix PTDF^T of the monitored branches with a
+        zero row for the slack bus, and the flows for zero injections,
+        computed with the factorisation of B on first use.
+        """
+
+        if self._transfer is None:
+            ptdf = np.zeros((len(self.buses), len(self.branches)))
+            ptdf[1:] = self.B_lu.solve(np.asfortranarray(self.H.T.toarray()))
+            self._transfer = (ptdf, self.p_branch_shift - np.dot(self.p_bus_shift, ptdf[1:]))
+        return self._transfer
+
+    def flows(self, injections, out=None):
+        """
+        Branch flows of the linear power flow for vectors of active
+        power injections.
+
+        The first call solves B for the monitored rows of H and keeps
+        the dense transfer matrix of size buses times monitored
+        branches (which is why compile_lpf can restrict the monitored
+        branches); each call is then a matrix product written directly
+        to out, so that nothing beyond the flows is allocated for
+        C-contiguous float injections and outputs.
+
+        Parameters
+        ----------
+        injections : numpy.ndarray
+            Active power injections in MW with one row for each vector
+            (or a single vector) and one column for each bus in the
+            order of self.buses; the slack bus column is ignored.
+        out : numpy.ndarray, default None
+            C-contiguous float array of the shape of the flows, which
+            the flows are written to.
+
+        Returns
+        -------
+        flows : numpy.ndarray
+            Active power flows p0 in MW with one row for each vector
+            (or a single vector for a single vector of injections) and
+            one column for each branch in self.branches; out if it is
+            given.
+        """
+
+        injections = np.asarray(injections, dtype=float)
+
+        if out is None:
+            out = np.empty(injections.shape[:-1] + (len(self.branches),))
+        target = out[0] if injections.ndim < out.ndim else out
+
+        if self.B_lu is None:
+            target[...] = self.p_branch_shift
+        else:
+            ptdf, p_zero = self._transfer_matrix()
+            np.dot(injections, ptdf, out=target)
+            target += p_zero
+
+        return out
+
+
+def compile_lpf(sub_network, skip_pre=False, linear_solver_options=None, branches=None):
+    """
+    Compile the linear power flow of the sub-network into a
+    LinearFlowOperator, which computes the branch flows for arrays of
+    power injections without touching the network.
+
+    The operator is built from calculate_B_H and the (cached)
+    factorisation of B, and reflects changes made by update_branches.
+
+    Parameters
+    ----------
+    skip_pre: bool, default False
+        Skip the preliminary steps of calculating dependent values,
+        finding bus controls and calculating B and H.
+    linear_solver_options : dict, default None
+        Options of the linear solver, see the solver option
+        "linear_solver" of network_pf.
+    branches : list-like, default None
+        Monitored branches, as tuples (component name, branch name) of
+        sub_network.branches_i(); defaults to all branches.
 
-    raise NotImplementedError("Batch linear power flow not supported yet.")
+    Returns
+    -------
+    LinearFlowOperator
+    """
+
+    branches_i = sub_network.branches_i()
+
+    if not skip_pre:
+        calculate_dependent_values(sub_network.network)
+        find_bus_controls(sub_network)
+        if len(branches_i) > 0:
+            calculate_B_H(sub_network, skip_pre=True)
+
+    if branches is None:
+        monitored = np.arange(len(branches_i))
+    else:
+        branches = pd.MultiIndex.from_tuples(list(branches), names=branches_i.names)
+        monitored = branches_i.get_indexer(branches)
+        if (monitored == -1).any():
+            raise KeyError("The branches {} are not in sub-network {}".format(list(branches[monitored == -1]),
+                                                                           sub_network.name))
+
+    if len(branches_i) == 0:
+        return LinearFlowOperator(None, None, None, zeros(len(monitored)), sub_network.buses_o, branches_i[monitored])
+
+    return LinearFlowOperator(_B_factorisation(sub_network, linear_solver_options),
+                              csr_matrix(sub_network.H)[monitored][:,1:],
+                              sub_network.p_bus_shift[1:],
+                              sub_network.p_branch_shift[monitored],
+                              sub_network.buses_o, branches_i[monitored])
+
+
+def _stacked_lpf(network, sub_networks, snapshots, skip_pre=False, solver_options=None):
+    #linear power flow for many small sub-networks at once: their
+    #weighted Laplacians are stacked into one block-diagonal matrix,
+    #which is factorised and solved once, and the results of all of
+    #them are written back together
+
+    linear_solver_options, deduplicate = _solver_options(solver_options, ["linear_solver", "deduplicate"])
+
+    from .components import \
+        one_port_components, passive_branch_components, controllable_branch_components
+
+    logger.info("Performing linear load-flow on %d stacked sub-networks for snapshot(s) %s",
+                len(sub_networks), snapshots)
+
+    if not skip_pre:
+        _find_bus_controls(network, sub_networks)
+
+    names = pd.Index([sn.name for sn in sub_networks])
+    buses_o = pd.Index(list(chain.from_iterable(sn.buses_o for sn in sub_networks)))
+    sizes = np.array([len(sn.buses_o) for sn in sub_networks])
+    slacks_i = np.r_[0, np.cumsum(sizes)[:-1]]
+    is_dc = np.repeat((network.sub_networks.carrier[names] == "DC").values, sizes)
+
+    # allow all shunt impedances and one ports to dispatch as set
+    for c in network.iterate_components(one_port_components):
+        ind = c.df.index[c.df.bus.isin(buses_o)]
+        if c.name == "ShuntImpedance":
+            c.pnl.p.loc[snapshots, ind] = c.df.loc[ind, "g_pu"].values
+        else:
+            c.pnl.p.loc[snapshots, ind] = get_switchable_as_dense(network, c.name, 'p_set', snapshots, ind)
+
+    # set the power injection at each node
+    p = _bus_injections(network, "_stacked", snapshots, buses_o,
+                        network.iterate_components(one_port_components),
+                        network.iterate_components(controllable_branch_components))
+
+    branches = network.passive_branches()
+    branches = branches[branches.sub_network.isin(names)]
+
+    v_diff = np.zeros((len(snapshots), len(buses_o)))
+    if len(branches) > 0:
+        b, p_branch_shift = _branch_susceptances(branches, network.sub_networks.carrier[branches.sub_network].values)
+        if np.isnan(b).any():
+            logger.warn("Warning! Some series impedances are zero - this will cause a singularity in LPF!")
+
+        #the branches never leave their sub-network, so K and B are block-diagonal
+        n = len(branches)
+        K = csr_matrix((r_[ones(n), -ones(n)],
+                        (r_[buses_o.get_indexer(branches.bus0), buses_o.get_indexer(branches.bus1)], r_[:n, :n])),
+                       (len(buses_o), n))
+        H = csr_matrix((b, (r_[:n], r_[:n]))) * K.T
+        pvpqs_i = np.setdiff1d(np.arange(len(buses_o)), slacks_i)
+        B_lu = _factorise((K * H)[pvpqs_i,:][:,pvpqs_i], linear_solver_options)
+
+        p_shifted = (p - K * p_branch_shift)[:, pvpqs_i]
+        if deduplicate:
+            unique, inverse = _unique_rows(p_shifted)
+            logger.info("Solving %d distinct operating points for %d snapshots of the stacked sub-networks",
+                        len(unique), len(snapshots))
+            v_diff[:,pvpqs_i] = B_lu.solve(np.asfortranarray(p_shifted[unique].T)).T[inverse]
+        else:
+            v_diff[:,pvpqs_i] = B_lu.solve(np.asfortranarray(p_shifted.T)).T
+
+        flows = v_diff * H.T + p_branch_shift
+        types = branches.index.get_level_values(0)
+        for c in network.iterate_components(passive_branch_components):
+            sel = types == c.name
+            if sel.any():
+                ind = branches.index.get_level_values(1)[sel]
+                c.pnl.p0.loc[snapshots, ind] = flows[:, sel]
+                c.pnl.p1.loc[snapshots, ind] = -flows[:, sel]
+
+    network.buses_t.v_ang.loc[snapshots, buses_o] = np.where(is_dc, 0., v_diff)
+    network.buses_t.v_mag_pu.loc[snapshots, buses_o] = np.where(is_dc, 1 + v_diff, 1.)
+
+    # set slack bus power to pick up remained
+    slack_adjustment = - np.add.reduceat(p, slacks_i, axis=1)
+    p[:, slacks_i] += slack_adjustment
+    network.buses_t.p.loc[snapshots, buses_o] = p
+
+    # let slack generators take up the slack
+    slack_generators = [sn.slack_generator for sn in sub_networks]
+    has_generator = np.array([g is not None for g in slack_generators], dtype=bool)
+    if has_generator.any():
+        network.generators_t.p.loc[snapshots, [g for g in slack_generators if g is not None]] += slack_adjustment[:, has_generator]
+
+
+def network_batch_lpf(network, snapshots=None, skip_pre=False, solver_options=None):
+    """
+    Batched linear power flow for generic network.
+
+    In contrast to ``network.lpf()``, the reduced weighted Laplacian
+    ``B[1:,1:]`` of each sub-network is factorised only once, all
+    snapshots are solved with the factorisation as a multi-column
+    right-hand side, the flows are computed with a single product with
+    ``H`` and the results are written back to the time-varying
+    DataFrames in bulk.
+
+    Parameters
+    ----------
+    snapshots : list-like|single snapshot
+        A subset or an elements of network.snapshots on which to run
+        the power flow, defaults to [now]
+    skip_pre: bool, default False
+        Skip the preliminary steps of computing topology, calculating
+        dependent values and finding bus controls.
+    solver_options : dict, default None
+        Settings of the solvers, see network_pf; "batch_size" (default
+        1000), "n_workers", "executor" and "linear_solver" apply.
+        Processes receive the matrices once and factorise them again
+        themselves.
+
+    Returns
+    -------
+    None
+    """
+
+    batch_size, n_workers, executor, linear_solver_options = \
+        _solver_options(solver_options, ["batch_size", "n_workers", "executor", "linear_solver"],
+                        batch_size=1000)
+
+    from .components import \
+        one_port_components, controllable_one_port_components, \
+        passive_branch_components, controllable_branch_components
+
+    if not skip_pre:
+        network.determine_network_topology()
+        calculate_dependent_values(network)
+        _allocate_pf_outputs(network, linear=True)
+
+    snapshots = _as_snapshots(network, snapshots)
+    logger.info("Performing batched linear load-flow for %d snapshot(s)", len(snapshots))
+
+    #deal with links
+    if not network.links.empty:
+        p_set = get_switchable_as_dense(network, 'Link', 'p_set', snapshots)
+        network.links_t.p0.loc[snapshots] = p_set.loc[snapshots]
+        network.links_t.p1.loc[snapshots] = -p_set.loc[snapshots].multiply(network.links.efficiency)
+
+    # allow all shunt impedances and one ports to dispatch as set
+    network.shunt_impedances_t.p.loc[snapshots, network.shunt_impedances.index] = \
+        network.shunt_impedances.g_pu.values
+
+    for c in network.iterate_components(controllable_one_port_components):
+        c.pnl.p.loc[snapshots, c.df.index] = \
+            get_switchable_as_dense(network, c.name, 'p_set', snapshots).values
+
+    # set the power injection at each node, for all sub-networks at once
+    buses_i = network.buses.index
+    p = _bus_injections(network, None, snapshots, buses_i,
+                        network.iterate_components(one_port_components),
+                        network.iterate_components(controllable_branch_components))
+
+    v_ang = np.zeros((len(snapshots), len(buses_i)))
+    v_mag_pu = np.ones((len(snapshots), len(buses_i)))
+
+    branch_p0 = {c.name : np.zeros((len(snapshots), len(c.df)))
+                 for c in network.iterate_components(passive_branch_components)}
+
+    slack_generators = []
+    slack_adjustments = []
+
+    #the sub-networks share one pool of workers
+    with _shared_pool(solver_options) as shared_solver_options:
+        executor = shared_solver_options.get("executor", executor)
+        for sub_network in network.sub_networks.obj:
+            if not skip_pre:
+                find_bus_controls(sub_network)
+
+            buses_o = sub_network.buses_o
+            branches_i = sub_network.branches_i()
+            buses_o_i = buses_i.get_indexer(buses_o)
+
+            if not skip_pre and len(branches_i) > 0:
+                calculate_B_H(sub_network, skip_pre=True)
+
+            v_diff = np.zeros((len(snapshots), len(buses_o)))
+
+            if len(branches_i) > 0:
+                #factorise once, then reuse for all snapshots
+                B_lu = _B_factorisation(sub_network, linear_solver_options)
+
+                flows = np.empty((len(snapshots), len(branches_i)))
+
+                chunks = _snapshot_chunks(len(snapshots), n_workers)
+                results = _map_chunks(_lpf_chunk, (B_lu, sub_network.H, sub_network.p_bus_shift,
+                                                   sub_network.p_branch_shift, p[:, buses_o_i], batch_size),
+                                      chunks, n_workers=n_workers, executor=executor)
+                for chunk, result in zip(chunks, results):
+                    v_diff[chunk], flows[chunk] = result
+
+                #rows of H follow the order of sub_network.branches_i()
+                offset = 0
+                for c in sub_network.iterate_components(passive_branch_components):
+                    branch_p0[c.name][:, c.df.index.get_indexer(c.ind)] = flows[:, offset:offset+len(c.ind)]
+                    offset += len(c.ind)
+
+            if network.sub_networks.at[sub_network.name,"carrier"] == "DC":
+                v_mag_pu[:, buses_o_i] = 1 + v_diff
+            else:
+                v_ang[:, buses_o_i] = v_diff
+
+            # set slack bus power to pick up remained
+            slack_adjustment = - p[:, buses_o_i].sum(axis=1)
+            p[:, buses_o_i[0]] += slack_adjustment
+
+            if sub_network.slack_generator is not None:
+                slack_generators.append(sub_network.slack_generator)
+                slack_adjustments.append(slack_adjustment)
+
+    # now write everything back in one go
+    network.buses_t.p.loc[snapshots, buses_i] = p
+    network.buses_t.v_ang.loc[snapshots, buses_i] = v_ang
+    network.buses_t.v_mag_pu.loc[snapshots, buses_i] = v_mag_pu
+
+    for c in network.iterate_components(passive_branch_components):
+        c.pnl.p0.loc[snapshots, c.df.index] = branch_p0[c.name]
+        c.pnl.p1.loc[snapshots, c.df.index] = -branch_p0[c.name]
+
+    if slack_generators:
+        network.generators_t.p.loc[snapshots, slack_generators] += np.column_stack(slack_adjustments)
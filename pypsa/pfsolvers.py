@@ -0,0 +1,1242 @@
+## Copyright 2015-2017 Tom Brown (FIAS), Jonas Hoersch (FIAS)
+
+## This program is free software; you can redistribute it and/or
+## modify it under the terms of the GNU General Public License as
+## published by the Free Software Foundation; either version 3 of the
+## License, or (at your option) any later version.
+
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+## You should have received a copy of the GNU General Public License
+## along with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Numerical machinery of the power flows: linear solvers, the matrix
+cache, the Newton-Raphson, fast-decoupled and sweep kernels on numpy
+arrays and the distribution of snapshots over batches and workers.
+"""
+
+# make the code as Python 3 compatible as possible
+from __future__ import division, absolute_import
+from six.moves import range
+
+__author__ = "Tom Brown (FIAS), Jonas Hoersch (FIAS)"
+__copyright__ = "Copyright 2015-2017 Tom Brown (FIAS), Jonas Hoersch (FIAS), GNU GPL 3"
+
+import logging
+logger = logging.getLogger(__name__)
+
+from scipy.sparse import issparse, csr_matrix, csc_matrix
+
+from numpy import r_, ones, zeros, newaxis
+from scipy.sparse.linalg import splu, spilu, gmres, bicgstab, LinearOperator
+
+import numpy as np
+
+import collections, six
+from contextlib import contextmanager
+import time
+import hashlib, json, os, shutil, tempfile
+
+
+def _run_chunk(task):
+    kernel, shared, chunk = task
+    return kernel(*(shared + (chunk,)))
+
+
+class _WorkerPool(object):
+    """Pool of n_workers processes (executor="process") or threads
+    (executor="thread"), which is only started when it is first needed
+    and is then reused, e.g. by all sub-networks of a power flow, until
+    it is closed."""
+
+    def __init__(self, n_workers, executor="process"):
+        if executor not in ("process", "thread"):
+            raise ValueError("executor must be one of 'process' or 'thread', got: {}".format(executor))
+        self.n_workers = n_workers
+        self.executor = executor
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def map(self, function, tasks):
+        if self._pool is None:
+            if self.executor == "process":
+                from multiprocessing import Pool
+            else:
+                from multiprocessing.pool import ThreadPool as Pool
+            self._pool = Pool(self.n_workers)
+        return self._pool.map(function, tasks)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+@contextmanager
+def _shared_pool(solver_options):
+    """Yield solver_options with a _WorkerPool as "executor", which all
+    sub-networks share and which is closed at the end, if they ask for
+    several workers of a kind given by name."""
+
+    solver_options = dict(solver_options or {})
+    n_workers = solver_options.get("n_workers")
+    executor = solver_options.get("executor", "process")
+    if n_workers is None or n_workers <= 1 or not isinstance(executor, six.string_types):
+        yield solver_options
+        return
+
+    with _WorkerPool(n_workers, executor) as pool:
+        solver_options["executor"] = pool
+        yield solver_options
+
+def _map_chunks(kernel, shared, chunks, n_workers=1, executor="process"):
+    """Return [kernel(*shared, chunk) for chunk in chunks].
+
+    If n_workers > 1 the chunks are distributed over a pool of
+    processes (executor="process") or threads (executor="thread"),
+    which is started for this call, or over executor itself if it is
+    a pool with a method map, like a _WorkerPool or a
+    multiprocessing.Pool, which stays open for further calls. The
+    read-only data in the tuple shared is handed over with each chunk,
+    of which there is one per worker. Kernels must be module-level
+    functions.
+
+    """
+
+    if n_workers is None or n_workers <= 1 or len(chunks) <= 1:
+        return [kernel(*(shared + (chunk,))) for chunk in chunks]
+
+    tasks = [(kernel, shared, chunk) for chunk in chunks]
+    if isinstance(executor, six.string_types):
+        with _WorkerPool(min(n_workers, len(chunks)), executor) as pool:
+            return pool.map(_run_chunk, tasks)
+    return list(executor.map(_run_chunk, tasks))
+
+def _snapshot_chunks(n_snapshots, n_workers=1):
+    #split the snapshots into one contiguous chunk per worker
+    if n_workers is None or n_workers <= 1:
+        return [slice(0, n_snapshots)]
+    chunk_size = max(1, -(-n_snapshots // n_workers))
+    return [slice(i, min(i + chunk_size, n_snapshots)) for i in range(0, n_snapshots, chunk_size)]
+
+def _unique_rows(*arrays):
+    """Find the distinct rows of the arrays put side by side.
+
+    Returns the positions of the first occurrence of each distinct row,
+    in increasing order, and for each row the index of its distinct row
+    in these positions. Rows are compared bit by bit, as raw bytes."""
+
+    a = np.hstack([np.asarray(x).reshape(len(x), -1) for x in arrays])
+    #adding 0. turns -0. into 0.
+    a = np.ascontiguousarray(a + 0.)
+    rows = a.view(np.dtype((np.void, a.dtype.itemsize*a.shape[1]))).ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+
+    #keep the snapshot order, e.g. for seeding with the previous snapshot
+    order = np.argsort(first)
+    rank = np.empty(len(first), dtype=int)
+    rank[order] = np.arange(len(first))
+    return first[order], rank[inverse]
+
+
+def _batches(chunk, batch_size):
+    return [slice(i, min(i + batch_size, chunk.stop)) for i in range(chunk.start, chunk.stop, batch_size)]
+
+
+class _SparseLU(object):
+    """LU factorisation of a sparse matrix which can be pickled, since
+    only the matrix is stored; it is factorised again on unpickling.
+
+    If ordered is True, the rows and columns of A are already in a
+    fill-reducing order, which is kept, and diagonal pivots are
+    preferred; otherwise SuperLU finds a column ordering itself."""
+
+    def __init__(self, A, ordered=False):
+        self.A = csc_matrix(A)
+        self.ordered = ordered
+        if ordered:
+            self.lu = splu(self.A, permc_spec="NATURAL", options=dict(SymmetricMode=True))
+        else:
+            self.lu = splu(self.A)
+
+    def solve(self, b):
+        return self.lu.solve(b)
+
+    def __getstate__(self):
+        return {"A" : self.A, "ordered" : self.ordered}
+
+    def __setstate__(self, state):
+        self.__init__(state["A"], state["ordered"])
+
+
+class _PermutedSolver(object):
+    """Solve with a matrix whose rows and columns were reordered by
+    perm before it was factorised by solver, for right-hand sides in
+    the original order."""
+
+    def __init__(self, solver, perm):
+        self.solver = solver
+        self.perm = perm
+
+    def solve(self, b):
+        b = np.asarray(b)
+        x = np.empty(b.shape)
+        x[self.perm] = self.solver.solve(np.asfortranarray(b[self.perm]))
+        return x
+
+
+class _IterativeSolver(object):
+    """Solve with a sparse matrix A using GMRES or BiCGSTAB, preconditioned
+    with an incomplete LU factorisation of A which is computed only
+    once. The preconditioner can be reused for other matrices with a
+    similar structure, including block-diagonal matrices made of such
+    blocks. Like _SparseLU it can be pickled; the incomplete LU
+    factorisation is then computed again."""
+
+    def __init__(self, A, solver="gmres", tol=1e-10, maxiter=None, restart=None,
+                 drop_tol=1e-4, fill_factor=10., ordered=False):
+        self.A = csc_matrix(A)
+        self.options = dict(solver=solver, tol=tol, maxiter=maxiter, restart=restart,
+                            drop_tol=drop_tol, fill_factor=fill_factor, ordered=ordered)
+        self.ilu = spilu(self.A, drop_tol=drop_tol, fill_factor=fill_factor,
+                         permc_spec="NATURAL" if ordered else "COLAMD")
+
+    def solve(self, b, A=None):
+        """Solve A x = b, where A defaults to the matrix of the
+        preconditioner; raises a RuntimeError if the iterations do not
+        converge."""
+
+        if A is None:
+            A = self.A
+
+        n = self.A.shape[0]
+        n_blocks = A.shape[0] // n
+
+        def precondition(x):
+            return self.ilu.solve(np.asfortranarray(x.reshape(n_blocks, n).T)).T.ravel()
+
+        M = LinearOperator(A.shape, precondition)
+
+        if self.options["solver"] == "gmres":
+            def method(b):
+                return gmres(A, b, tol=self.options["tol"], restart=self.options["restart"],
+                             maxiter=self.options["maxiter"], M=M)
+        else:
+            def method(b):
+                return bicgstab(A, b, tol=self.options["tol"], maxiter=self.options["maxiter"], M=M)
+
+        b = np.asarray(b)
+        x = np.empty(b.shape)
+        for j in range(b.shape[1] if b.ndim == 2 else 1):
+            column = (slice(None), j) if b.ndim == 2 else slice(None)
+            x[column], info = method(b[column])
+            if info != 0:
+                raise RuntimeError("{} did not converge (info = {})".format(self.options["solver"], info))
+        return x
+
+    def __getstate__(self):
+        return {"A" : self.A, "options" : self.options}
+
+    def __setstate__(self, state):
+        self.__init__(state["A"], **state["options"])
+
+
+class _LowRankUpdate(object):
+    """Solve with A + U diag(c) U^T for a dense U with few columns,
+    given a solver for A, with the Sherman-Morrison-Woodbury formula,
+    so that A need not be factorised again after a low-rank change.
+    Raises a ValueError if the changed matrix is singular."""
+
+    def __init__(self, solver, U, c):
+        self.solver = solver
+        self.U = U
+        self.c = c
+        self.W = np.asarray(solver.solve(np.asfortranarray(U))).reshape(U.shape)
+        self.M = np.eye(len(c)) + c[:,newaxis]*U.T.dot(self.W)
+        if np.linalg.cond(self.M) > 1e12:
+            raise ValueError("The changed matrix is singular, e.g. because branch outages split the sub-network")
+
+    def solve(self, b):
+        y = self.solver.solve(b)
+        z = np.linalg.solve(self.M, (self.c*self.U.T.dot(y).T).T)
+        return y - self.W.dot(z)
+
+
+def _factorise(A, linear_solver_options=None, perm=None, ordered=False):
+    """Prepare solving with the sparse matrix A.
+
+    Returns an object with a method solve(b), for one- or
+    two-dimensional b, according to linear_solver_options (see
+    network_pf); by default A is LU-factorised.
+
+    If perm is given, the rows and columns of A are reordered by perm
+    (usually a fill-reducing bus ordering, see find_bus_ordering)
+    before A is factorised; right-hand sides and solutions stay in
+    the original order. With ordered=True A is taken to be in a
+    fill-reducing order already.
+
+    """
+
+    options = dict(linear_solver_options or {})
+    solver = options.pop("solver", "lu")
+
+    if perm is not None:
+        A = csc_matrix(A)[perm,:][:,perm]
+        ordered = True
+
+    if solver == "lu":
+        factorisation = _SparseLU(A, ordered)
+    elif solver in ("gmres", "bicgstab"):
+        factorisation = _IterativeSolver(A, solver=solver, ordered=ordered, **options)
+    else:
+        raise ValueError("The linear solver must be one of 'lu', 'gmres' or 'bicgstab', got: {}".format(solver))
+
+    return factorisation if perm is None else _PermutedSolver(factorisation, perm)
+
+
+class MatrixCache(object):
+    """
+    Cache for the matrices of sub-networks and their factorisations.
+
+    Each network has one in network.matrix_cache. Its entries are
+    keyed by a hash of everything the matrices of a sub-network depend
+    on (the bus ordering and controls, the branch topology, the
+    impedances, tap ratios and phase shifts of the branches and the
+    shunt impedances) together with the kind of entry, so that
+    calculate_Y, calculate_B_H, calculate_PTDF, calculate_BODF,
+    find_bus_ordering and the factorisations in the power flows are
+    only computed once for a grid that is solved again and again with
+    different injections, even across calls of determine_network_topology.
+
+    Parameters
+    ----------
+    maxsize : int, default 128
+        Number of entries kept in memory; the least recently used
+        entries are evicted first. If 0, nothing is kept in memory.
+    path : str, default None
+        Directory in which the matrices (but not their factorisations)
+        are also stored, as one .npy file per array, so that they can
+        be reused by other processes and later sessions.
+    mmap_mode : str, default None
+        Passed to numpy.load for the arrays read from path, e.g. "r" to
+        memory-map large PTDF and BODF matrices read-only.
+
+    Examples
+    --------
+    >>> network.matrix_cache = pypsa.pfsolvers.MatrixCache(path="matrices", mmap_mode="r")
+    """
+
+    def __init__(self, maxsize=128, path=None, mmap_mode=None):
+        self.maxsize = maxsize
+        self.path = path
+        self.mmap_mode = mmap_mode
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        """Remove all entries from memory; the files in path are kept."""
+        self._entries.clear()
+
+    def get(self, key, kind):
+        """Return the entry kind for the hash key, or None if there is none."""
+
+        entry = self._entries.pop((key, kind), None)
+        if entry is None and self.path is not None and isinstance(kind, six.string_types):
+            entry = self._load(key, kind)
+        if entry is not None:
+            self._store(key, kind, entry)
+        return entry
+
+    def set(self, key, kind, entry, persist=True):
+        """Store entry as kind for the hash key. Entries which are
+        dictionaries of arrays and sparse matrices are also written to
+        path if persist is True."""
+
+        self._store(key, kind, entry)
+        if persist and self.path is not None:
+            self._save(key, kind, entry)
+
+    def _store(self, key, kind, entry):
+        self._entries[(key, kind)] = entry
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def _directory(self, key, kind):
+        return os.path.join(self.path, "{}-{}".format(kind, key))
+
+    def _save(self, key, kind, entry):
+        directory = self._directory(key, kind)
+        if os.path.isdir(directory):
+            return
+
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+
+        #write into a temporary directory first, so that other
+        #processes never see incomplete entries
+        tmp = tempfile.mkdtemp(dir=self.path)
+        index = {}
+        for name, value in entry.items():
+            if issparse(value):
+                value = value if value.format in ("csr", "csc") else value.tocsr()
+                for part in ("data", "indices", "indptr"):
+                    np.save(os.path.join(tmp, "{}.{}.npy".format(name, part)), getattr(value, part))
+                index[name] = {"format" : value.format, "shape" : list(value.shape)}
+            else:
+                np.save(os.path.join(tmp, name + ".npy"), np.asarray(value))
+                index[name] = {"format" : "dense"}
+        with open(os.path.join(tmp, "index.json"), "w") as f:
+            json.dump(index, f)
+
+        try:
+            os.rename(tmp, directory)
+        except OSError:
+            #another process was faster
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _load(self, key, kind):
+        directory = self._directory(key, kind)
+        if not os.path.isdir(directory):
+            return None
+
+        def load(name):
+            return np.load(os.path.join(directory, name + ".npy"), mmap_mode=self.mmap_mode)
+
+        with open(os.path.join(directory, "index.json")) as f:
+            index = json.load(f)
+
+        entry = {}
+        for name, info in index.items():
+            if info["format"] == "dense":
+                entry[name] = load(name)
+            else:
+                matrix = csr_matrix if info["format"] == "csr" else csc_matrix
+                entry[name] = matrix(tuple(load("{}.{}".format(name, part))
+                                           for part in ("data", "indices", "indptr")),
+                                     shape=tuple(info["shape"]))
+        return entry
+
+
+def _matrix_key(sub_network):
+    #hash of everything the matrices of sub_network depend on
+
+    from .components import passive_branch_components
+
+    network = sub_network.network
+
+    h = hashlib.sha1()
+    def update(*values):
+        for value in values:
+            h.update(np.ascontiguousarray(value).tobytes() if isinstance(value, np.ndarray)
+                     else "|".join(map(str, value)).encode("utf-8"))
+
+    update([network.sub_networks.at[sub_network.name,"carrier"], len(sub_network.pvs)],
+           sub_network.buses_o)
+
+    for c in sub_network.iterate_components(passive_branch_components):
+        df = c.df.loc[c.ind]
+        attrs = ["r_pu", "x_pu", "g_pu", "b_pu"]
+        if c.name == "Transformer":
+            attrs += ["tap_ratio", "tap_side", "phase_shift"]
+        update([c.name], c.ind, df.bus0, df.bus1, df[attrs].values.astype(float))
+
+    shunt_impedances_i = sub_network.shunt_impedances_i()
+    df = network.shunt_impedances.loc[shunt_impedances_i]
+    update(df.bus, df[["g_pu", "b_pu"]].values.astype(float))
+
+    return h.hexdigest()
+
+
+def _from_cache(sub_network, kind):
+    #set the attributes of sub_network stored as kind in the matrix
+    #cache and return whether there were any
+    cache = getattr(sub_network.network, "matrix_cache", None)
+    key = getattr(sub_network, "_matrix_key", None)
+    if cache is None or key is None:
+        return False
+
+    entry = cache.get(key, kind)
+    if entry is None:
+        return False
+
+    for name, value in entry.items():
+        setattr(sub_network, name, value)
+    return True
+
+
+def _to_cache(sub_network, kind, names):
+    cache = getattr(sub_network.network, "matrix_cache", None)
+    key = getattr(sub_network, "_matrix_key", None)
+    if cache is not None and key is not None:
+        cache.set(key, kind, {name : getattr(sub_network, name) for name in names})
+
+
+def _cached(sub_network, kind, compute, key=None):
+    #get an object which cannot be stored on disk, like a
+    #factorisation, from the matrix cache or compute and add it; key
+    #defaults to the hash of the current matrices of sub_network
+    cache = getattr(sub_network.network, "matrix_cache", None)
+    if key is None:
+        key = getattr(sub_network, "_matrix_key", None)
+    if cache is None or key is None:
+        return compute()
+
+    entry = cache.get(key, kind)
+    if entry is None:
+        entry = compute()
+        cache.set(key, kind, entry, persist=False)
+    return entry
+
+
+def _options_key(linear_solver_options):
+    return tuple(sorted((linear_solver_options or {}).items()))
+
+
+#maximum number of times a Newton step is halved by the backtracking line search
+_max_backtracks = 10
+
+#with a divergence_factor, Newton-Raphson also gives up if the error has
+#not halved within this many iterations
+_max_stalled_iterations = 5
+
+
+def _check_step_control(step_control):
+    if step_control not in (None, "backtracking", "iwamoto"):
+        raise ValueError("step_control must be one of None, 'backtracking' or 'iwamoto', got: {}".format(step_control))
+
+
+def _optimal_multipliers(F0, F1):
+    """Iwamoto's optimal multipliers for the Newton steps of several
+    systems at once.
+
+    F0 holds the mismatches before and F1 the mismatches after the full
+    Newton step, one row per system. With the quadratic approximation
+    F(mu) = (1 - mu)*F0 + mu**2*F1 of the mismatch after the step
+    scaled by mu, the multiplier minimises |F(mu)|^2, which leads to a
+    cubic equation in mu. The best real root in (0, 1] is returned,
+    otherwise 1 (the full step)."""
+
+    a = (F0*F0).sum(axis=1)
+    b = (F0*F1).sum(axis=1)
+    c = (F1*F1).sum(axis=1)
+
+    mu = ones(len(F0))
+    for k in range(len(F0)):
+        coefficients = np.array([2*c[k], -3*b[k], a[k] + 2*b[k], -a[k]])
+        if c[k] == 0 or not np.isfinite(coefficients).all():
+            continue
+        roots = np.roots(coefficients)
+        roots = roots.real[(abs(roots.imag) < 1e-10) & (roots.real > 0) & (roots.real <= 1)]
+        if len(roots):
+            objective = a[k]*(1-roots)**2 + 2*b[k]*(1-roots)*roots**2 + c[k]*roots**4
+            mu[k] = roots[objective.argmin()]
+
+    return mu
+
+
+class JacobianPattern(object):
+    """
+    Power flow Jacobian with a fixed sparsity pattern.
+
+    The sparsity pattern of the Jacobian only depends on the bus
+    admittance matrix Y and on the positions of the PV and PQ buses,
+    so it is built once; for each new guess of the voltages only the
+    data array of the CSC matrix is filled in. If a fill-reducing
+    ordering of the buses is given, the rows and columns of the
+    Jacobian are ordered bus by bus accordingly; otherwise the column
+    ordering found by the first LU factorisation is used. The ordering
+    is folded into the pattern, so that all later factorisations (for
+    all iterations and snapshots) reuse it instead of analysing the
+    matrix again.
+
+    With an iterative linear solver the Newton steps are instead found
+    with GMRES or BiCGSTAB, preconditioned with an incomplete LU
+    factorisation of the first Jacobian, which is reused for all later
+    iterations and snapshots as long as the Krylov iterations converge.
+
+    The reactive power rows of some magnitude unknowns can be replaced
+    by the rows of the identity matrix in the same pattern (see dfdx),
+    e.g. for PV buses which keep their voltage magnitude fixed.
+
+    Parameters
+    ----------
+    Y : scipy.sparse matrix
+        Bus admittance matrix.
+    pvpq_i, pq_i : numpy.ndarray
+        Integer positions of the PV and PQ buses, respectively the PQ
+        buses, in the bus ordering of Y.
+    linear_solver_options : dict, default None
+        See network_pf.
+    bus_order : numpy.ndarray, default None
+        Integer positions of the buses in the bus ordering of Y, in a
+        fill-reducing order (see find_bus_ordering).
+
+    """
+
+    def __init__(self, Y, pvpq_i, pq_i, linear_solver_options=None, bus_order=None):
+
+        self.Y = Y
+        self.pvpq_i = pvpq_i
+        self.pq_i = pq_i
+        self.bus_order = bus_order
+        self.linear_solver_options = linear_solver_options
+        self.direct = (linear_solver_options or {}).get("solver", "lu") == "lu"
+        self._preconditioner = None
+
+        n_buses = Y.shape[0]
+        n_pvpq = len(pvpq_i)
+
+        #entries of Y, including all diagonal entries even if zero
+        Y = Y.tocoo()
+        diag = np.arange(n_buses)
+        Y_entries = csr_matrix((r_[Y.data, zeros(n_buses)],
+                                (r_[Y.row, diag], r_[Y.col, diag])),
+                               shape=(n_buses, n_buses))
+        Y_entries.sum_duplicates()
+        Y_entries = Y_entries.tocoo()
+
+        self.row = Y_entries.row
+        self.col = Y_entries.col
+        self.y = Y_entries.data
+        self.diag = csr_matrix((np.arange(len(self.y)), (self.row, self.col)),
+                               shape=(n_buses, n_buses)).diagonal().astype(int)
+
+        #position of each bus among the angle and magnitude unknowns
+        pos_pvpq = -ones(n_buses, dtype=int)
+        pos_pvpq[pvpq_i] = np.arange(n_pvpq)
+        pos_pq = -ones(n_buses, dtype=int)
+        pos_pq[pq_i] = np.arange(len(pq_i))
+
+        row_pvpq, col_pvpq = pos_pvpq[self.row], pos_pvpq[self.col]
+        row_pq, col_pq = pos_pq[self.row], pos_pq[self.col]
+
+        self.b00 = ((row_pvpq >= 0) & (col_pvpq >= 0)).nonzero()[0]
+        self.b01 = ((row_pvpq >= 0) & (col_pq >= 0)).nonzero()[0]
+        self.b10 = ((row_pq >= 0) & (col_pvpq >= 0)).nonzero()[0]
+        self.b11 = ((row_pq >= 0) & (col_pq >= 0)).nonzero()[0]
+
+        self.J_row = r_[row_pvpq[self.b00], row_pvpq[self.b01],
+                        n_pvpq + row_pq[self.b10], n_pvpq + row_pq[self.b11]]
+
+        #magnitude unknown in whose reactive power row each entry lies
+        #(-1 for the active power rows) and the entries of the identity
+        self._q_row = r_[-ones(len(self.b00) + len(self.b01), dtype=int),
+                         row_pq[self.b10], row_pq[self.b11]]
+        self._q_entries = (self._q_row >= 0).nonzero()[0]
+        self._q_eye = r_[zeros(len(self.b00) + len(self.b01) + len(self.b10)),
+                         (self.row[self.b11] == self.col[self.b11]).astype(float)][self._q_entries]
+        self.J_col = r_[col_pvpq[self.b00], n_pvpq + col_pq[self.b01],
+                        col_pvpq[self.b10], n_pvpq + col_pq[self.b11]]
+
+        self.n = n_pvpq + len(pq_i)
+        self.perm_r = None
+
+        if bus_order is not None:
+            #the angle and magnitude unknowns (and mismatches) of each
+            #bus are put next to each other in the order of the buses
+            order = np.column_stack((pos_pvpq[bus_order],
+                                     np.where(pos_pq[bus_order] >= 0, n_pvpq + pos_pq[bus_order], -1))).ravel()
+            order = order[order >= 0]
+            self.perm_c = np.empty(self.n, dtype=int)
+            self.perm_c[order] = np.arange(self.n)
+            self.perm_r = self.perm_c
+            self._row_order = order
+            self._build_pattern(self.perm_c[self.J_col], self.perm_r[self.J_row])
+        else:
+            #the column ordering only matters for the direct solver
+            self.perm_c = None if self.direct else np.arange(self.n)
+            self._build_pattern(self.J_col)
+
+    def __getstate__(self):
+        #the incomplete LU factorisation cannot be pickled, it is
+        #recomputed when needed
+        state = self.__dict__.copy()
+        state["_preconditioner"] = None
+        return state
+
+    def _build_pattern(self, J_col, J_row=None):
+        #entries are numbered so that we can read off where each one
+        #ends up in the data array of the CSC matrix
+        if J_row is None:
+            J_row = self.J_row
+        self.J = csc_matrix((np.arange(1., len(J_row)+1.), (J_row, J_col)),
+                            shape=(self.n, self.n))
+        self.J_order = self.J.data.astype(int) - 1
+
+    def matches(self, Y, pvpq_i, pq_i, linear_solver_options=None, bus_order=None):
+        return (self.Y is Y and np.array_equal(self.pvpq_i, pvpq_i)
+                and np.array_equal(self.pq_i, pq_i)
+                and self.linear_solver_options == linear_solver_options
+                and np.array_equal(self.bus_order, bus_order))
+
+    def _values(self, V):
+        #Jacobian entries of each snapshot (row of V) in the order of
+        #the block masks
+
+        I = (self.Y*V.T).T
+
+        YV = self.y*V[:,self.col]
+        dS_dVa = -1j*V[:,self.row]*np.conj(YV)
+        dS_dVm = V[:,self.row]*np.conj(YV/abs(V[:,self.col]))
+
+        dS_dVa[:,self.diag] += 1j*V*np.conj(I)
+        dS_dVm[:,self.diag] += V/abs(V)*np.conj(I)
+
+        return np.hstack((dS_dVa[:,self.b00].real, dS_dVm[:,self.b01].real,
+                          dS_dVa[:,self.b10].imag, dS_dVm[:,self.b11].imag))
+
+    def analyse(self, V):
+        """Find a fill-reducing column ordering with an LU factorisation
+        of the Jacobian at the complex voltages V and fold it into the
+        pattern, so that all later factorisations reuse it."""
+
+        data = self._values(np.atleast_2d(V)[:1])[0]
+        J = csc_matrix((data[self.J_order], self.J.indices, self.J.indptr), shape=self.J.shape)
+        try:
+            self.perm_c = splu(J).perm_c
+        except RuntimeError:
+            self.perm_c = np.arange(self.n)
+        self._build_pattern(self.perm_c[self.J_col])
+
+    def dfdx(self, V, fixed=None):
+        """Fill in the Jacobian for the complex voltages V.
+
+        If V is two-dimensional, with one row of bus voltages per
+        snapshot, the Jacobians of all the snapshots are returned as
+        a single block-diagonal matrix. The pattern itself is not
+        modified, so that it can be shared between threads once the
+        ordering is known.
+
+        If fixed is given, a boolean array with a row for each snapshot
+        and a column for each magnitude unknown (the positions pq_i),
+        the reactive power rows of the fixed magnitudes are replaced by
+        the rows of the identity matrix.
+        """
+
+        V = np.atleast_2d(V)
+        n_blocks = V.shape[0]
+
+        if self.perm_c is None:
+            self.analyse(V)
+
+        data = self._values(V)
+
+        if fixed is not None:
+            q_row = self._q_row[self._q_entries]
+            data[:,self._q_entries] = np.where(fixed[:,q_row], self._q_eye, data[:,self._q_entries])
+
+        nnz = self.J.nnz
+        offsets = np.arange(n_blocks)[:,newaxis]
+        return csc_matrix((data[:,self.J_order].ravel(),
+                           (self.J.indices + self.n*offsets).ravel(),
+                           r_[(self.J.indptr[:-1] + nnz*offsets).ravel(), n_blocks*nnz]),
+                          shape=(n_blocks*self.n, n_blocks*self.n))
+
+    def _solve_iterative(self, J, F):
+        #the preconditioner is built from the Jacobian of a single snapshot
+        ordered = self.perm_r is not None
+        if self._preconditioner is None:
+            self._preconditioner = _factorise(J[:self.n,:self.n], self.linear_solver_options, ordered=ordered)
+        try:
+            return self._preconditioner.solve(F, J)
+        except RuntimeError as e:
+            #the preconditioner may be out of date, so build a new one
+            logger.info("%s, updating the preconditioner", e)
+            self._preconditioner = _factorise(J[:self.n,:self.n], self.linear_solver_options, ordered=ordered)
+            try:
+                return self._preconditioner.solve(F, J)
+            except RuntimeError as e:
+                logger.warning("%s, using a direct solver for this Newton step", e)
+                return splu(J).solve(F)
+
+    def _solve(self, J, F):
+        #solve in the ordering of the pattern
+        n_blocks = J.shape[0] // self.n
+
+        if not self.direct:
+            try:
+                return self._solve_iterative(J, F)
+            except RuntimeError as e:
+                logger.warning("Solving for the Newton step failed: %s", e)
+                return np.full(len(F), np.nan)
+
+        try:
+            if self.perm_r is not None:
+                lu = splu(J, permc_spec="NATURAL", options=dict(SymmetricMode=True))
+            else:
+                lu = splu(J, permc_spec="NATURAL")
+            return lu.solve(F)
+        except RuntimeError as e:
+            if n_blocks == 1:
+                logger.warning("Factorisation of the Jacobian failed: %s", e)
+                return np.full(len(F), np.nan)
+
+            #find the singular blocks, so that only their snapshots fail
+            x = np.empty(len(F))
+            for b in range(n_blocks):
+                block = slice(b*self.n, (b+1)*self.n)
+                x[block] = self._solve(J[block,block], F[block])
+            return x
+
+    def solve(self, J, F):
+        """Solve J dx = F for a Jacobian J returned by self.dfdx."""
+
+        n_blocks = J.shape[0] // self.n
+
+        if self.perm_r is not None:
+            F = F.reshape(n_blocks, self.n)[:,self._row_order].ravel()
+
+        x = self._solve(J, F)
+
+        return x.reshape(n_blocks, self.n)[:,self.perm_c].ravel()
+
+
+def _newton_raphson_pf(jacobian, s, v_mag_pu, v_ang, x_tol=1e-6, lim_iter=100, history=None,
+                       step_control=None, divergence_factor=None, q_limits=None):
+    """Solve the power flow equations for a batch of snapshots at once
+    with Newton-Raphson, working only on numpy arrays.
+
+    In each iteration the mismatches and Jacobians of all snapshots
+    which have not yet converged are computed together and the Newton
+    steps are found from a single factorisation of their
+    block-diagonal Jacobian. A snapshot is masked out as soon as its
+    mismatch is below the tolerance (or has become NaN).
+
+    With q_limits the voltage magnitudes of the PV buses are unknowns
+    as well (they have to be among jacobian.pq_i), whose equations
+    hold them at their set-points. Once a snapshot has converged, its
+    PV buses whose reactive power lies outside the limits are switched
+    to PQ buses at the violated limit by swapping their rows of the
+    Jacobian and the mismatches, and the iterations go on.
+
+    Parameters
+    ----------
+    jacobian : JacobianPattern
+        Holds the bus admittance matrix, the positions of the PV and
+        PQ buses and the sparsity pattern of the Jacobian.
+    s : numpy.ndarray
+        Complex power injections with one row per snapshot and one
+        column per bus.
+    v_mag_pu, v_ang : numpy.ndarray
+        Voltage magnitudes and angles with one row per snapshot and one
+        column per bus, containing the known values and the initial
+        guess for the unknowns; they are overwritten in place with the
+        solution.
+    x_tol : float
+        Tolerance for Newton-Raphson power flow.
+    lim_iter : int
+        Maximum number of Newton-Raphson iterations.
+    history : list, default None
+        If a list, the errors of all snapshots are appended to it
+        before the first and after each iteration.
+    step_control : string, default None
+        Take full Newton steps (None), halve the steps of each snapshot
+        until its error decreases ("backtracking") or scale them by
+        Iwamoto's optimal multiplier ("iwamoto").
+    divergence_factor : float, default None
+        Stop iterating on a snapshot as soon as its error exceeds
+        divergence_factor times its initial error or has not halved
+        within _max_stalled_iterations iterations.
+    q_limits : tuple, default None
+        Tuple (pv_i, v_set, q_min, q_max) of the integer positions of
+        the PV buses and arrays with one row per snapshot and one
+        column per PV bus of their voltage magnitude set-points and
+        the limits of their reactive power injections.
+
+    Returns
+    -------
+    n_iter : numpy.ndarray
+        Number of iterations for each snapshot.
+    diff : numpy.ndarray
+        Remaining error for each snapshot.
+    """
+
+    Y = jacobian.Y
+    pvpq_i = jacobian.pvpq_i
+    pq_i = jacobian.pq_i
+    n_pvpq = len(pvpq_i)
+
+    if q_limits is not None:
+        pv_i, v_set, q_min, q_max = q_limits
+        pos_pq = -ones(Y.shape[0], dtype=int)
+        pos_pq[pq_i] = np.arange(len(pq_i))
+        pv_k = n_pvpq + pos_pq[pv_i]
+        #the limits become the set-points of switched buses
+        s = s.copy()
+        #which magnitudes are held at their set-point by each snapshot
+        fixed = zeros((len(s), len(pq_i)), dtype=bool)
+        fixed[:,pv_k - n_pvpq] = True
+
+    def f(ix):
+        mismatch = V[ix]*np.conj((Y*V[ix].T).T) - s[ix]
+        F = np.hstack((mismatch.real[:,pvpq_i], mismatch.imag[:,pq_i]))
+        if q_limits is not None:
+            F[:,pv_k] = np.where(fixed[ix][:,pv_k - n_pvpq], v_mag_pu[ix][:,pv_i] - v_set[ix], F[:,pv_k])
+        return F
+
+    def error(F):
+        return abs(F).max(axis=1) if F.shape[1] else zeros(len(F))
+
+    _check_step_control(step_control)
+
+    n_iter = zeros(len(s), dtype=int)
+    V = v_mag_pu*np.exp(1j*v_ang)
+    F = f(slice(None))
+    diff = error(F)
+    if history is not None:
+        history.append(diff.copy())
+
+    diverging = np.zeros(len(s), dtype=bool)
+    if divergence_factor is not None:
+        limit = divergence_factor*diff
+        best = diff.copy()
+        stalled = zeros(len(s), dtype=int)
+
+    def step(rows, mu):
+        #move the snapshots rows (positions in active) by mu times their Newton step
+        ix = active[rows]
+        v_ang[np.ix_(ix, pvpq_i)] = ang[rows] - mu[:,newaxis]*dx[rows,:n_pvpq]
+        v_mag_pu[np.ix_(ix, pq_i)] = mag[rows] - mu[:,newaxis]*dx[rows,n_pvpq:]
+        V[ix] = v_mag_pu[ix]*np.exp(1j*v_ang[ix])
+        F[ix] = f(ix)
+
+    for i in range(lim_iter):
+        active = ((diff > x_tol) & ~diverging).nonzero()[0]
+        if len(active) == 0:
+            break
+
+        n_iter[active] += 1
+
+        J = jacobian.dfdx(V[active], None if q_limits is None else fixed[active])
+        dx = jacobian.solve(J, F[active].ravel()).reshape(len(active), -1)
+
+        ang = v_ang[np.ix_(active, pvpq_i)]
+        mag = v_mag_pu[np.ix_(active, pq_i)]
+        F_old = F[active]
+        mu = ones(len(active))
+        step(slice(None), mu)
+
+        if step_control == "iwamoto":
+            mu = _optimal_multipliers(F_old, F[active])
+            rows = (mu != 1.).nonzero()[0]
+            if len(rows):
+                step(rows, mu[rows])
+        elif step_control == "backtracking":
+            for j in range(_max_backtracks):
+                rows = (~(error(F[active]) < diff[active])).nonzero()[0]
+                if len(rows) == 0:
+                    break
+                mu[rows] /= 2.
+                step(rows, mu[rows])
+
+        diff[active] = error(F[active])
+
+        if q_limits is not None:
+            #switch the PV buses of converged snapshots which violate their limits
+            done = active[diff[active] <= x_tol]
+            q = (V[done][:,pv_i]*np.conj((Y[pv_i,:]*V[done].T).T)).imag
+            above = fixed[done][:,pv_k - n_pvpq] & (q > q_max[done] + x_tol)
+            below = fixed[done][:,pv_k - n_pvpq] & (q < q_min[done] - x_tol)
+            switched = (above | below).any(axis=1)
+            if switched.any():
+                done, above, below = done[switched], above[switched], below[switched]
+                s_pv = s[done][:,pv_i]
+                s[np.ix_(done, pv_i)] = s_pv.real + 1j*np.where(above, q_max[done],
+                                                                np.where(below, q_min[done], s_pv.imag))
+                fixed[np.ix_(done, pv_k - n_pvpq)] &= ~(above | below)
+                F[done] = f(done)
+                diff[done] = error(F[done])
+                if divergence_factor is not None:
+                    best[done], stalled[done] = diff[done], 0
+                logger.info("Switching %d PV buses of %d snapshots to PQ at their reactive power limits after %d iterations",
+                            (above | below).sum(), len(done), i+1)
+
+        if history is not None:
+            history.append(diff.copy())
+
+        if divergence_factor is not None:
+            improved = diff[active] < 0.5*best[active]
+            best[active[improved]] = diff[active[improved]]
+            stalled[active] = np.where(improved, 0, stalled[active] + 1)
+            diverging[active] = ~(diff[active] <= limit[active]) | (stalled[active] >= _max_stalled_iterations)
+            if diverging[active].any():
+                logger.info("Aborting Newton-Raphson for %d diverging or stalling snapshots after %d iterations",
+                            diverging[active].sum(), i+1)
+
+        logger.debug("Error at iteration %d: %f for %d snapshots", i+1, diff[active].max(), len(active))
+
+    return n_iter, diff
+
+
+def _fast_decoupled_pf(Bp_lu, Bpp_lu, Y, pvpq_i, pq_i, s, v_mag_pu, v_ang, x_tol=1e-6, lim_iter=30,
+                       history=None):
+    """Solve the power flow equations for a batch of snapshots at once
+    with the fast-decoupled load flow, working only on numpy arrays.
+
+    Each iteration is a half-iteration for the voltage angles with the
+    factorised matrix B' followed by a half-iteration for the voltage
+    magnitudes of the PQ buses with B''; both are solved for all the
+    snapshots which have not yet converged as a multi-column
+    right-hand side.
+
+    Parameters
+    ----------
+    Bp_lu, Bpp_lu : _SparseLU
+        Factorisations of B' for the PV and PQ buses and B'' for the PQ
+        buses (None if there are no PQ buses).
+    Y : scipy.sparse matrix
+        Bus admittance matrix.
+    pvpq_i, pq_i : numpy.ndarray
+        Integer positions of the PV and PQ buses, respectively the PQ
+        buses.
+    s, v_mag_pu, v_ang : numpy.ndarray
+        As for _newton_raphson_pf; v_mag_pu and v_ang are overwritten in
+        place.
+    x_tol : float
+        Tolerance for the mismatch of the power flow equations.
+    lim_iter : int
+        Maximum number of iterations.
+    history : list, default None
+        As for _newton_raphson_pf.
+
+    Returns
+    -------
+    n_iter : numpy.ndarray
+        Number of iterations for each snapshot.
+    diff : numpy.ndarray
+        Remaining error for each snapshot.
+    """
+
+    def mismatch(active):
+        V = v_mag_pu[active]*np.exp(1j*v_ang[active])
+        return V*np.conj((Y*V.T).T) - s[active]
+
+    def error(mismatch):
+        F = np.hstack((mismatch.real[:,pvpq_i], mismatch.imag[:,pq_i]))
+        return abs(F).max(axis=1) if F.shape[1] else zeros(len(F))
+
+    n_iter = zeros(len(s), dtype=int)
+    diff = error(mismatch(slice(None)))
+    if history is not None:
+        history.append(diff.copy())
+
+    for i in range(lim_iter):
+        active = (diff > x_tol).nonzero()[0]
+        if len(active) == 0:
+            break
+
+        n_iter[active] += 1
+
+        P = mismatch(active).real[:,pvpq_i]/v_mag_pu[np.ix_(active, pvpq_i)]
+        v_ang[np.ix_(active, pvpq_i)] -= Bp_lu.solve(np.asfortranarray(P.T)).T
+
+        if Bpp_lu is not None:
+            Q = mismatch(active).imag[:,pq_i]/v_mag_pu[np.ix_(active, pq_i)]
+            v_mag_pu[np.ix_(active, pq_i)] -= Bpp_lu.solve(np.asfortranarray(Q.T)).T
+
+        diff[active] = error(mismatch(active))
+        if history is not None:
+            history.append(diff.copy())
+
+        logger.debug("Error at iteration %d: %f for %d snapshots", i+1, diff[active].max(), len(active))
+
+    return n_iter, diff
+
+
+def _sweep_pf(levels, y_shunt, Y, pvpq_i, pq_i, s, v_mag_pu, v_ang, x_tol=1e-6, lim_iter=100,
+              history=None):
+    """Solve the power flow equations for a batch of snapshots of a
+    radial sub-network without PV buses with the backward/forward
+    sweep, working only on numpy arrays.
+
+    In the backward sweep the branch currents are accumulated from the
+    leaves towards the slack, in the forward sweep the voltages are
+    updated from the slack towards the leaves; both proceed level by
+    level for all snapshots at once and need no factorisation.
+
+    Parameters
+    ----------
+    levels, y_shunt
+        As returned by _radial_sweep_levels.
+    Y : scipy.sparse matrix
+        Bus admittance matrix, for the mismatch.
+    pvpq_i, pq_i : numpy.ndarray
+        Integer positions of the PV and PQ buses, respectively the PQ
+        buses.
+    s, v_mag_pu, v_ang : numpy.ndarray
+        As for _newton_raphson_pf; v_mag_pu and v_ang are overwritten in
+        place.
+    x_tol : float
+        Tolerance for the mismatch of the power flow equations.
+    lim_iter : int
+        Maximum number of iterations.
+    history : list, default None
+        As for _newton_raphson_pf.
+
+    Returns
+    -------
+    n_iter : numpy.ndarray
+        Number of iterations for each snapshot.
+    diff : numpy.ndarray
+        Remaining error for each snapshot.
+    """
+
+    def error(V, s):
+        mismatch = V*np.conj((Y*V.T).T) - s
+        F = np.hstack((mismatch.real[:,pvpq_i], mismatch.imag[:,pq_i]))
+        return abs(F).max(axis=1) if F.shape[1] else zeros(len(F))
+
+    n_iter = zeros(len(s), dtype=int)
+    V = v_mag_pu*np.exp(1j*v_ang)
+    diff = error(V, s)
+    if history is not None:
+        history.append(diff.copy())
+
+    for i in range(lim_iter):
+        active = (diff > x_tol).nonzero()[0]
+        if len(active) == 0:
+            break
+
+        n_iter[active] += 1
+
+        V_a = V[active]
+        I = np.conj(s[active]/V_a) - y_shunt*V_a
+
+        #backward sweep: current into each branch from its child bus
+        #and, via the two-port equations, from its parent bus
+        i_t = []
+        for buses, parents, y_ff, y_ft, y_tf, y_tt in reversed(levels):
+            i_t.append(I[:,buses])
+            v_f = (i_t[-1] - y_tt*V_a[:,buses])/y_tf
+            np.subtract.at(I, (slice(None), parents), y_ff*v_f + y_ft*V_a[:,buses])
+
+        #forward sweep: voltages from the slack outwards
+        for (buses, parents, y_ff, y_ft, y_tf, y_tt), i_t_l in zip(levels, reversed(i_t)):
+            V_a[:,buses] = (i_t_l - y_tf*V_a[:,parents])/y_tt
+
+        V[active] = V_a
+        diff[active] = error(V_a, s[active])
+        if history is not None:
+            history.append(diff.copy())
+
+        logger.debug("Error at iteration %d: %f for %d snapshots", i+1, diff[active].max(), len(active))
+
+    v_mag_pu[:] = abs(V)
+    v_ang[:] = np.angle(V)
+
+    return n_iter, diff
+
+
+def _object_array(items):
+    #1d array of objects, even if the items are arrays of the same length
+    a = np.empty(len(items), dtype=object)
+    for i, item in enumerate(items):
+        a[i] = item
+    return a
+
+
+def _residuals(history, n_iter):
+    #the errors of each snapshot from a history of _newton_raphson_pf,
+    #_fast_decoupled_pf or _sweep_pf, up to its last iteration
+    history = np.array(history)
+    return [history[:n+1,k] for k, n in enumerate(n_iter)]
+
+
+def _pf_chunk(jacobian, s, v_mag_pu, v_ang, x_tol, batch_size, chain, solver, record_residuals, nr_options,
+              q_limits, chunk):
+    #run the power flow on the snapshots in the slice chunk, in
+    #batches of batch_size snapshots; if chain, the unknowns of each
+    #batch are seeded with the last converged snapshot before it; if
+    #solver is a tuple (method, name, function, args, tol) of the
+    #fast-decoupled load flow or the sweep, it is tried first (until its
+    #error is below tol, which is at most x_tol) and
+    #Newton-Raphson (with the keyword arguments nr_options) only run
+    #for the snapshots where it fails; q_limits are the reactive power
+    #limits of the PV buses for Newton-Raphson (without a solver); besides
+    #the solution, the iterations, errors, wall time of the batch,
+    #method and (if record_residuals) the errors after each iteration
+    #are returned for each snapshot
+    n_iter = zeros(chunk.stop - chunk.start, dtype=int)
+    diff = zeros(chunk.stop - chunk.start)
+    seconds = zeros(chunk.stop - chunk.start)
+    methods = np.empty(chunk.stop - chunk.start, dtype=object)
+    residuals = [None]*(chunk.stop - chunk.start) if record_residuals else None
+    seed = None
+
+    for batch in _batches(chunk, batch_size):
+        start = time.time()
+        v_mag_pu_b = v_mag_pu[batch]
+        v_ang_b = v_ang[batch]
+
+        if chain and seed is not None:
+            v_mag_pu_b[:,jacobian.pq_i] = seed[0]
+            v_ang_b[:,jacobian.pvpq_i] = seed[1]
+
+        local = slice(batch.start - chunk.start, batch.stop - chunk.start)
+        history = [] if record_residuals else None
+
+        if solver is None:
+            q_limits_b = None if q_limits is None else (q_limits[0],) + tuple(a[batch] for a in q_limits[1:])
+            n_iter[local], diff[local] = _newton_raphson_pf(jacobian, s[batch], v_mag_pu_b, v_ang_b, x_tol=x_tol,
+                                                            history=history, q_limits=q_limits_b, **nr_options)
+            methods[local] = "nr"
+            if record_residuals:
+                residuals[local] = _residuals(history, n_iter[local])
+            logger.info("Newton-Raphson solved %d snapshots in at most %d iterations with error of at most %f in %f seconds",
+                        len(n_iter[local]), n_iter[local].max(), diff[local].max(), time.time()-start)
+        else:
+            method, name, function, args, tol = solver
+            guess = v_mag_pu_b.copy(), v_ang_b.copy()
+            n_iter[local], diff[local] = function(*(args + (jacobian.Y, jacobian.pvpq_i, jacobian.pq_i,
+                                                            s[batch], v_mag_pu_b, v_ang_b)), x_tol=tol,
+                                                  history=history)
+            methods[local] = method
+            if record_residuals:
+                residuals[local] = _residuals(history, n_iter[local])
+            logger.info("%s solved %d snapshots in at most %d iterations with error of at most %f in %f seconds",
+                        name, len(n_iter[local]), n_iter[local].max(), diff[local].max(), time.time()-start)
+
+            failed = (~(diff[local] <= x_tol)).nonzero()[0]
+            if len(failed):
+                logger.info("Falling back to Newton-Raphson for %d snapshots", len(failed))
+                history = [] if record_residuals else None
+                v_mag_pu_f, v_ang_f = guess[0][failed], guess[1][failed]
+                n_iter_f, diff[local][failed] = _newton_raphson_pf(jacobian, s[batch][failed], v_mag_pu_f, v_ang_f,
+                                                                   x_tol=x_tol, history=history, **nr_options)
+                n_iter[local][failed] += n_iter_f
+                v_mag_pu_b[failed], v_ang_b[failed] = v_mag_pu_f, v_ang_f
+                methods[local][failed] = method + "+nr"
+                if record_residuals:
+                    for k, r in zip(failed, _residuals(history, n_iter_f)):
+                        residuals[local.start + k] = np.r_[residuals[local.start + k], r]
+
+        seconds[local] = time.time() - start
+
+        converged = (diff[local] <= x_tol).nonzero()[0]
+        if len(converged):
+            seed = (v_mag_pu_b[converged[-1],jacobian.pq_i], v_ang_b[converged[-1],jacobian.pvpq_i])
+
+    return v_mag_pu[chunk], v_ang[chunk], n_iter, diff, seconds, methods, residuals
+
+
+def _lpf_chunk(B_lu, H, p_bus_shift, p_branch_shift, p, batch_size, chunk):
+    #solve the linear power flow for the snapshots in the slice chunk,
+    #batch_size snapshots at a time
+    v_diff = np.zeros(p[chunk].shape)
+    flows = np.empty((len(v_diff), H.shape[0]))
+    for batch in _batches(chunk, batch_size):
+        local = slice(batch.start - chunk.start, batch.stop - chunk.start)
+        v_diff[local, 1:] = B_lu.solve(np.asfortranarray((p[batch, 1:] - p_bus_shift[1:]).T)).T
+        flows[local] = (H * v_diff[local].T).T + p_branch_shift
+    return v_diff, flows
@@ -13,6 +13,12 @@ import numpy as np
 from itertools import chain, product
 
 import os
+import re
+import shutil
+import filecmp
+import tempfile
+
+import pytest
 
 
 
@@ -51,5 +57,267 @@ def test_lopf():
 
 
 
+#solvers of the sparse backend, with whether they are installed
+sparse_solvers = {"scipy-highs" : lambda: pypsa.linopf._scipy_version >= '1.7',
+                  "glpk" : lambda: find_executable("glpsol") is not None,
+                  "cbc" : lambda: find_executable("cbc") is not None,
+                  "gurobi" : lambda: find_executable("gurobi_cl") is not None}
+
+
+def _sparse_solvers():
+    return [solver_name for solver_name, installed in sorted(sparse_solvers.items()) if installed()]
+
+
+def _skip_unless_installed(solver_name):
+    if not sparse_solvers[solver_name]():
+        pytest.skip("{} is not installed".format(solver_name))
+
+
+@pytest.mark.parametrize("solver_name", sorted(sparse_solvers))
+def test_lopf_sparse(solver_name):
+
+    _skip_unless_installed(solver_name)
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lopf")
+
+    network_r = pypsa.Network(csv_folder_name=results_folder_name)
+
+    #test results were generated with GLPK and are stored with limited
+    #precision, so other solvers are only compared to 4 decimals
+    for formulation in ["angles", "cycles", "kirchhoff", "ptdf"]:
+        status, termination_condition = network.lopf(snapshots=network.snapshots, solver_name=solver_name,
+                                                      backend="sparse", formulation=formulation)
+        assert status == "ok" and termination_condition == "optimal"
+
+        np.testing.assert_array_almost_equal(network.generators_t.p.loc[:,network.generators.index],network_r.generators_t.p.loc[:,network.generators.index],decimal=4)
+
+        np.testing.assert_array_almost_equal(network.lines_t.p0.loc[:,network.lines.index],network_r.lines_t.p0.loc[:,network.lines.index],decimal=4)
+
+        np.testing.assert_array_almost_equal(network.links_t.p0.loc[:,network.links.index],network_r.links_t.p0.loc[:,network.links.index],decimal=4)
+
+        np.testing.assert_array_almost_equal(network.lines.s_nom_opt,network_r.lines.s_nom_opt,decimal=4)
+
+        np.testing.assert_array_almost_equal(network.buses_t.marginal_price.loc[:,network.buses.index],network_r.buses_t.marginal_price.loc[:,network.buses.index],decimal=4)
+
+        assert abs(network.objective - network_r.objective) < 1e-6*abs(network_r.objective)
+
+
+@pytest.mark.parametrize("solver_name", sorted(sparse_solvers))
+def test_lopf_sparse_failure(solver_name):
+
+    _skip_unless_installed(solver_name)
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    network.generators_t.p = pd.DataFrame(1., network.snapshots, network.generators.index)
+    dispatch = network.generators_t.p.copy()
+
+    #a solve which is stopped early leaves the results untouched
+    iteration_limits = {"scipy-highs" : {"maxiter" : 1}, "cbc" : {"maxIterations" : 1},
+                        "gurobi" : {"IterationLimit" : 1}}
+    if solver_name in iteration_limits:
+        status, termination_condition = network.lopf(snapshots=network.snapshots, solver_name=solver_name,
+                                                      backend="sparse",
+                                                      solver_options=iteration_limits[solver_name])
+        assert (status, termination_condition) == ("warning", "maxIterations")
+        np.testing.assert_array_equal(network.generators_t.p, dispatch)
+
+    #and so does an infeasible problem
+    network.co2_limit = -1.
+    status, termination_condition = network.lopf(snapshots=network.snapshots, solver_name=solver_name,
+                                                  backend="sparse")
+    assert status != "ok"
+    np.testing.assert_array_equal(network.generators_t.p, dispatch)
+
+
+def test_scipy_highs_registered():
+
+    assert pypsa.linopf.sparse_solvers["scipy-highs"] is pypsa.linopf.solve_scipy_highs
+
+    #without HiGHS (scipy < 1.7) the solver says what it needs
+    if pypsa.linopf._scipy_version < '1.7':
+        try:
+            pypsa.linopf.solve_scipy_highs(pypsa.linopf.LinearProblem())
+        except ImportError as e:
+            assert "scipy >= 1.7" in str(e)
+        else:
+            raise AssertionError("solve_scipy_highs ran without HiGHS")
+
+
+def test_lopf_lp_file():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    network.determine_network_topology()
+    network.calculate_dependent_values()
+    for sub_network in network.sub_networks.obj:
+        sub_network.find_slack_bus()
+
+    lp = pypsa.linopf.build_lopf_problem(network, network.snapshots, "kirchhoff")
+    streamed = pypsa.linopf.build_lopf_problem(network, network.snapshots, "kirchhoff",
+                                               lp=pypsa.linopf.LPFileProblem())
+
+    path = tempfile.mkdtemp()
+    try:
+        lp.write_lp(os.path.join(path, "memory.lp"))
+        streamed.write_lp(os.path.join(path, "streamed.lp"))
+        assert filecmp.cmp(os.path.join(path, "memory.lp"), os.path.join(path, "streamed.lp"), shallow=False)
+
+        with open(os.path.join(path, "streamed.lp")) as f:
+            constraints = f.read().split("s.t.\n")[1].split("bounds\n")[0]
+    finally:
+        shutil.rmtree(path)
+
+    #read the constraints back
+    A = np.zeros((lp.n_constraints, lp.n_variables))
+    b = np.zeros(lp.n_constraints)
+    for row, terms, sense, rhs in re.findall(r"c(\d+):\n((?:\S+ x\d+\n)*)(<=|=|>=) (\S+)\n", constraints):
+        for coefficient, column in re.findall(r"(\S+) x(\d+)", terms):
+            A[int(row), int(column)] += float(coefficient)
+        b[int(row)] = float(rhs)
+
+    np.testing.assert_array_almost_equal(A, lp.A.toarray())
+    np.testing.assert_array_almost_equal(b, lp.b, decimal=6)
+
+    #the streamed problem has no matrix form to hand to scipy
+    assert not hasattr(streamed, "A")
+    try:
+        pypsa.linopf.solve_scipy_highs(streamed)
+    except TypeError:
+        pass
+    else:
+        raise AssertionError("solve_scipy_highs accepted an LPFileProblem")
+
+    if find_executable("glpsol") is not None:
+        network_r = pypsa.Network(csv_folder_name=os.path.join(csv_folder_name,"results-lopf"))
+        network.lopf(snapshots=network.snapshots, solver_name="glpk", backend="sparse")
+        np.testing.assert_array_almost_equal(network.generators_t.p.loc[:,network.generators.index],network_r.generators_t.p.loc[:,network.generators.index])
+        np.testing.assert_array_almost_equal(network.lines_t.p0.loc[:,network.lines.index],network_r.lines_t.p0.loc[:,network.lines.index])
+
+
+def _persistent_models():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    model = network.build_lopf(network.snapshots, formulation="kirchhoff")
+
+    model.update(loads=1.1*network.loads_t.p_set, p_max_pu=0.9*network.generators_t.p_max_pu,
+                 marginal_cost=1.5*network.generators.marginal_cost, co2_limit=1e5)
+    model.update(co2_limit=2e5)
+
+    #the same changes made to the network before building the model
+    network_r = pypsa.Network(csv_folder_name=csv_folder_name)
+    network_r.loads_t.p_set *= 1.1
+    network_r.generators_t.p_max_pu *= 0.9
+    network_r.generators.marginal_cost *= 1.5
+    network_r.co2_limit = 2e5
+
+    model_r = network_r.build_lopf(network_r.snapshots, formulation="kirchhoff")
+
+    return model, model_r
+
+
+def test_lopf_persistent():
+
+    model, model_r = _persistent_models()
+
+    #the updated model is the same as one built from scratch
+    lp, lp_r = model.lp, model_r.lp
+    assert abs(lp.A - lp_r.A).max() == 0.
+    for attr in ["b", "c", "lower", "upper"]:
+        np.testing.assert_array_equal(getattr(lp, attr), getattr(lp_r, attr))
+
+    network = model.network
+
+    #only generators have their marginal costs updated
+    marginal_cost = pd.Series(1., network.links.index[:1])
+    try:
+        model.update(marginal_cost=marginal_cost)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("LOPFModel.update accepted the marginal cost of a link")
+
+    #closing the model removes the basis kept for warm starts
+    with model:
+        model._basis_fn
+        directory = model._directory
+        assert os.path.isdir(directory)
+    assert not os.path.exists(directory) and model._directory is None
+
+
+def test_lopf_persistent_update():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    #a generator with fixed capacity, so that its availability is a bound
+    gen = "Manchester Wind"
+    network.generators.loc[gen, ["p_nom_extendable", "p_nom"]] = [False, 100.]
+    load = network.loads.index[0]
+
+    model = network.build_lopf(network.snapshots, formulation="kirchhoff")
+    lp = model.lp
+    A, b, upper, c = lp.A.copy(), lp.b.copy(), lp.upper.copy(), lp.c.copy()
+
+    model.update(loads=network.loads_t.p_set[[load]] + 10., p_max_pu=0.5*network.generators_t.p_max_pu[[gen]] + 0.1,
+                 marginal_cost=network.generators.marginal_cost[[gen]] + 1., co2_limit=2e5)
+
+    def changed(new, old):
+        return set(np.flatnonzero(new != old))
+
+    def positions(families, name, label):
+        index, snapshots, positions = families[name]
+        return set(positions[:, pd.Index(index).get_loc(label)])
+
+    #only the balances at the bus of the load and the CO2 limit, the
+    #bounds of the generator and its objective coefficients change
+    assert changed(lp.b, b) == (positions(lp.constraints, "power_balance", network.loads.at[load, "bus"])
+                                | {int(lp.constraints["co2_constraint"][2])})
+    assert lp.b[lp.constraints["co2_constraint"][2]] == 2e5
+    assert changed(lp.upper, upper) == positions(lp.variables, "generator_p", gen)
+    assert changed(lp.c, c) == positions(lp.variables, "generator_p", gen)
+    assert abs(lp.A - A).max() == 0.
+
+
+@pytest.mark.parametrize("solver_name", sorted(sparse_solvers))
+def test_lopf_persistent_solve(solver_name):
+
+    _skip_unless_installed(solver_name)
+
+    model, model_r = _persistent_models()
+    network, network_r = model.network, model_r.network
+
+    model.solver_name = model_r.solver_name = solver_name
+    status, termination_condition = model.solve()
+    assert status == "ok"
+    status, termination_condition = model_r.solve()
+    assert status == "ok"
+
+    np.testing.assert_array_almost_equal(network.generators_t.p,network_r.generators_t.p)
+    np.testing.assert_array_almost_equal(network.lines_t.p0,network_r.lines_t.p0)
+    assert abs(network.objective - network_r.objective) < 1e-6*abs(network_r.objective)
+
+
 if __name__ == "__main__":
     test_lopf()
+    for solver_name in _sparse_solvers():
+        test_lopf_sparse(solver_name)
+        test_lopf_sparse_failure(solver_name)
+    test_scipy_highs_registered()
+    test_lopf_lp_file()
+    test_lopf_persistent()
+    test_lopf_persistent_update()
+    for solver_name in _sparse_solvers():
+        test_lopf_persistent_solve(solver_name)
@@ -14,6 +14,9 @@ from itertools import chain
 
 import os
 
+import shutil
+import tempfile
+import pickle
 
 
 from distutils.spawn import find_executable
@@ -46,5 +49,265 @@ def test_lpf():
     np.testing.assert_array_almost_equal(network.links_t.p0,network_r.links_t.p0)
 
 
+def test_batch_lpf():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lpf")
+
+    network_r = pypsa.Network(csv_folder_name=results_folder_name)
+
+    #use a small batch size to make sure batches are stitched together correctly
+    for kwargs in [dict(batch_size=3),
+                   dict(batch_size=3, n_workers=2, executor="thread"),
+                   dict(batch_size=3, n_workers=2, executor="process")]:
+        network.batch_lpf(snapshots=network.snapshots, solver_options=kwargs)
+
+        np.testing.assert_array_almost_equal(network.generators_t.p,network_r.generators_t.p)
+        np.testing.assert_array_almost_equal(network.lines_t.p0,network_r.lines_t.p0)
+        np.testing.assert_array_almost_equal(network.links_t.p0,network_r.links_t.p0)
+
+
+def test_shared_pool():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lpf")
+
+    network_r = pypsa.Network(csv_folder_name=results_folder_name)
+
+    #all sub-networks are solved in one pool, which is started once
+    with pypsa.pfsolvers._shared_pool(dict(n_workers=2, executor="thread")) as solver_options:
+        pool = solver_options["executor"]
+        results = []
+        for chunks in [[0, 1], [2, 3, 4]]:
+            results.append(pypsa.pfsolvers._map_chunks(pow, (2,), chunks, 2, pool))
+            if results == [[1, 2]]:
+                started = pool._pool
+        assert results == [[1, 2], [4, 8, 16]]
+        assert pool._pool is started
+    assert pool._pool is None
+
+    #a pool given as executor is used as it is
+    from multiprocessing.pool import ThreadPool
+    pool = ThreadPool(2)
+    try:
+        network.batch_lpf(snapshots=network.snapshots, solver_options=dict(batch_size=3, n_workers=2, executor=pool))
+    finally:
+        pool.close()
+        pool.join()
+
+    np.testing.assert_array_almost_equal(network.lines_t.p0,network_r.lines_t.p0)
+    np.testing.assert_array_almost_equal(network.links_t.p0,network_r.links_t.p0)
+
+
+def test_matrix_cache():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lpf")
+
+    network_r = pypsa.Network(csv_folder_name=results_folder_name)
+
+    network.lpf(network.snapshots)
+    B = {sn.name : sn.B for sn in network.sub_networks.obj if len(sn.branches_i()) > 0}
+
+    #the topology is determined again, but B comes from the cache
+    network.lpf(network.snapshots)
+    for sn in network.sub_networks.obj:
+        if sn.name in B:
+            assert sn.B is B[sn.name]
+
+    np.testing.assert_array_almost_equal(network.lines_t.p0,network_r.lines_t.p0)
+
+    #other impedances give other matrices
+    network.lines.x *= 2.
+    network.lines.r *= 2.
+    network.lpf(network.snapshots)
+    for sn in network.sub_networks.obj:
+        if sn.name in B:
+            assert sn.B is not B[sn.name]
+
+    #the matrices stored on disk are used by other networks
+    path = tempfile.mkdtemp()
+    try:
+        BODF = {}
+        for mmap_mode in [None, "r"]:
+            network = pypsa.Network(csv_folder_name=csv_folder_name)
+            network.matrix_cache = pypsa.pfsolvers.MatrixCache(path=path, mmap_mode=mmap_mode)
+            network.lpf(network.snapshots)
+
+            np.testing.assert_array_almost_equal(network.lines_t.p0,network_r.lines_t.p0)
+
+            for sn in network.sub_networks.obj:
+                if len(sn.branches_i()) > 0:
+                    sn.calculate_BODF()
+                    if mmap_mode is None:
+                        BODF[sn.name] = sn.BODF
+                    else:
+                        assert isinstance(sn.BODF, np.memmap)
+                        np.testing.assert_array_almost_equal(sn.BODF, BODF[sn.name])
+    finally:
+        shutil.rmtree(path)
+
+
 if __name__ == "__main__":
     test_lpf()
+    test_batch_lpf()
+    test_shared_pool()
+    test_matrix_cache()
+
+
+def test_bus_injections():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    network.lpf(network.snapshots)
+
+    #compare with the aggregation over the components
+    p = sum([(c.pnl.p * c.df.sign).groupby(c.df.bus, axis=1).sum()
+             .reindex(columns=network.buses.index, fill_value=0.)
+             for c in network.iterate_components(pypsa.components.one_port_components)]
+            +
+            [(- c.pnl["p"+str(i)]).groupby(c.df["bus"+str(i)], axis=1).sum()
+             .reindex(columns=network.buses.index, fill_value=0.)
+             for c in network.iterate_components(pypsa.components.controllable_branch_components)
+             for i in [0,1]])
+
+    np.testing.assert_array_almost_equal(network.buses_t.p, p)
+
+    #the operators survive the sub-networks being determined anew
+    operators = dict(network._injection_operators)
+    network.lpf(network.snapshots)
+    for key, entry in network._injection_operators.items():
+        assert entry[-1] is operators[key][-1]
+
+    #and are rebuilt when a component moves to another bus
+    network.generators.loc[network.generators.index[0], "bus"] = network.buses.index[1]
+    network.lpf(network.snapshots)
+    assert any(entry[-1] is not operators[key][-1]
+               for key, entry in network._injection_operators.items())
+
+
+def test_stacked_lpf():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    results_folder_name = os.path.join(csv_folder_name,"results-lpf")
+
+    network_r = pypsa.Network(csv_folder_name=results_folder_name)
+
+    #stack some and then all sub-networks into one block-diagonal system
+    for max_stacked_buses in [3, len(network.buses)]:
+        network.lpf(network.snapshots, solver_options=dict(max_stacked_buses=max_stacked_buses))
+
+        np.testing.assert_array_almost_equal(network.generators_t.p,network_r.generators_t.p)
+        np.testing.assert_array_almost_equal(network.lines_t.p0,network_r.lines_t.p0)
+        np.testing.assert_array_almost_equal(network.links_t.p0,network_r.links_t.p0)
+        np.testing.assert_array_almost_equal(network.buses_t.v_ang,network_r.buses_t.v_ang)
+
+        for sn in network.sub_networks.obj:
+            assert sn.buses_o[0] == sn.slack_bus == network.sub_networks.at[sn.name,"slack_bus"]
+
+
+def test_find_bus_controls():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+    network.determine_network_topology()
+
+    #two slack generators in sub-network 0, none in 2 and no generators in 1
+    network.generators.loc[["Manchester Wind", "Manchester Gas"], "control"] = "Slack"
+    network.generators.loc["Frankfurt Gas", "control"] = "PV"
+    controls = network.generators.control.copy()
+
+    #one sub-network at a time and all of them at once choose the same
+    for stacked in [False, True]:
+        network.generators.control = controls
+        if stacked:
+            pypsa.pf._find_bus_controls(network, list(network.sub_networks.obj))
+        else:
+            for sn in network.sub_networks.obj:
+                sn.find_bus_controls()
+
+        assert network.generators.control.to_dict() == {"Manchester Wind" : "Slack", "Manchester Gas" : "PV",
+                                                        "Norway Wind" : "Slack", "Norway Gas" : "PQ",
+                                                        "Frankfurt Wind" : "Slack", "Frankfurt Gas" : "PV"}
+        assert network.sub_networks.slack_bus.tolist() == ["Manchester", "Norwich DC", "Frankfurt", "Norway"]
+        assert [sn.slack_generator for sn in network.sub_networks.obj] == ["Manchester Wind", None,
+                                                                           "Frankfurt Wind", "Norway Wind"]
+        assert [list(sn.buses_o) for sn in network.sub_networks.obj] == [["Manchester", "London", "Norwich"],
+                                                                         ["Norwich DC", "Bremen DC", "Norway DC"],
+                                                                         ["Frankfurt", "Bremen"], ["Norway"]]
+        assert network.buses.control.to_dict() == {"London" : "PQ", "Norwich" : "PQ", "Norwich DC" : "Slack",
+                                                   "Manchester" : "Slack", "Bremen" : "PQ", "Bremen DC" : "PQ",
+                                                   "Frankfurt" : "Slack", "Norway" : "Slack", "Norway DC" : "PQ"}
+
+
+def test_determine_network_topology():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    #a bus with another carrier makes its sub-network mixed, which is
+    #only warned about
+    network.buses.loc["Norwich", "carrier"] = "gas"
+
+    #the old sub-networks are replaced when the topology is determined again
+    for i in range(2):
+        network.determine_network_topology()
+
+        assert network.sub_networks.carrier.tolist() == ["AC", "DC", "AC", "AC"]
+        assert [sn.name for sn in network.sub_networks.obj] == network.sub_networks.index.tolist()
+        assert network.buses.sub_network.groupby(network.buses.sub_network).size().tolist() == [3, 3, 2, 1]
+
+        #each sub-network takes the carrier of its first bus
+        first_buses = network.buses.groupby("sub_network").head(1)
+        np.testing.assert_array_equal(network.sub_networks.carrier.loc[first_buses.sub_network],
+                                      first_buses.carrier)
+
+
+def test_compile_lpf():
+
+    csv_folder_name = "../examples/ac-dc-meshed/ac-dc-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    network.lpf(network.snapshots)
+
+    for sn in network.sub_networks.obj:
+        operator = sn.compile_lpf()
+        p = network.buses_t.p.loc[:, operator.buses].values
+        p0 = pd.concat([network.pnl(c).p0 for c in ["Line", "Transformer"]], axis=1)
+
+        flows = operator.flows(p)
+        assert flows.shape == (len(network.snapshots), len(sn.branches_i()))
+        np.testing.assert_array_almost_equal(flows, p0.loc[:, operator.branches.get_level_values(1)].values)
+
+        #single vectors and preallocated outputs
+        np.testing.assert_array_almost_equal(operator.flows(p[0]), flows[0])
+        out = np.empty_like(flows)
+        assert operator.flows(p, out=out) is out
+        np.testing.assert_array_almost_equal(out, flows)
+        out = np.empty(len(operator.branches))
+        assert operator.flows(p[0], out=out) is out
+        np.testing.assert_array_almost_equal(out, flows[0])
+
+        #monitored subset, also after pickling
+        if len(sn.branches_i()) > 1:
+            monitored = operator.branches[::2]
+            subset = pickle.loads(pickle.dumps(sn.compile_lpf(branches=monitored)))
+            assert subset.branches.equals(monitored)
+            np.testing.assert_array_almost_equal(subset.flows(p), flows[:, ::2])
@@ -69,3 +69,49 @@ def test_pypower_case():
             si_pypsa = getattr(pnl,si).loc[network.now].values
             si_pypower = results_df['branch'][si][df.original_index].values
             np.testing.assert_array_almost_equal(si_pypsa,si_pypower)
+
+
+def test_update_branches():
+
+    network = pypsa.Network()
+    network.import_from_pypower_ppc(case())
+
+    outage = ("Line", network.lines.index[5])
+    changed = ("Line", network.lines.index[7])
+
+    p0 = network.lpf_contingency([network.now], branch_outages=[outage])
+
+    #switch the branch out without calculating the matrices again
+    sub_network = network.sub_networks.obj.iat[0]
+    sub_network.update_branches([outage], in_service=False)
+    network.lpf(skip_pre=True)
+
+    np.testing.assert_array_almost_equal(network.lines_t.p0.loc[network.now, p0.index.get_level_values(1)],
+                                         p0[outage])
+
+    #change the parameters of another branch and switch the first in again
+    network.lines.loc[changed[1], ["r", "x"]] *= 1.5
+    network.calculate_dependent_values()
+    sub_network.update_branches([changed])
+    sub_network.update_branches([outage], in_service=True)
+    network.lpf(skip_pre=True)
+
+    updated = {attr : getattr(sub_network, attr).copy() for attr in ["B", "H", "p_bus_shift"]}
+    p0 = network.lines_t.p0.loc[network.now].copy()
+
+    sub_network.calculate_Y(skip_pre=True)
+    sub_network.update_branches([changed], in_service=False)
+    sub_network.update_branches([changed], in_service=True)
+    updated.update({attr : getattr(sub_network, attr).copy() for attr in ["Y", "Y0", "Y1"]})
+
+    #compare with calculating everything again
+    network.lpf()
+    sub_network = network.sub_networks.obj.iat[0]
+    sub_network.calculate_Y(skip_pre=True)
+
+    np.testing.assert_array_almost_equal(network.lines_t.p0.loc[network.now], p0)
+    for attr, value in updated.items():
+        value = value.toarray() if hasattr(value, "toarray") else value
+        expected = getattr(sub_network, attr)
+        expected = expected.toarray() if hasattr(expected, "toarray") else expected
+        np.testing.assert_array_almost_equal(value, expected)
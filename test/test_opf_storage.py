@@ -14,6 +14,8 @@ from itertools import chain
 
 import os
 
+import pytest
+
 
 from distutils.spawn import find_executable
 
@@ -58,5 +60,205 @@ def test_opf():
 
 
 
+def test_storage_spill_weightings():
+
+    csv_folder_name = "../examples/opf-storage-hvdc/opf-storage-data"
+
+    solvers = [solver_name for solver_name, executable in [("glpk", "glpsol"), ("cbc", "cbc")]
+               if find_executable(executable) is not None]
+    if not solvers:
+        pytest.skip("neither glpk nor cbc is installed")
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+
+    #uneven weightings and more inflow than the storage can take, so
+    #that it spills
+    network.snapshot_weightings = pd.Series(np.arange(1., 1. + len(network.snapshots)) % 3 + 1.,
+                                            network.snapshots)
+    network.storage_units_t.inflow *= 50.
+
+    for backend in ["pyomo", "sparse"]:
+        network.lopf(network.snapshots, solver_name=solvers[0], backend=backend)
+
+        spill = network.storage_units_t.spill
+        assert (spill.values > 1e-3).any()
+
+        #each spillage is weighted with its own snapshot
+        sus = network.storage_units
+        w = network.snapshot_weightings
+        inflow = network.storage_units_t.inflow.reindex(columns=sus.index).fillna(0.)
+        soc = sus.state_of_charge_initial.where(~sus.cyclic_state_of_charge,
+                                                network.storage_units_t.state_of_charge.iloc[-1])
+        for sn in network.snapshots:
+            p = network.storage_units_t.p.loc[sn]
+            soc = (soc*(1-sus.standing_loss)**w[sn]
+                   + (sus.efficiency_store*(-p).clip(lower=0) - p.clip(lower=0)/sus.efficiency_dispatch
+                      + inflow.loc[sn] - spill.loc[sn])*w[sn])
+            np.testing.assert_array_almost_equal(soc, network.storage_units_t.state_of_charge.loc[sn], decimal=4)
+            soc = network.storage_units_t.state_of_charge.loc[sn]
+
+
+def test_rolling_horizon_lopf():
+
+    csv_folder_name = "../examples/opf-storage-hvdc/opf-storage-data"
+
+    def load_network():
+        network = pypsa.Network(csv_folder_name=csv_folder_name)
+        #dispatch only
+        for c, attr in [("Generator", "p_nom"), ("StorageUnit", "p_nom"), ("Link", "p_nom"), ("Line", "s_nom")]:
+            df = network.df(c)
+            df.loc[df[attr+"_extendable"], attr] = 1000.
+            df[attr+"_extendable"] = False
+        network.add("Store", "Store 0", bus=network.buses.index[0], e_nom=500., standing_loss=0.01, e_initial=100.)
+        network.co2_limit = None
+        return network
+
+    #any installed solver of the sparse backend
+    solvers = [solver_name for solver_name, installed in [("scipy-highs", pypsa.linopf._scipy_version >= '1.7'),
+                                                          ("glpk", find_executable("glpsol")),
+                                                          ("cbc", find_executable("cbc"))]
+               if installed]
+    if not solvers:
+        pytest.skip("no solver of the sparse backend is installed")
+    solver_name = solvers[0]
+
+    network = load_network()
+    network.lopf(network.snapshots, solver_name=solver_name, backend="sparse", formulation="kirchhoff",
+                 horizon=4, overlap=2)
+
+    #the initial values are restored
+    network_r = load_network()
+    for attr in ["state_of_charge_initial", "cyclic_state_of_charge"]:
+        np.testing.assert_array_equal(network.storage_units[attr], network_r.storage_units[attr])
+    np.testing.assert_array_equal(network.stores.e_initial, network_r.stores.e_initial)
+
+    #the state of charge and energy continue from one window to the next
+    sus = network.storage_units
+    stores = network.stores
+    w = network.snapshot_weightings
+    inflow = network.storage_units_t.inflow.reindex(columns=sus.index).fillna(0.)
+    soc = sus.state_of_charge_initial
+    e = stores.e_initial
+    for sn in network.snapshots:
+        p = network.storage_units_t.p.loc[sn]
+        soc = (soc*(1-sus.standing_loss)**w[sn]
+               + (sus.efficiency_store*(-p).clip(lower=0) - p.clip(lower=0)/sus.efficiency_dispatch
+                  + inflow.loc[sn] - network.storage_units_t.spill.loc[sn])*w[sn])
+        np.testing.assert_array_almost_equal(soc, network.storage_units_t.state_of_charge.loc[sn], decimal=4)
+        soc = network.storage_units_t.state_of_charge.loc[sn]
+
+        e = e*(1-stores.standing_loss)**w[sn] - network.stores_t.p.loc[sn]*w[sn]
+        np.testing.assert_array_almost_equal(e, network.stores_t.e.loc[sn], decimal=4)
+        e = network.stores_t.e.loc[sn]
+
+    #the objective counts the marginal costs of each snapshot once,
+    #although the overlaps are optimised twice
+    costs = (network.generators_t.p.dot(network.generators.marginal_cost)
+             + network.storage_units_t.p.clip(lower=0).dot(sus.marginal_cost)
+             + network.stores_t.p.dot(stores.marginal_cost)
+             + network.links_t.p0.dot(network.links.marginal_cost))
+    np.testing.assert_almost_equal(network.objective, costs.mul(w).sum(), decimal=2)
+
+    #a window which fails is reported and leaves the objective alone
+    objective = network.objective
+    p_set = network.loads_t.p_set.copy()
+    network.loads_t.p_set.iloc[-1] = 1e6
+    status, termination_condition = network.lopf(network.snapshots, solver_name=solver_name, backend="sparse",
+                                                 formulation="kirchhoff", horizon=4, overlap=2)
+    assert status != "ok"
+    assert network.objective == objective
+    network.loads_t.p_set = p_set
+
+    #a single window is the same as optimising all snapshots, without
+    #cyclic conditions
+    network.lopf(network.snapshots, solver_name=solver_name, backend="sparse", formulation="kirchhoff",
+                 horizon=len(network.snapshots))
+    network_r.storage_units.cyclic_state_of_charge = False
+    network_r.lopf(network_r.snapshots, solver_name=solver_name, backend="sparse", formulation="kirchhoff")
+    np.testing.assert_array_almost_equal(network.generators_t.p, network_r.generators_t.p)
+    np.testing.assert_almost_equal(network.objective, network_r.objective)
+
+
+def test_rolling_horizon_handoff():
+
+    csv_folder_name = "../examples/opf-storage-hvdc/opf-storage-data"
+
+    network = pypsa.Network(csv_folder_name=csv_folder_name)
+    network.add("Store", "Store 0", bus=network.buses.index[0], e_nom=500., e_initial=100., marginal_cost=2.)
+    network.storage_units.cyclic_state_of_charge = True
+
+    snapshots = network.snapshots
+    sus = network.storage_units
+    stores = network.stores
+    initial = sus.state_of_charge_initial.copy(), stores.e_initial.copy()
+
+    class Solution(object):
+        #a dispatch of 1 for every component and snapshot of the window
+        def __init__(self, window):
+            self.window = window
+
+        def values(self, name):
+            df = {"generator_p" : network.generators, "storage_p_dispatch" : sus,
+                  "store_p" : stores, "link_p" : network.links}[name]
+            return pd.Series(1., pd.MultiIndex.from_product([df.index, self.window]))
+
+    #instead of solving, each window records its initial values, sets the
+    #state in each snapshot to the position of the snapshot and costs 100
+    calls = []
+    def network_lopf(network, window, skip_pre=False, **kwargs):
+        calls.append((list(window), sus.cyclic_state_of_charge.any(),
+                      sus.state_of_charge_initial.copy(), stores.e_initial.copy()))
+        if len(calls) == fail:
+            return "warning", "infeasible"
+        position = np.arange(len(snapshots), dtype=float)
+        network.storage_units_t.state_of_charge = pd.DataFrame(np.add.outer(position, np.zeros(len(sus))),
+                                                               snapshots, sus.index)
+        network.stores_t.e = pd.DataFrame(np.add.outer(position, np.zeros(len(stores))), snapshots, stores.index)
+        network.objective = 100.
+        network.model = Solution(window)
+        return "ok", "optimal"
+
+    network_lopf_, pypsa.opf.network_lopf = pypsa.opf.network_lopf, network_lopf
+    try:
+        fail = None
+        status = pypsa.opf._network_lopf_rolling(network, snapshots, 4, 2, dict(backend="sparse"))
+        assert status == ("ok", "optimal")
+
+        #windows of 4 snapshots and an overlap of 2, except at the end,
+        #start from the state at the last snapshot before them (not at
+        #the end of the overlap) and without cyclic conditions
+        assert [window for window, cyclic, soc, e in calls] == [list(snapshots[0:6]), list(snapshots[4:10]),
+                                                                 list(snapshots[8:12])]
+        assert not any(cyclic for window, cyclic, soc, e in calls)
+        np.testing.assert_array_equal(calls[0][2], initial[0])
+        np.testing.assert_array_equal(calls[0][3], initial[1])
+        for (window, cyclic, soc, e), start in zip(calls[1:], [4, 8]):
+            assert (soc == start - 1).all() and (e == start - 1).all()
+
+        #the overlaps are optimised twice, but their costs count once
+        w = network.snapshot_weightings
+        costs = sum(df.marginal_cost.sum() for df in [network.generators, sus, stores, network.links])
+        overlaps = list(snapshots[4:6]) + list(snapshots[8:10])
+        np.testing.assert_almost_equal(network.objective, 3*100. - costs*w.loc[overlaps].sum())
+
+        #the initial values are restored
+        np.testing.assert_array_equal(sus.state_of_charge_initial, initial[0])
+        np.testing.assert_array_equal(stores.e_initial, initial[1])
+        assert sus.cyclic_state_of_charge.all()
+
+        #a failed window stops the horizon and leaves the objective alone
+        objective = network.objective
+        calls, fail = [], 2
+        status = pypsa.opf._network_lopf_rolling(network, snapshots, 4, 2, dict(backend="sparse"))
+        assert status == ("warning", "infeasible") and len(calls) == 2
+        assert network.objective == objective
+        np.testing.assert_array_equal(sus.state_of_charge_initial, initial[0])
+    finally:
+        pypsa.opf.network_lopf = network_lopf_
+
+
 if __name__ == "__main__":
     test_opf()
+    test_storage_spill_weightings()
+    test_rolling_horizon_lopf()
+    test_rolling_horizon_handoff()
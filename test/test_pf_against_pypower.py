@@ -3,7 +3,7 @@ from __future__ import absolute_import
 
 import pypsa
 
-from pypower.api import ppoption, runpf, case118 as case
+from pypower.api import ppoption, runpf, case14, case30, case57, case118
 
 
 import pandas as pd
@@ -15,68 +15,330 @@ import numpy as np
 
 def test_pypower_case():
 
-    #ppopt is a dictionary with the details of the optimization routine to run
-    ppopt = ppoption(PF_ALG=2)
+    for case in [case14, case30, case57, case118]:
 
-    #choose DC or AC
-    ppopt["PF_DC"] = False
+        #ppopt is a dictionary with the details of the optimization routine to run
+        ppopt = ppoption(PF_ALG=2)
 
-    #ppc is a dictionary with details about the network, including baseMVA, branches and generators
-    ppc = case()
+        #choose DC or AC
+        ppopt["PF_DC"] = False
 
-    results,success = runpf(ppc, ppopt)
+        #ppc is a dictionary with details about the network, including baseMVA, branches and generators
+        ppc = case()
 
-    #store results in a DataFrame for easy access
-    results_df = {}
+        results,success = runpf(ppc, ppopt)
 
-    #branches
-    columns = 'bus0, bus1, r, x, b, rateA, rateB, rateC, ratio, angle, status, angmin, angmax, p0, q0, p1, q1'.split(", ")
-    results_df['branch'] = pd.DataFrame(data=results["branch"],columns=columns)
+        #store results in a DataFrame for easy access
+        results_df = {}
 
-    #buses
-    columns = ["bus","type","Pd","Qd","Gs","Bs","area","v_mag_pu","v_ang","v_nom","zone","Vmax","Vmin"]
-    results_df['bus'] = pd.DataFrame(data=results["bus"],columns=columns,index=results["bus"][:,0])
+        #branches
+        columns = 'bus0, bus1, r, x, b, rateA, rateB, rateC, ratio, angle, status, angmin, angmax, p0, q0, p1, q1'.split(", ")
+        results_df['branch'] = pd.DataFrame(data=results["branch"],columns=columns)
 
-    #generators
-    columns = "bus, p, q, q_max, q_min, Vg, mBase, status, p_max, p_min, Pc1, Pc2, Qc1min, Qc1max, Qc2min, Qc2max, ramp_agc, ramp_10, ramp_30, ramp_q, apf".split(", ")
-    results_df['gen'] = pd.DataFrame(data=results["gen"],columns=columns)
+        #buses
+        columns = ["bus","type","Pd","Qd","Gs","Bs","area","v_mag_pu","v_ang","v_nom","zone","Vmax","Vmin"]
+        results_df['bus'] = pd.DataFrame(data=results["bus"],columns=columns,index=results["bus"][:,0])
 
+        #generators
+        columns = "bus, p, q, q_max, q_min, Vg, mBase, status, p_max, p_min, Pc1, Pc2, Qc1min, Qc1max, Qc2min, Qc2max, ramp_agc, ramp_10, ramp_30, ramp_q, apf".split(", ")
+        results_df['gen'] = pd.DataFrame(data=results["gen"],columns=columns)
 
 
-    #now compute in PyPSA
+
+        #now compute in PyPSA
+
+        network = pypsa.Network()
+        network.import_from_pypower_ppc(ppc)
+
+        #PYPOWER uses PI model for transformers, whereas PyPSA defaults to
+        #T since version 0.8.0
+        network.transformers.model = "pi"
+
+        network.pf()
+
+        #compare branch flows
+        for c in network.iterate_components(pypsa.components.passive_branch_components):
+            for si in ["p0","p1","q0","q1"]:
+                si_pypsa = getattr(c.pnl,si).loc[network.now].values
+                si_pypower = results_df['branch'][si][c.df.original_index].values
+                np.testing.assert_array_almost_equal(si_pypsa,si_pypower)
+
+
+        #compare generator dispatch
+        for s in ["p","q"]:
+            s_pypsa = getattr(network.generators_t,s).loc[network.now].values
+            s_pypower = results_df["gen"][s].values
+            np.testing.assert_array_almost_equal(s_pypsa,s_pypower)
+
+
+        #compare voltages
+        v_mag_pypsa = network.buses_t.v_mag_pu.loc[network.now]
+        v_mag_pypower = results_df["bus"]["v_mag_pu"]
+
+        np.testing.assert_array_almost_equal(v_mag_pypsa,v_mag_pypower)
+
+        v_ang_pypsa = network.buses_t.v_ang.loc[network.now]
+        pypower_slack_angle = results_df["bus"]["v_ang"][results_df["bus"]["type"] == 3].values[0]
+        v_ang_pypower = (results_df["bus"]["v_ang"] - pypower_slack_angle)*np.pi/180.
+
+        np.testing.assert_array_almost_equal(v_ang_pypsa,v_ang_pypower)
+
+
+def test_pf_batches():
 
     network = pypsa.Network()
-    network.import_from_pypower_ppc(ppc)
+    network.import_from_pypower_ppc(case118())
+    network.transformers.model = "pi"
 
-    #PYPOWER uses PI model for transformers, whereas PyPSA defaults to
-    #T since version 0.8.0
+    network.set_snapshots(range(5))
+    for c in ["loads", "generators"]:
+        df = getattr(network, c)
+        scaling = np.linspace(0.9, 1.1, len(network.snapshots))
+        getattr(network, c + "_t").p_set = pd.DataFrame(np.outer(scaling, df.p_set),
+                                                        network.snapshots, df.index)
+
+    results = []
+    for kwargs in [dict(solver_options=dict(batch_size=1)), dict(solver_options=dict(batch_size=2)),
+                   dict(solver_options=dict(n_workers=2, executor="thread")),
+                   dict(solver_options=dict(n_workers=2, executor="process")),
+                   dict(use_seed="chain", solver_options=dict(batch_size=1)),
+                   dict(use_seed="lpf"),
+                   dict(solver_options=dict(method="fdlf")),
+                   dict(solver_options=dict(linear_solver=dict(solver="gmres"))),
+                   dict(solver_options=dict(linear_solver=dict(solver="bicgstab")))]:
+        info = network.pf(network.snapshots, **kwargs)
+
+        assert info.converged.all().all()
+        assert (info.n_iter > 0).all().all()
+
+        results.append((network.buses_t.v_ang.copy(), network.lines_t.q0.copy()))
+
+    #the stored solution is already converged
+    info = network.pf(network.snapshots, use_seed="stored")
+    assert (info.n_iter == 0).all().all()
+
+    for result in results[1:]:
+        for r1, r2 in zip(results[0], result):
+            np.testing.assert_array_almost_equal(r1, r2)
+
+    #the fill-reducing bus ordering is kept on the sub-network
+    sub_network = network.sub_networks.obj.iat[0]
+    bus_order = sub_network.find_bus_ordering()
+    assert sorted(bus_order) == list(range(len(sub_network.buses_o)))
+    assert sub_network.find_bus_ordering() is bus_order
+
+
+
+def test_pf_deduplicate():
+
+    network = pypsa.Network()
+    network.import_from_pypower_ppc(case118())
     network.transformers.model = "pi"
 
-    network.pf()
+    #two distinct operating points, repeated
+    network.set_snapshots(range(6))
+    for c in ["loads", "generators"]:
+        df = getattr(network, c)
+        scaling = np.array([0.9, 1.1, 0.9, 0.9, 1.1, 0.9])
+        getattr(network, c + "_t").p_set = pd.DataFrame(np.outer(scaling, df.p_set),
+                                                        network.snapshots, df.index)
 
-    #compare branch flows
-    for c in network.iterate_components(pypsa.components.passive_branch_components):
-        for si in ["p0","p1","q0","q1"]:
-            si_pypsa = getattr(c.pnl,si).loc[network.now].values
-            si_pypower = results_df['branch'][si][c.df.original_index].values
-            np.testing.assert_array_almost_equal(si_pypsa,si_pypower)
+    results = []
+    for deduplicate in [False, True]:
+        info = network.pf(network.snapshots, solver_options=dict(deduplicate=deduplicate))
+        assert info.converged.all().all()
+        assert info.duplicate.values.sum() == (4 if deduplicate else 0)
+        results.append((network.buses_t.v_ang.copy(), network.lines_t.q0.copy(),
+                        network.generators_t.q.copy()))
 
+        network.lpf(network.snapshots, solver_options=dict(deduplicate=deduplicate))
+        results[-1] += (network.lines_t.p0.copy(),)
 
-    #compare generator dispatch
-    for s in ["p","q"]:
-        s_pypsa = getattr(network.generators_t,s).loc[network.now].values
-        s_pypower = results_df["gen"][s].values
-        np.testing.assert_array_almost_equal(s_pypsa,s_pypower)
+    for r1, r2 in zip(*results):
+        np.testing.assert_array_almost_equal(r1, r2)
 
 
-    #compare voltages
-    v_mag_pypsa = network.buses_t.v_mag_pu.loc[network.now]
-    v_mag_pypower = results_df["bus"]["v_mag_pu"]
 
-    np.testing.assert_array_almost_equal(v_mag_pypsa,v_mag_pypower)
+def test_pf_convergence():
+
+    network = pypsa.Network()
+    network.import_from_pypower_ppc(case118())
+    network.transformers.model = "pi"
 
-    v_ang_pypsa = network.buses_t.v_ang.loc[network.now]
-    pypower_slack_angle = results_df["bus"]["v_ang"][results_df["bus"]["type"] == 3].values[0]
-    v_ang_pypower = (results_df["bus"]["v_ang"] - pypower_slack_angle)*np.pi/180.
+    network.set_snapshots(range(5))
+    for c in ["loads", "generators"]:
+        df = getattr(network, c)
+        scaling = np.linspace(0.9, 1.1, len(network.snapshots))
+        getattr(network, c + "_t").p_set = pd.DataFrame(np.outer(scaling, df.p_set),
+                                                        network.snapshots, df.index)
 
-    np.testing.assert_array_almost_equal(v_ang_pypsa,v_ang_pypower)
+    for method in ["nr", "fdlf"]:
+        info = network.pf(network.snapshots, solver_options=dict(method=method, batch_size=1,
+                                                             record_residuals=True))
+        assert info is network.pf_convergence
+
+        for sn in network.sub_networks.index:
+            for snapshot in network.snapshots:
+                residuals = info.residuals.at[snapshot, sn]
+                assert len(residuals) >= info.n_iter.at[snapshot, sn] + 1
+                assert residuals[-1] == info.error.at[snapshot, sn]
+                assert info.method.at[snapshot, sn] in ([method] if method == "nr" else ["fdlf", "fdlf+nr"])
+        assert (info.seconds.values > 0).all()
+
+        summary = network.pf_convergence_summary(n=3, by="n_iter")
+        assert len(summary) == 3
+        assert (np.diff(summary.n_iter.values) <= 0).all()
+        assert network.pf_convergence_summary(non_converged=True).empty
+
+
+def test_pf_step_control():
+
+    network = pypsa.Network()
+    network.import_from_pypower_ppc(case118())
+    network.transformers.model = "pi"
+
+    #the last snapshot is loaded beyond the point of voltage collapse
+    network.set_snapshots(range(3))
+    scaling = np.array([1., 1.5, 3.5])
+    for c in ["loads", "generators"]:
+        df = getattr(network, c)
+        getattr(network, c + "_t").p_set = pd.DataFrame(np.outer(scaling, df.p_set),
+                                                        network.snapshots, df.index)
+    network.loads_t.q_set = pd.DataFrame(np.outer(scaling, network.loads.q_set),
+                                         network.snapshots, network.loads.index)
+
+    network.pf(network.snapshots)
+    v_ang = network.buses_t.v_ang.copy()
+
+    for step_control in ["backtracking", "iwamoto"]:
+        info = network.pf(network.snapshots, solver_options=dict(step_control=step_control,
+                                                             divergence_factor=1e3))
+
+        np.testing.assert_array_almost_equal(network.buses_t.v_ang.iloc[:2], v_ang.iloc[:2])
+        assert info.converged.values.ravel().tolist() == [True, True, False]
+        assert info.n_iter.values.max() < 20
+
+    try:
+        network.pf(network.snapshots, solver_options=dict(step_control="armijo"))
+    except ValueError:
+        pass
+    else:
+        assert False, "invalid step_control was accepted"
+
+    #max_stacked_buses only applies to the linear power flow
+    try:
+        network.pf(network.snapshots, solver_options=dict(max_stacked_buses=10))
+    except ValueError:
+        pass
+    else:
+        assert False, "unknown solver option was accepted"
+
+
+def test_pf_q_limits():
+
+    network = pypsa.Network()
+    network.import_from_pypower_ppc(case118())
+    network.transformers.model = "pi"
+
+    network.set_snapshots(range(2))
+    scaling = np.array([1., 1.1])
+    for c in ["loads", "generators"]:
+        df = getattr(network, c)
+        getattr(network, c + "_t").p_set = pd.DataFrame(np.outer(scaling, df.p_set),
+                                                        network.snapshots, df.index)
+
+    info = network.pf(network.snapshots, solver_options=dict(enforce_q_limits=True))
+    assert info.converged.values.all()
+
+    pv = network.generators.index[network.generators.control == "PV"]
+    q = network.generators_t.q[pv]
+    q_min, q_max = network.generators.q_min[pv], network.generators.q_max[pv]
+    assert ((q <= q_max + 1e-6) & (q >= q_min - 1e-6)).values.all()
+
+    #the case has several PV generators which are limited
+    limited = ((q - q_max).abs() < 1e-6) | ((q - q_min).abs() < 1e-6)
+    assert (limited.sum(axis=1) > 0).all()
+
+    #the same as fixing the limited generators at their limits
+    for snapshot in network.snapshots:
+        fixed = network.copy(with_time=False)
+        for c in ["loads", "generators"]:
+            getattr(fixed, c).p_set = getattr(network, c + "_t").p_set.loc[snapshot]
+        fixed.generators.loc[pv[limited.loc[snapshot]], "control"] = "PQ"
+        fixed.generators.loc[pv[limited.loc[snapshot]], "q_set"] = q.loc[snapshot, limited.loc[snapshot]]
+        fixed.pf()
+
+        np.testing.assert_array_almost_equal(fixed.buses_t.v_mag_pu.iloc[0], network.buses_t.v_mag_pu.loc[snapshot])
+        np.testing.assert_array_almost_equal(fixed.buses_t.v_ang.iloc[0], network.buses_t.v_ang.loc[snapshot])
+
+
+
+def test_pf_auto_sweep():
+
+    #a radial feeder without PV buses, which method="auto" solves with
+    #the backward/forward sweep
+    network = pypsa.Network()
+    network.set_snapshots(range(4))
+    network.add("Bus", "0", v_nom=20.)
+    network.add("Generator", "slack", bus="0", control="Slack")
+    rng = np.random.RandomState(0)
+    for i in range(1, 30):
+        network.add("Bus", str(i), v_nom=20.)
+        network.add("Line", str(i), bus0=str(rng.randint(0, i)), bus1=str(i), r=0.3, x=0.3, s_nom=10.)
+        network.add("Load", str(i), bus=str(i), p_set=1. + rng.rand(), q_set=0.3)
+    network.loads_t.p_set = pd.DataFrame(np.outer(np.linspace(0.5, 1.5, 4), network.loads.p_set),
+                                         network.snapshots, network.loads.index)
+
+    info = network.pf(network.snapshots)
+    assert (info.method == "sweep").all().all()
+    results = (network.buses_t.v_mag_pu.copy(), network.buses_t.v_ang.copy(), network.lines_t.p0.copy(),
+               network.lines_t.q0.copy())
+
+    #with the default tolerance the sweep is as precise as Newton-Raphson
+    info = network.pf(network.snapshots, solver_options=dict(method="nr"))
+    assert (info.method == "nr").all().all()
+    for r1, r2 in zip(results, (network.buses_t.v_mag_pu, network.buses_t.v_ang, network.lines_t.p0,
+                                network.lines_t.q0)):
+        np.testing.assert_array_almost_equal(r1, r2)
+
+
+def test_update_branches_pf():
+
+    network = pypsa.Network()
+    network.import_from_pypower_ppc(case30())
+    network.transformers.model = "pi"
+
+    #a line in a loop, so that the network stays connected without it
+    outage = ("Line", network.lines.index[1])
+
+    network_r = network.copy()
+    network_r.remove(*outage)
+    network_r.lpf()
+    p0 = network_r.lines_t.p0.loc[network.now]
+    network_r.pf()
+    v_ang_r = network_r.buses_t.v_ang.loc[network.now]
+
+    network.pf()
+    sub_network = network.sub_networks.obj.iat[0]
+    sub_network.update_branches([outage], in_service=False)
+
+    #the seed, the fast-decoupled load flow and the later power flows
+    #all use the updated matrices
+    for kwargs in [dict(use_seed="lpf"), dict(), dict(solver_options=dict(method="fdlf")), dict()]:
+        network.pf(skip_pre=True, **kwargs)
+        np.testing.assert_array_almost_equal(network.buses_t.v_ang.loc[network.now, v_ang_r.index], v_ang_r)
+
+    network.lpf(skip_pre=True)
+    np.testing.assert_array_almost_equal(network.lines_t.p0.loc[network.now, p0.index], p0)
+    assert network.lines_t.p0.at[network.now, outage[1]] == 0.
+
+
+if __name__ == "__main__":
+    test_pypower_case()
+    test_pf_batches()
+    test_pf_deduplicate()
+    test_pf_convergence()
+    test_pf_step_control()
+    test_pf_q_limits()
+    test_pf_auto_sweep()
+    test_update_branches_pf()